@@ -1,51 +1,339 @@
 import os
+import io
+import time
+import asyncio
+import random
 import base64
 import json
 import logging
-from dotenv import load_dotenv
-from openai import OpenAI
-from typing import Tuple
-import pytesseract
-from PIL import Image
-
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY") or exit("OPENAI_API_KEY missing"))
+import threading
+from typing import Callable, Tuple
+from PIL import Image, ImageChops, ImageOps, ImageStat
+import extraction_cache
+import ocr_service
+from circuit_breaker import CircuitBreaker
+from db import connection
+from metrics import Counter, Gauge, Histogram
 
 # Logger setup
 logger = logging.getLogger("ai_service")
 logger.setLevel(logging.INFO)
 
-# Tesseract path (Windows only - change if installed elsewhere)
-TESSERACT_PATH = os.getenv("TESSERACT_PATH", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
-if os.path.exists(TESSERACT_PATH):
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
+# ---------- OpenAI clients ----------
+# Created on first use in each process: importing openai is slow, and HTTP
+# connection pools must not be shared with processes forked after creation.
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def vision_configured() -> bool:
+    """Without an API key uploads go straight to OCR."""
+    return bool(os.getenv("OPENAI_API_KEY"))
+
+
+def _client_options() -> dict:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY missing")
+    # Retries are handled by _create_completion (jittered backoff within a deadline).
+    # OPENAI_BASE_URL points the client at any OpenAI-compatible server, e.g. a local fake.
+    return {"api_key": api_key, "base_url": os.getenv("OPENAI_BASE_URL") or None, "max_retries": 0}
+
+
+def get_client():
+    """This process's OpenAI client."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI(**_client_options())
+        return _client
+
+
+def get_async_client():
+    """This process's AsyncOpenAI client; used only from the asyncio job runner's event loop (JOB_MODE=async)."""
+    global _async_client
+    with _client_lock:
+        if _async_client is None:
+            from openai import AsyncOpenAI
+            _async_client = AsyncOpenAI(**_client_options())
+        return _async_client
+
+
+def _reset_clients():
+    global _client, _async_client, _client_lock
+    _client = _async_client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_clients)
+
+# Model and prompts; all of them are part of the extraction cache key
+MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+SYS_PROMPT = (
+    "Extract all text from the image and create a short (3-8 words) descriptive title. "
+    "Never use 'Untitled' or 'None' as the title; describe the image if it has no text."
+)
+
+# Strict structured output: one request returns both title and text
+EXTRACTION_SCHEMA = {
+    "name": "document_extraction",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string", "description": "Short (3-8 words) descriptive title"},
+            "text": {"type": "string", "description": "All text in the image, in reading order"},
+        },
+        "required": ["title", "text"],
+        "additionalProperties": False,
+    },
+}
+
+# Per-request budget defaults (overridable per call)
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "4096"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_IMAGE_DETAIL = os.getenv("OPENAI_IMAGE_DETAIL", "high")  # low, high or auto
+OPENAI_DEADLINE = float(os.getenv("OPENAI_DEADLINE", "120"))  # total seconds across retries
+
+# Retry policy for 429/5xx/connection errors
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))
+
+# While open, uploads go straight to OCR
+vision_breaker = CircuitBreaker(
+    "openai-vision",
+    failure_threshold=int(os.getenv("AI_BREAKER_FAILURES", "5")),
+    cooldown=float(os.getenv("AI_BREAKER_COOLDOWN", "30")),
+)
+Gauge("vision_circuit_open", "1 while the Vision circuit breaker is not closed",
+      collect=lambda: int(vision_breaker.snapshot()["state"] != "closed"))
+
+# Image preprocessing: gpt-4o high detail fits images into 2048x2048 anyway
+IMAGE_MAX_DIM = int(os.getenv("IMAGE_MAX_DIM", "2048"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()  # JPEG or WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "1") == "1"
+PREPROCESS_VERSION = f"{IMAGE_MAX_DIM}:{IMAGE_FORMAT}:{IMAGE_QUALITY}:{int(IMAGE_GRAYSCALE)}"
 
 # ---------- Helper Functions ----------
-def image_to_base64(path: str) -> str:
-    """Convert image to Base64 string."""
-    with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode()
+# Multiple of 3 so chunks encode to Base64 without padding in between
+B64_CHUNK_SIZE = 3 * 64 * 1024
+
+def _b64_stream(f) -> str:
+    """Base64-encode a binary stream chunk by chunk (never holds the raw bytes and the encoding together)."""
+    return "".join(base64.b64encode(chunk).decode() for chunk in iter(lambda: f.read(B64_CHUNK_SIZE), b""))
+
+def _is_grayscale(img: Image.Image, tolerance: float = 4.0) -> bool:
+    """True if the colour channels are (almost) identical, e.g. scans of black-on-white paper."""
+    r, g, b = img.convert("RGB").resize((64, 64)).split()
+    spread = ImageStat.Stat(ImageChops.difference(r, g)).mean[0] + ImageStat.Stat(ImageChops.difference(g, b)).mean[0]
+    return spread <= tolerance
+
+def preprocess_image(path: str) -> Image.Image:
+    """
+    Normalize an upload before Vision/OCR: first frame only, EXIF orientation applied,
+    transparency flattened on white, grayscale if colourless, downscaled to IMAGE_MAX_DIM.
+    """
+    with Image.open(path) as src:
+        src.seek(0)  # first frame of animated GIFs
+        img = ImageOps.exif_transpose(src)
+        img.load()
+
+    if img.mode in ("P", "LA", "RGBA") or "transparency" in img.info:
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, "white")
+        img.paste(rgba, mask=rgba.split()[-1])
+    elif img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    if IMAGE_GRAYSCALE and img.mode != "L" and _is_grayscale(img):
+        img = img.convert("L")
+
+    img.thumbnail((IMAGE_MAX_DIM, IMAGE_MAX_DIM), Image.LANCZOS)
+    return img
+
+def encode_image(img: Image.Image) -> Tuple[str, str]:
+    """Re-encode a preprocessed image; returns (base64 data, MIME type)."""
+    fmt = "WEBP" if IMAGE_FORMAT == "WEBP" else "JPEG"
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=IMAGE_QUALITY, optimize=fmt == "JPEG")
+    buf.seek(0)
+    return _b64_stream(buf), f"image/{fmt.lower()}"
 
 def _strip_code_fence(s: str) -> str:
     return s.strip("` \n")
 
 def _parse_json(s: str) -> dict:
-    """Parse JSON safely from AI output."""
-    s = _strip_code_fence(s)
+    """Parse the structured-output JSON; {} if the response was cut off or malformed."""
     try:
-        return json.loads(s)
-    except:
-        start, depth, in_str, esc = s.find("{"), 0, False, False
-        for i, ch in enumerate(s[start:], start):
-            if ch == '"' and not esc:
-                in_str = not in_str
-            esc = ch == "\\" and not esc
-            if not in_str:
-                depth += ch == "{"
-                depth -= ch == "}"
-                if depth == 0:
-                    return json.loads(s[start:i+1])
+        data = json.loads(_strip_code_fence(s or ""))
+    except ValueError:
         return {}
+    return data if isinstance(data, dict) else {}
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+class _StreamedField:
+    """
+    Decodes one string field of a JSON object while the object arrives in pieces,
+    so the text of a streamed structured-output response can be shown before the
+    response is complete. Understands flat objects of strings (EXTRACTION_SCHEMA).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._pending = ""      # undecoded input: an escape sequence cut in half
+        self._in_string = False
+        self._is_value = False  # a ':' was seen, so the next string is a value
+        self._chars = []        # the key being read
+        self._key = None        # key of the value being read
+
+    def feed(self, chunk: str) -> str:
+        """Newly decoded characters of the field."""
+        buf, out, i = self._pending + chunk, [], 0
+        while i < len(buf):
+            c, step = buf[i], 1
+            if not self._in_string:
+                if c == '"':
+                    self._in_string = True
+                    self._chars = []
+                elif c == ":":
+                    self._is_value = True
+                elif c in ",{":
+                    self._is_value = False
+                i += 1
+                continue
+            if c == '"':
+                self._in_string = False
+                if not self._is_value:
+                    self._key = "".join(self._chars)
+                i += 1
+                continue
+            if c == "\\":
+                if i + 2 > len(buf):
+                    break
+                if buf[i + 1] != "u":
+                    c, step = _ESCAPES.get(buf[i + 1], buf[i + 1]), 2
+                else:
+                    if i + 6 > len(buf):
+                        break
+                    try:
+                        code = int(buf[i + 2:i + 6], 16)
+                    except ValueError:
+                        code = 0xFFFD
+                    c, step = chr(code), 6
+                    if 0xD800 <= code < 0xDC00:  # high surrogate; the low half follows
+                        if i + 12 > len(buf):
+                            break
+                        try:
+                            low = int(buf[i + 8:i + 12], 16) if buf[i + 6:i + 8] == "\\u" else -1
+                        except ValueError:
+                            low = -1
+                        if 0xDC00 <= low < 0xE000:
+                            c, step = chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)), 12
+            if not self._is_value:
+                self._chars.append(c)
+            elif self._key == self.name:
+                out.append(c)
+            i += step
+        self._pending = buf[i:]
+        return "".join(out)
+
+def _is_transient(e: Exception) -> bool:
+    """Errors worth retrying and counting against the circuit breaker."""
+    import openai
+    if isinstance(e, (openai.APIConnectionError, TimeoutError)):  # includes APITimeoutError
+        return True
+    return isinstance(e, openai.APIStatusError) and (e.status_code == 429 or e.status_code >= 500)
+
+def _backoff_delay(attempt: int, e: Exception) -> float:
+    """Full-jitter exponential backoff; honours Retry-After on 429s."""
+    import openai
+    delay = random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+    if isinstance(e, openai.APIStatusError) and e.status_code == 429:
+        try:
+            delay = max(delay, float(e.response.headers.get("retry-after", 0)))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+def _create_completion(deadline: float, timeout: float, **kwargs):
+    """chat.completions.create with retries on transient errors, bounded by `deadline` (monotonic)."""
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Vision request deadline exceeded")
+        try:
+            return get_client().chat.completions.create(timeout=min(timeout, remaining), **kwargs)
+        except Exception as e:
+            if not _is_transient(e) or attempt >= OPENAI_MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt, e)
+            if time.monotonic() + delay >= deadline:
+                raise
+            attempt += 1
+            logger.warning(f"Vision call failed ({e}); retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+
+async def _create_completion_async(deadline: float, timeout: float, **kwargs):
+    """Async counterpart of _create_completion (same retry policy, non-blocking sleeps)."""
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Vision request deadline exceeded")
+        try:
+            return await get_async_client().chat.completions.create(timeout=min(timeout, remaining), **kwargs)
+        except Exception as e:
+            if not _is_transient(e) or attempt >= OPENAI_MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt, e)
+            if time.monotonic() + delay >= deadline:
+                raise
+            attempt += 1
+            logger.warning(f"Vision call failed ({e}); retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+# Metrics (see /metrics); the OCR fallback rate is extractions_total{source="ocr"} over the total
+vision_requests = Counter("vision_requests_total", "Vision calls by outcome (ok, error, circuit_open, disabled)", ["outcome"])
+vision_seconds = Histogram("vision_request_duration_seconds", "Vision call latency including retries", ["outcome"])
+vision_tokens = Counter("vision_tokens_total", "Tokens used by Vision calls", ["kind"])
+extractions = Counter("extractions_total", "Extractions by where the text came from (cache, vision, ocr, none)", ["source"])
+vision_first_text_seconds = Histogram("vision_first_text_seconds", "Time until a streamed Vision call yields its first text")
+ocr_seconds = Histogram("ocr_duration_seconds", "Tesseract fallback duration", ["outcome"])
+
+def _record_call(content_hash: str, detail: str, latency_ms: int, usage=None, error: str = None,
+                 doc_id: int = None, job_id: int = None):
+    """
+    Store token usage and latency of one Vision call. doc_id/job_id attribute it to the
+    upload that paid for it; content_hash alone is shared by deduplicated copies.
+    """
+    outcome = "error" if error else "ok"
+    vision_requests.inc(outcome=outcome)
+    vision_seconds.observe(latency_ms / 1000, outcome=outcome)
+    if usage is not None:
+        vision_tokens.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+        vision_tokens.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+    try:
+        with connection() as conn:
+            conn.execute("""
+                INSERT INTO ai_calls (content_hash, doc_id, job_id, model, detail, prompt_tokens,
+                                      completion_tokens, total_tokens, latency_ms, status, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                content_hash, doc_id, job_id, MODEL, detail,
+                getattr(usage, "prompt_tokens", None),
+                getattr(usage, "completion_tokens", None),
+                getattr(usage, "total_tokens", None),
+                latency_ms, "error" if error else "ok", error,
+            ))
+    except Exception as e:
+        logger.error(f"Failed to record AI call: {e}")
 
 def _title_from_text(text: str) -> str:
     """Generate title from extracted text."""
@@ -54,71 +342,240 @@ def _title_from_text(text: str) -> str:
             return " ".join(line.split()[:6]).rstrip(",:;.").title()
     return "Image (no text)"
 
-def _ocr_fallback(path: str) -> str:
-    """Extract text using Tesseract OCR."""
+def _ocr_fallback(img) -> str:
+    """Extract text using Tesseract OCR (accepts a path or a preprocessed image)."""
+    started = time.perf_counter()
     try:
-        img = Image.open(path)
-        return pytesseract.image_to_string(img)
+        if isinstance(img, str):
+            img = preprocess_image(img)
+        text = ocr_service.ocr_image(img)
+        ocr_seconds.observe(time.perf_counter() - started, outcome="ok" if text.strip() else "empty")
+        return text
     except Exception as e:
+        ocr_seconds.observe(time.perf_counter() - started, outcome="error")
         logger.error(f"OCR failed: {e}")
         return ""
 
-# ---------- Main Processing Function ----------
-def process_image_with_ai(path: str) -> Tuple[str, str]:
-    """
-    Process an image to extract text and generate a title.
-    1. Try OpenAI Vision API first
-    2. Fallback to Tesseract OCR if OpenAI fails or text is empty
-    """
-    b64 = image_to_base64(path)
-    sys_prompt = (
-        "Extract all text from the image and create a short (3-8 words) descriptive title. "
-        "Reply in JSON: {\"title\":\"...\",\"text\":\"...\"}, no 'Untitled'."
+def _cache_key(content_hash: str, detail: str) -> str:
+    return extraction_cache.cache_key(
+        content_hash, MODEL, SYS_PROMPT, json.dumps(EXTRACTION_SCHEMA), detail, PREPROCESS_VERSION
     )
+
+def _vision_request(img: Image.Image, detail: str, max_tokens: int = None, stream: bool = False) -> dict:
+    """Keyword arguments for the structured-output Vision request."""
+    b64, mime = encode_image(img)
     user_content = [
         {"type": "text", "text": "Return JSON with title and text."},
-        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}}
+        {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}", "detail": detail}}
     ]
+    return dict(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": SYS_PROMPT},
+            {"role": "user", "content": user_content}
+        ],
+        response_format={"type": "json_schema", "json_schema": EXTRACTION_SCHEMA},
+        temperature=0.0,
+        max_tokens=max_tokens or OPENAI_MAX_TOKENS,
+        # A streamed answer reports its token usage in a final chunk
+        **({"stream": True, "stream_options": {"include_usage": True}} if stream else {})
+    )
 
-    title, text = "", ""
+class _StreamReader:
+    """
+    Collects a streamed Vision answer chunk by chunk and forwards the growing "text"
+    field to on_event as ("text", {"delta": ...}) events.
+    """
 
-    # Step 1: Try OpenAI Vision API
-    try:
-        resp = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": user_content}
-            ],
-            temperature=0.0
-        )
-        data = _parse_json(resp.choices[0].message.content)
-        title = (data.get("title") or "").strip()
-        text = (data.get("text") or "").strip()
-
-        # If AI gave no title, try generating again
-        if not title or title.lower() in {"untitled", "none"}:
-            resp2 = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "Give only a short (3-8 words) descriptive title."},
-                    {"role": "user", "content": user_content}
-                ],
-                temperature=0.0,
-                max_tokens=40
-            )
-            title = _strip_code_fence(resp2.choices[0].message.content.strip())
+    def __init__(self, on_event: Callable[[str, dict], None], started: float):
+        self.on_event = on_event
+        self.started = started
+        self.field = _StreamedField("text")
+        self.parts, self.finish_reason, self.usage = [], None, None
 
-    except Exception as e:
-        logger.error(f"AI processing failed: {e}")
+    def add(self, chunk):
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return
+        choice = chunk.choices[0]
+        self.finish_reason = choice.finish_reason or self.finish_reason
+        content = choice.delta.content if choice.delta else None
+        if not content:
+            return
+        self.parts.append(content)
+        delta = self.field.feed(content)
+        if delta:
+            if self.started is not None:
+                vision_first_text_seconds.observe(time.monotonic() - self.started)
+                self.started = None
+            self.on_event("text", {"delta": delta})
+
+    def result(self) -> Tuple[str, str, object]:
+        return "".join(self.parts), self.finish_reason, self.usage
+
+def _read_response(resp, on_event=None, started: float = None) -> Tuple[str, str, object]:
+    """(content, finish_reason, usage) of a Vision response; a stream is consumed here."""
+    if on_event is None:
+        choice = resp.choices[0]
+        return choice.message.content, choice.finish_reason, resp.usage
+    reader = _StreamReader(on_event, started)
+    for chunk in resp:
+        reader.add(chunk)
+    return reader.result()
+
+async def _read_response_async(resp, on_event=None, started: float = None) -> Tuple[str, str, object]:
+    """_read_response for the async client's streams."""
+    if on_event is None:
+        return _read_response(resp)
+    reader = _StreamReader(on_event, started)
+    async for chunk in resp:
+        reader.add(chunk)
+    return reader.result()
+
+def _vision_result(content: str, finish_reason: str) -> Tuple[str, str]:
+    """(title, text) from a Vision answer."""
+    if finish_reason == "length":
+        logger.warning("AI response hit max_tokens; output truncated")
+    data = _parse_json(content)
+    title = (data.get("title") or "").strip()
+    text = (data.get("text") or "").strip()
+    if title.lower() in {"untitled", "none"}:
+        title = ""
+    return title, text
+
+def _vision_failed(e: Exception, content_hash: str, detail: str, started: float, doc_id: int = None, job_id: int = None):
+    # Only provider-side trouble counts; a rejected request still proves the API is up
+    if _is_transient(e):
+        vision_breaker.record_failure()
+    else:
+        vision_breaker.record_success()
+    _record_call(content_hash, detail, int((time.monotonic() - started) * 1000), error=str(e),
+                 doc_id=doc_id, job_id=job_id)
+    logger.error(f"AI processing failed: {e}")
+
+def _finish(key: str, content_hash: str, img: Image.Image, title: str, text: str,
+            on_event: Callable[[str, dict], None] = None) -> Tuple[str, str, str]:
+    """Cache a Vision result, or fall back to OCR, and make sure there is a title."""
+    # Only Vision results are cached; OCR fallbacks should be retried against the API
+    if text.strip():
+        title = title or _title_from_text(text)
+        extraction_cache.put(key, content_hash, title, text)
+        source = "vision"
 
     # Step 2: If AI failed or returned no text, fallback to OCR
-    if not text.strip():
+    else:
         logger.info("Falling back to OCR...")
-        text = _ocr_fallback(path)
+        if on_event:
+            on_event("fallback", {"source": "ocr"})
+        text = _ocr_fallback(img)
+        source = "ocr" if text.strip() else "none"
+        if on_event and text.strip():
+            on_event("text", {"delta": text})
+    extractions.inc(source=source)
 
     # Step 3: If still no title, generate from text
     if not title.strip():
         title = _title_from_text(text)
 
-    return title or "Image (no title)", text or ""
\ No newline at end of file
+    return title or "Image (no title)", text or "", source
+
+# ---------- Main Processing Function ----------
+def process_image_with_ai(path: str, content_hash: str = None, detail: str = None,
+                          max_tokens: int = None, timeout: float = None,
+                          on_event: Callable[[str, dict], None] = None,
+                          doc_id: int = None, job_id: int = None) -> Tuple[str, str, str]:
+    """
+    Process an image to extract text and generate a title. Returns (title, text, source),
+    source being "vision" (also for cached results), "ocr" or "none".
+    0. Reuse a cached result for identical image bytes (same model and prompts)
+    1. Try OpenAI Vision API first (one structured-output request)
+    2. Fallback to Tesseract OCR if OpenAI fails or text is empty
+    `detail`, `max_tokens` and `timeout` override the OPENAI_* defaults for this call.
+    With `on_event` the Vision answer is streamed and its text passed on as it arrives,
+    as are the OCR fallback and cached results (see job_events.py for the events).
+    `doc_id` and `job_id` are recorded with the call's usage in ai_calls.
+    """
+    detail = detail or OPENAI_IMAGE_DETAIL
+    content_hash = content_hash or extraction_cache.file_sha256(path)
+    key = _cache_key(content_hash, detail)
+    cached = extraction_cache.get(key)
+    if cached:
+        logger.info("Extraction cache hit")
+        extractions.inc(source="cache")
+        if on_event:
+            on_event("text", {"delta": cached[1]})
+        return (*cached, "vision")
+
+    # One normalized image feeds both the Vision call and the OCR fallback
+    img = preprocess_image(path)
+    title, text = "", ""
+
+    # Step 1: Try OpenAI Vision API (skipped without an API key or while the circuit breaker is open)
+    if not vision_configured():
+        vision_requests.inc(outcome="disabled")
+    elif vision_breaker.allow():
+        started = time.monotonic()
+        try:
+            resp = _create_completion(
+                started + OPENAI_DEADLINE,
+                timeout or OPENAI_TIMEOUT,
+                **_vision_request(img, detail, max_tokens, stream=on_event is not None)
+            )
+            content, finish_reason, usage = _read_response(resp, on_event, started)
+            vision_breaker.record_success()
+            _record_call(content_hash, detail, int((time.monotonic() - started) * 1000), usage,
+                         doc_id=doc_id, job_id=job_id)
+            title, text = _vision_result(content, finish_reason)
+        except Exception as e:
+            _vision_failed(e, content_hash, detail, started, doc_id, job_id)
+    else:
+        logger.info("Vision circuit open, skipping AI")
+        vision_requests.inc(outcome="circuit_open")
+
+    return _finish(key, content_hash, img, title, text, on_event)
+
+async def process_image_with_ai_async(path: str, content_hash: str = None, detail: str = None,
+                                      max_tokens: int = None, timeout: float = None,
+                                      on_event: Callable[[str, dict], None] = None,
+                                      doc_id: int = None, job_id: int = None) -> Tuple[str, str, str]:
+    """
+    Coroutine version of process_image_with_ai for the asyncio job runner.
+    The Vision call uses the async client; file, SQLite, Pillow and Tesseract
+    work runs in the loop's executor, so the event loop never blocks.
+    """
+    detail = detail or OPENAI_IMAGE_DETAIL
+    content_hash = content_hash or await asyncio.to_thread(extraction_cache.file_sha256, path)
+    key = _cache_key(content_hash, detail)
+    cached = await asyncio.to_thread(extraction_cache.get, key)
+    if cached:
+        logger.info("Extraction cache hit")
+        extractions.inc(source="cache")
+        if on_event:
+            on_event("text", {"delta": cached[1]})
+        return (*cached, "vision")
+
+    img = await asyncio.to_thread(preprocess_image, path)
+    title, text = "", ""
+
+    if not vision_configured():
+        vision_requests.inc(outcome="disabled")
+    elif vision_breaker.allow():
+        started = time.monotonic()
+        try:
+            request_kwargs = await asyncio.to_thread(_vision_request, img, detail, max_tokens, on_event is not None)
+            resp = await _create_completion_async(started + OPENAI_DEADLINE, timeout or OPENAI_TIMEOUT, **request_kwargs)
+            content, finish_reason, usage = await _read_response_async(resp, on_event, started)
+            vision_breaker.record_success()
+            await asyncio.to_thread(
+                _record_call, content_hash, detail, int((time.monotonic() - started) * 1000), usage,
+                None, doc_id, job_id
+            )
+            title, text = _vision_result(content, finish_reason)
+        except Exception as e:
+            await asyncio.to_thread(_vision_failed, e, content_hash, detail, started, doc_id, job_id)
+    else:
+        logger.info("Vision circuit open, skipping AI")
+        vision_requests.inc(outcome="circuit_open")
+
+    return await asyncio.to_thread(_finish, key, content_hash, img, title, text, on_event)
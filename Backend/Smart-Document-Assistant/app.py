@@ -3,49 +3,254 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent))
 import os
 import time
+import uuid
+import logging
+import threading
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file
+from dotenv import load_dotenv
+load_dotenv()  # before the imports below read their settings from the environment
+from flask import Blueprint, Flask, Response, g, request, jsonify, make_response, send_file
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
-from db import get_conn, init_db
-from ai_service import process_image_with_ai
-from flasgger import Swagger
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from db import connection, init_db, fts_match_query, make_preview
+from jobs import enqueue_document, resume_pending_jobs, extract_many, store_pages
+import extraction_cache
+import derivatives
+import paged_files
+import semantic_index
+import metadata_cache
+import file_gc
+import storage
+import text_store
+import job_events
+from ai_service import vision_breaker
+import metrics
+import profiling
+from log_config import configure_logging, request_id
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
 import hashlib
+import base64
+import io
+import json
+import zipfile
 
-app = Flask(__name__)
-CORS(app)
-swagger = Swagger(app)
+logger = logging.getLogger("app")
+logger.setLevel(logging.INFO)
 
-# JWT Configuration
-app.config['JWT_SECRET_KEY'] = 'smart-document-assistant-secret-key'  # Change this in production!
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
-app.config['PROPAGATE_EXCEPTIONS'] = True  # Propagate JWT exceptions to see them in the logs
-jwt = JWTManager(app)
+# Routes and request hooks live on this blueprint; create_app() builds the application
+api = Blueprint("api", __name__)
+
+# JWT callbacks are registered here and bound to the app in create_app()
+jwt = JWTManager()
+
+# Serve /apidocs (flasgger builds the spec from the route docstrings)
+SWAGGER_UI = os.getenv("SWAGGER_UI", "1") == "1"
 
 # Custom error handler for JWT errors
 @jwt.invalid_token_loader
 def invalid_token_callback(error_string):
-    print(f"Invalid token: {error_string}")
+    logger.warning("Invalid token: %s", error_string)
     return jsonify({"error": f"Invalid token: {error_string}"}), 401
 
+# With a shared cache (CACHE_BACKEND=redis) user rows are cached, so tokens of
+# deleted accounts can be refused at no cost; otherwise the reads' deleted_at
+# filters keep their documents hidden
+@jwt.token_in_blocklist_loader
+def token_in_blocklist_callback(jwt_header, jwt_payload):
+    if not metadata_cache.get_backend().shared:
+        return False
+    user_id = jwt_payload["sub"]
+    return metadata_cache.user(user_id, lambda: _load_user(user_id)) is None
+
+@jwt.revoked_token_loader
+def revoked_token_callback(jwt_header, jwt_payload):
+    logger.warning("Revoked token for user %s", jwt_payload.get("sub"))
+    return jsonify({"error": "Token has been revoked"}), 401
+
 @jwt.unauthorized_loader
 def unauthorized_callback(error_string):
-    print(f"Missing Authorization header: {error_string}")
+    logger.warning("Missing Authorization header: %s", error_string)
     return jsonify({"error": f"Missing Authorization header: {error_string}"}), 401
 
-# Configure upload folder and allowed extensions
-UPLOAD_FOLDER = Path("uploads")
-ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
+# ------------------------
+# Request metrics, access log and profiling
+# ------------------------
+http_requests = metrics.Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+http_seconds = metrics.Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"])
+http_db_queries = metrics.Histogram("http_request_db_queries", "SQL statements executed per request",
+                                    ["route"], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500))
+
+@api.before_app_request
+def _start_request():
+    if _background_pid != os.getpid():
+        start_background()
+    g.started = time.perf_counter()
+    g.db_stats = {"queries": 0, "seconds": 0.0}
+    g.context_tokens = (
+        request_id.set(request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]),
+        metrics.request_stats.set(g.db_stats),
+    )
+    g.profile = profiling.start(request.headers)
+
+@api.after_app_request
+def _finish_request(response):
+    if "started" not in g:
+        return response
+    elapsed = time.perf_counter() - g.started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    http_requests.inc(method=request.method, route=route, status=response.status_code)
+    http_seconds.observe(elapsed, method=request.method, route=route)
+    http_db_queries.observe(g.db_stats["queries"], route=route)
+    response.headers["X-Request-ID"] = request_id.get()
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("request", extra={
+            "method": request.method, "route": route, "status": response.status_code,
+            "duration_ms": round(elapsed * 1000, 2), "db_queries": g.db_stats["queries"],
+            "db_ms": round(g.db_stats["seconds"] * 1000, 2),
+        })
+    return response
+
+@api.teardown_app_request
+def _end_request(exc):
+    # Here rather than in after_request, which is skipped when a view raises
+    profile = g.pop("profile", None)
+    if profile:
+        profile.stop()
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        label = f"{request.method}{route}".replace("/", "_").replace("<", "").replace(">", "")
+        profile.dump(label, (time.perf_counter() - g.started) * 1000)
+    tokens = g.pop("context_tokens", None)
+    if tokens:
+        request_id.reset(tokens[0])
+        metrics.request_stats.reset(tokens[1])
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
+# Configure upload folder and allowed extensions
+UPLOAD_FOLDER = storage.STORAGE_ROOT
+# Multi-page formats (PDF, TIFF) are split into pages; see paged_files.py
+ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"} | paged_files.supported_extensions()
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "500"))
+# Request body caps, enforced by Werkzeug while it reads the body (413): MAX_REQUEST_BYTES
+# app-wide (batches), MAX_UPLOAD_BYTES plus multipart slack for /api/upload. Batch files are
+# checked against MAX_UPLOAD_BYTES one by one in _save_upload.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "20")) * 1024 * 1024
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_MB", "512")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "200"))
+THUMBNAIL_MAX_AGE = int(os.getenv("THUMBNAIL_MAX_AGE", str(365 * 24 * 3600)))
+# Semantic/hybrid search: candidates taken from each ranking, and the semantic weight in hybrid scores
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "200"))
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))
+
+# Columns selectable through /api/documents?fields=...
+DOCUMENT_FIELDS = {
+    "doc_id", "user_id", "title", "file_path", "extracted_text", "upload_date",
+    "status", "content_hash", "text_preview", "extraction_source"
+}
+DOCUMENT_SUMMARY_FIELDS = ["doc_id", "title", "upload_date", "status", "text_preview"]
+
+
+def _conditional(user_id, build):
+    """
+    Serve a per-user read with an ETag derived from the version of the user's documents.
+    A matching If-None-Match gets a 304 without loading or serializing anything;
+    otherwise build(version) makes the response.
+    """
+    version = metadata_cache.docs_version(user_id)
+    etag = metadata_cache.etag(user_id, version, request.full_path)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = build(version)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Authorization")
+    return response
+
+def _load_user(user_id):
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        row = cur.fetchone()
+    return dict(row) if row else None
 
 def allowed_file(filename):
     """Check if uploaded file has allowed extension."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _save_upload(file):
+    """
+    Copy an uploaded file into storage's temp area and return (temp path, storage key, sha256).
+    Werkzeug has already spooled the body while parsing the form, so this is a second copy
+    (hashed on the way), not a memory saving; oversized requests are refused before that.
+    """
+    def chunks():
+        size = 0
+        for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b""):
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise RequestEntityTooLarge(f"file exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+            yield chunk
+
+    tmp_path, content_hash = storage.save_temp(chunks(), file.filename)
+    return tmp_path, storage.object_key(content_hash, file.filename), content_hash
+
+def _publish_upload(tmp_path, key, doc_id):
+    """
+    Store an upload's file once its row is committed (so the collector cannot remove
+    the same content in between, see storage.py). Removes the row if that fails.
+    """
+    try:
+        storage.publish(tmp_path, key)
+    except Exception:
+        with connection() as conn:
+            conn.execute("DELETE FROM documents WHERE doc_id=?", (doc_id,))
+        raise
+
+def _encode_cursor(upload_date, doc_id):
+    """Opaque keyset pagination cursor for (upload_date, doc_id)."""
+    return base64.urlsafe_b64encode(f"{upload_date}|{doc_id}".encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        upload_date, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return upload_date, int(doc_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+def _safe_title(title, doc_id):
+    """Clean a document title for use as a file name."""
+    safe = "".join(c for c in (title or "") if c.isalnum() or c in (' ', '-', '_')).strip()
+    return safe or f"document_{doc_id}"
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, unseekable buffer that zipfile writes into; drained after every entry/chunk."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _int_arg(name, default, maximum=None):
+    """Read a non-negative integer query parameter, clamped to `maximum`."""
+    try:
+        value = max(0, int(request.args.get(name, default)))
+    except (TypeError, ValueError):
+        value = default
+    return min(value, maximum) if maximum is not None else value
+
 # ------------------------
 # Auth Routes
 # ------------------------
@@ -54,7 +259,7 @@ def allowed_file(filename):
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-@app.route("/api/auth/register", methods=["POST"])
+@api.route("/api/auth/register", methods=["POST"])
 def api_register():
     """
     Register a new user
@@ -112,33 +317,31 @@ def api_register():
         if not email or '@' not in email:
             return jsonify({"error": "Valid email is required"}), 400
 
-        # Check if username or email already exists
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE username = ? OR email = ?", (username, email))
-        existing_user = cur.fetchone()
-        
-        if existing_user:
-            conn.close()
-            return jsonify({"error": "Username or email already exists"}), 400
+        with connection() as conn:
+            cur = conn.cursor()
 
-        # Hash the password
-        hashed_password = hash_password(password)
-        
-        # Insert the new user
-        cur.execute(
-            "INSERT INTO users (username, password, email) VALUES (?, ?, ?)", 
-            (username, hashed_password, email)
-        )
-        conn.commit()
-        user_id = cur.lastrowid
-        conn.close()
+            # Check if username or email already exists
+            cur.execute("SELECT * FROM users WHERE username = ? OR email = ?", (username, email))
+            existing_user = cur.fetchone()
+
+            if existing_user:
+                return jsonify({"error": "Username or email already exists"}), 400
+
+            # Hash the password
+            hashed_password = hash_password(password)
+
+            # Insert the new user
+            cur.execute(
+                "INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
+                (username, hashed_password, email)
+            )
+            user_id = cur.lastrowid
 
         return jsonify({"message": "User registered successfully", "user_id": user_id}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route("/api/auth/login", methods=["POST"])
+@api.route("/api/auth/login", methods=["POST"])
 def api_login():
     """
     Login a user
@@ -188,14 +391,13 @@ def api_login():
         hashed_password = hash_password(password)
         
         # Check credentials
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT * FROM users WHERE username = ? AND password = ?", 
-            (username, hashed_password)
-        )
-        user = cur.fetchone()
-        conn.close()
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT * FROM users WHERE username = ? AND password = ?",
+                (username, hashed_password)
+            )
+            user = cur.fetchone()
         
         if not user:
             return jsonify({"error": "Invalid username or password"}), 401
@@ -216,7 +418,7 @@ def api_login():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route("/api/auth/profile", methods=["GET"])
+@api.route("/api/auth/profile", methods=["GET"])
 @jwt_required()
 def api_profile():
     """Get current user profile from JWT token."""
@@ -224,12 +426,8 @@ def api_profile():
         # Get user_id from token - now it's just a string
         user_id = get_jwt_identity()
         
-        # Get user data from database
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        user = cur.fetchone()
-        conn.close()
+        # Get user data (cached; the frontend fetches it on every page load)
+        user = metadata_cache.user(user_id, lambda: _load_user(user_id))
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -237,17 +435,17 @@ def api_profile():
         return jsonify({
             "user_id": user["user_id"],
             "username": user["username"],
-            "email": user["email"] if "email" in user else None
+            "email": user.get("email")
         }), 200
     except Exception as e:
-        print(f"Error in api_profile: {str(e)}")
+        logger.exception("Error in api_profile")
         return jsonify({"error": str(e)}), 500
 
 # ------------------------
 # User Routes
 # ------------------------
 
-@app.route("/api/users", methods=["POST"])
+@api.route("/api/users", methods=["POST"])
 def api_create_user():
     """
     Create a new user
@@ -288,12 +486,10 @@ def api_create_user():
         if not username or not (3 <= len(username) <= 20) or not username.isalnum():
             return jsonify({"error": "Invalid username (3-20 alphanumeric)"}), 400
 
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("INSERT INTO users (username) VALUES (?)", (username,))
-        conn.commit()
-        user_id = cur.lastrowid
-        conn.close()
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO users (username) VALUES (?)", (username,))
+            user_id = cur.lastrowid
 
         return jsonify({"message": "user created", "user_id": user_id}), 201
     except Exception as e:
@@ -301,42 +497,37 @@ def api_create_user():
 
 
 
-@app.route("/api/users", methods=["GET"])
+@api.route("/api/users", methods=["GET"])
 def api_get_users():
     """Get all users."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users")
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM users")
+        rows = cur.fetchall()
     return jsonify([dict(row) for row in rows]), 200
 
 
-@app.route("/api/users/<int:user_id>", methods=["GET"])
+@api.route("/api/users/<int:user_id>", methods=["GET"])
 def api_get_user(user_id):
     """Get specific user by ID."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
+    row = metadata_cache.user(user_id, lambda: _load_user(user_id))
 
     if not row:
         return jsonify({"error": "user not found"}), 404
 
-    return jsonify(dict(row)), 200
+    return jsonify(row), 200
 
 
-@app.route("/api/users/<int:user_id>", methods=["DELETE"])
+@api.route("/api/users/<int:user_id>", methods=["DELETE"])
 def api_delete_user(user_id):
-    """Delete user by ID (and their documents)."""
+    """Delete user by ID (and their documents; files are removed in the background)."""
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM documents WHERE user_id=?", (user_id,))
-        cur.execute("DELETE FROM users WHERE user_id=?", (user_id,))
-        conn.commit()
-        conn.close()
+        with connection() as conn:
+            cur = conn.cursor()
+            file_gc.queue_user_deletion(cur, user_id)
+            cur.execute("DELETE FROM users WHERE user_id=?", (user_id,))
+        file_gc.wake()
+        metadata_cache.invalidate_profile(user_id)
         return jsonify({"message": f"user {user_id} deleted"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -345,15 +536,19 @@ def api_delete_user(user_id):
 # Document Routes
 # ------------------------
 
-@app.route("/api/upload", methods=["POST"])
+@api.route("/api/upload", methods=["POST"])
 @jwt_required()
 def api_upload():
     try:
         # Get user_id from token - now it's just a string
         user_id = get_jwt_identity()
         
-        print(f"Upload request - JWT user: {user_id}")
-        
+        logger.debug("Upload request", extra={"user_id": user_id})
+
+        # Lower the body limit for this route before the form is parsed (1 MB slack for
+        # multipart overhead); Werkzeug checks it against Content-Length and while reading
+        request.max_content_length = MAX_UPLOAD_BYTES + 1024 * 1024
+
         title = request.form.get("title", "").strip()
         file = request.files.get("file")
 
@@ -362,202 +557,755 @@ def api_upload():
         if not allowed_file(file.filename):
             return jsonify({"error": "invalid file type"}), 400
 
-        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        dest_dir = UPLOAD_FOLDER / today
-        dest_dir.mkdir(parents=True, exist_ok=True)
-
         filename = secure_filename(file.filename)
-        save_path = dest_dir / f"{user_id}{int(datetime.now(timezone.utc).timestamp())}{filename}"
-        file.save(str(save_path))
-
-        # Process image with OpenAI — get title & text
-        ai_title, extracted_text = process_image_with_ai(str(save_path))
-        if not title:  # Use AI-generated title if not provided
-            title = ai_title
+        tmp_path, key, content_hash = _save_upload(file)
 
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO documents (user_id, title, file_path, extracted_text)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, title, str(save_path), extracted_text))
-        conn.commit()
-        doc_id = cur.lastrowid
-        conn.close()
+        try:
+            # Store the document right away; the AI/OCR step runs in the worker pool
+            placeholder_title = title or Path(filename).stem
+            with connection() as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    INSERT INTO documents (user_id, title, file_path, status, content_hash)
+                    VALUES (?, ?, ?, 'pending', ?)
+                """, (user_id, placeholder_title, key, content_hash))
+                doc_id = cur.lastrowid
+            _publish_upload(tmp_path, key, doc_id)
+        finally:
+            storage.discard(tmp_path)
+
+        job_id = enqueue_document(doc_id, user_id, title)
+        derivatives.schedule(key, content_hash)
 
         return jsonify({
             "doc_id": doc_id,
-            "message": "File uploaded and processed successfully",
-            "title": title,
-            "extracted_text": extracted_text
-        }), 201
+            "job_id": job_id,
+            "status": "pending",
+            "message": "File uploaded, processing started",
+            "title": placeholder_title
+        }), 202
+
+    except RequestEntityTooLarge as e:
+        return jsonify({"error": f"File too large: {e.description}"}), 413
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/api/upload/batch", methods=["POST"])
+@jwt_required()
+def api_upload_batch():
+    """
+    Upload many files in one multipart request (field name `files`).
+    Files are processed concurrently (BATCH_CONCURRENCY) and all documents are
+    inserted in a single transaction. Returns per-file results; 207 on partial failure.
+    """
+    try:
+        user_id = get_jwt_identity()
+        files = [f for f in request.files.getlist("files") if f and f.filename]
+
+        if not files:
+            return jsonify({"error": "files required"}), 400
+        if len(files) > MAX_BATCH_FILES:
+            return jsonify({"error": f"at most {MAX_BATCH_FILES} files per batch"}), 400
 
+        logger.debug("Batch upload request", extra={"user_id": user_id, "files": len(files)})
+
+        # Save everything first; rejected files get an error entry and are skipped
+        results, saved = [], []
+        try:
+            for file in files:
+                entry = {"filename": file.filename}
+                results.append(entry)
+                if not allowed_file(file.filename):
+                    entry["error"] = "invalid file type"
+                    continue
+                try:
+                    tmp_path, key, content_hash = _save_upload(file)
+                except RequestEntityTooLarge as e:
+                    entry["error"] = f"file too large: {e.description}"
+                    continue
+                saved.append((entry, tmp_path, key, content_hash))
+
+            # Extraction reads the temp files; they are published after the insert
+            extractions = extract_many([(str(tmp_path), content_hash) for _, tmp_path, _, content_hash in saved])
+            stored = []
+
+            with connection() as conn:
+                cur = conn.cursor()
+                for (entry, tmp_path, key, content_hash), outcome in zip(saved, extractions):
+                    if isinstance(outcome, Exception):
+                        entry["error"] = f"processing failed: {outcome}"
+                        continue
+                    title, extracted_text, pages, source = outcome
+                    cur.execute("""
+                        INSERT INTO documents (user_id, title, file_path, status, content_hash, text_preview,
+                                               extraction_source)
+                        VALUES (?, ?, ?, 'done', ?, ?, ?)
+                    """, (user_id, title, key, content_hash, make_preview(extracted_text), source))
+                    doc_id = cur.lastrowid
+                    text_store.store(cur, doc_id, extracted_text)
+                    if pages:
+                        store_pages(cur, doc_id, pages)
+                    stored.append((entry, doc_id, tmp_path, key, content_hash, title, extracted_text))
+
+            published = []
+            for entry, doc_id, tmp_path, key, content_hash, title, extracted_text in stored:
+                try:
+                    _publish_upload(tmp_path, key, doc_id)
+                except Exception as e:
+                    entry["error"] = f"storing failed: {e}"
+                    continue
+                entry.update({
+                    "doc_id": doc_id,
+                    "title": title,
+                    "extracted_text": extracted_text,
+                    "status": "done"
+                })
+                published.append((doc_id, key, content_hash, extracted_text))
+        finally:
+            for _, tmp_path, _, _ in saved:
+                storage.discard(tmp_path)
+
+        for doc_id, key, content_hash, extracted_text in published:
+            derivatives.schedule(key, content_hash)
+            semantic_index.schedule(doc_id, user_id, extracted_text)
+
+        failed = sum(1 for entry in results if "error" in entry)
+        status_code = 201 if failed == 0 else 207 if failed < len(results) else 422
+        return jsonify({
+            "uploaded": len(results) - failed,
+            "failed": failed,
+            "results": results
+        }), status_code
+
+    except RequestEntityTooLarge as e:
+        return jsonify({"error": f"Request too large: {e.description}"}), 413
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/document/<int:doc_id>", methods=["GET"])
+@api.route("/api/jobs/<int:job_id>", methods=["GET"])
+@jwt_required()
+def api_job(job_id):
+    """Get the processing status of an upload job (and its result once done)."""
+    user_id = int(get_jwt_identity())
+
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT j.job_id, j.doc_id, j.status, j.error, j.created_at, j.updated_at,
+                   d.title, t.codec, t.body
+            FROM jobs j
+            LEFT JOIN documents d ON d.doc_id = j.doc_id
+            LEFT JOIN document_text t ON t.doc_id = j.doc_id
+            WHERE j.job_id=? AND j.user_id=?
+        """, (job_id, user_id))
+        row = cur.fetchone()
+
+    if not row:
+        return jsonify({"error": "not found"}), 404
+
+    job = dict(row)
+    codec, body = job.pop("codec"), job.pop("body")
+    if job["status"] == "done":
+        job["extracted_text"] = text_store.decode(codec, body)
+    else:
+        job.pop("title")
+    return jsonify(job), 200
+
+
+@api.route("/api/jobs/<int:job_id>/events", methods=["GET"])
+@jwt_required(locations=["headers", "query_string"])
+def api_job_events(job_id):
+    """
+    Follow an upload job as Server-Sent Events: partial text while it is extracted,
+    then the stored title and text (event types in job_events.py). EventSource cannot
+    set headers, so the token may also be passed as ?jwt=<token>. Under asgi.py the
+    stream is served from the event loop; a WSGI server holds a thread per stream.
+    """
+    user_id = int(get_jwt_identity())
+
+    with connection() as conn:
+        row = conn.execute("SELECT 1 FROM jobs WHERE job_id=? AND user_id=?", (job_id, user_id)).fetchone()
+    if not row:
+        return jsonify({"error": "not found"}), 404
+
+    return Response(job_events.stream(job_id), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # nginx would otherwise hold the events back
+    })
+
+
+@api.route("/api/health", methods=["GET"])
+def api_health():
+    """Service health, including the Vision API circuit breaker state."""
+    breaker = vision_breaker.snapshot()
+    return jsonify({
+        "status": "degraded" if breaker["state"] != "closed" else "ok",
+        "ai_breaker": breaker
+    }), 200
+
+
+@api.route("/metrics", methods=["GET"])
+def api_metrics():
+    """Prometheus metrics: HTTP, database, Vision API, OCR and job queue."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@api.route("/api/cache/stats", methods=["GET"])
+@jwt_required()
+def api_cache_stats():
+    """Extraction cache hit/miss counters and size (also in /metrics)."""
+    return jsonify(extraction_cache.stats()), 200
+
+
+@api.route("/api/document/<int:doc_id>", methods=["GET"])
 @jwt_required()
 def api_document(doc_id):
     """View full document details."""
     current_user_id = get_jwt_identity()
     user_id = int(current_user_id)  # Convert string back to int
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT * FROM documents
-        WHERE doc_id=? AND user_id=?
-    """, (doc_id, user_id))
-    row = cur.fetchone()
-    conn.close()
+    def load():
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT d.*, t.codec, t.body,
+                       (SELECT COUNT(*) FROM document_pages p WHERE p.doc_id = d.doc_id) AS page_count
+                FROM documents d LEFT JOIN document_text t ON t.doc_id = d.doc_id
+                WHERE d.doc_id=? AND d.user_id=? AND d.deleted_at IS NULL
+            """, (doc_id, user_id))
+            row = cur.fetchone()
+        if not row:
+            return None
+        document = dict(row)
+        document["extracted_text"] = text_store.decode(document.pop("codec"), document.pop("body")) or ""
+        return document
+
+    def build(version):
+        row = metadata_cache.document(user_id, version, doc_id, load)
+        if not row:
+            return make_response(jsonify({"error": "not found"}), 404)
+        return jsonify(row)
+
+    return _conditional(user_id, build)
+
+
+@api.route("/api/document/<int:doc_id>/pages", methods=["GET"])
+@jwt_required()
+def api_document_pages(doc_id):
+    """Pages of a PDF/TIFF document with their source (text_layer or image) and a text preview."""
+    user_id = int(get_jwt_identity())
+
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM documents WHERE doc_id=? AND user_id=? AND deleted_at IS NULL", (doc_id, user_id))
+        if not cur.fetchone():
+            return jsonify({"error": "not found"}), 404
+        cur.execute(
+            "SELECT page_no, source, text FROM document_pages WHERE doc_id=? ORDER BY page_no",
+            (doc_id,)
+        )
+        pages = [
+            {"page_no": row["page_no"], "source": row["source"], "text_preview": make_preview(row["text"])}
+            for row in cur.fetchall()
+        ]
+    return jsonify(pages), 200
+
+
+@api.route("/api/document/<int:doc_id>/pages/<int:page_no>", methods=["GET"])
+@jwt_required()
+def api_document_page(doc_id, page_no):
+    """Full text of one page."""
+    user_id = int(get_jwt_identity())
+
+    with connection() as conn:
+        row = conn.execute("""
+            SELECT p.page_no, p.source, p.text
+            FROM document_pages p JOIN documents d ON d.doc_id = p.doc_id
+            WHERE p.doc_id=? AND p.page_no=? AND d.user_id=? AND d.deleted_at IS NULL
+        """, (doc_id, page_no, user_id)).fetchone()
 
     if not row:
         return jsonify({"error": "not found"}), 404
-
     return jsonify(dict(row)), 200
 
 
-@app.route("/api/documents", methods=["GET"])
+@api.route("/api/document/<int:doc_id>/thumbnail", methods=["GET"])
 @jwt_required()
-def api_documents():
-    """Get all documents for the authenticated user."""
+def api_document_thumbnail(doc_id):
+    """
+    WebP thumbnail of the uploaded image; `?size=preview` for the larger preview.
+    Rendered on first request if the background step has not produced it yet.
+    """
+    user_id = int(get_jwt_identity())
+    kind = request.args.get("size", "thumbnail")
+    if kind not in derivatives.SIZES:
+        return jsonify({"error": f"size must be one of: {', '.join(derivatives.SIZES)}"}), 400
+
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT file_path, content_hash FROM documents WHERE doc_id=? AND user_id=? AND deleted_at IS NULL",
+            (doc_id, user_id)
+        ).fetchone()
+    if not row:
+        return jsonify({"error": "Document not found"}), 404
+    if not row["file_path"] or not storage.exists(row["file_path"]):
+        return jsonify({"error": "Original file missing"}), 404
+
+    content_hash = row["content_hash"] or extraction_cache.file_sha256(row["file_path"])
     try:
-        # Get user_id from token - now it's just a string
-        user_id = get_jwt_identity()
+        path = derivatives.ensure(row["file_path"], content_hash, kind)
+    except Exception as e:
+        logger.warning("Thumbnail failed for doc %s: %s", doc_id, e)
+        return jsonify({"error": "Could not render image"}), 500
+
+    # The name is content-addressed, so the bytes behind it never change
+    response = send_file(
+        path.resolve(),  # send_file resolves relative paths against the app folder, not the cwd
+        mimetype="image/webp",
+        etag=path.stem,
+        conditional=True,
+        max_age=THUMBNAIL_MAX_AGE
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
+@api.route("/api/document/<int:doc_id>/usage", methods=["GET"])
+@jwt_required()
+def api_document_usage(doc_id):
+    """Vision API token usage and latency recorded for a document (older calls: by its image's hash)."""
+    user_id = int(get_jwt_identity())
 
-        conn = get_conn()
+    with connection() as conn:
         cur = conn.cursor()
         cur.execute("""
-            SELECT * FROM documents
-            WHERE user_id=?
-            ORDER BY upload_date DESC
-        """, (user_id,))
-        rows = cur.fetchall()
-        conn.close()
+            SELECT COUNT(a.call_id) AS calls,
+                   COALESCE(SUM(a.prompt_tokens), 0) AS prompt_tokens,
+                   COALESCE(SUM(a.completion_tokens), 0) AS completion_tokens,
+                   COALESCE(SUM(a.total_tokens), 0) AS total_tokens,
+                   COALESCE(SUM(a.latency_ms), 0) AS latency_ms,
+                   SUM(a.status = 'error') AS errors
+            FROM documents d
+            LEFT JOIN ai_calls a ON a.doc_id = d.doc_id
+                OR (a.doc_id IS NULL AND a.content_hash = d.content_hash)
+            WHERE d.doc_id=? AND d.user_id=? AND d.deleted_at IS NULL
+            GROUP BY d.doc_id
+        """, (doc_id, user_id))
+        row = cur.fetchone()
+
+    if not row:
+        return jsonify({"error": "not found"}), 404
+
+    return jsonify(dict(row, doc_id=doc_id)), 200
+
 
-        return jsonify([dict(row) for row in rows]), 200
+@api.route("/api/documents", methods=["GET"])
+@jwt_required()
+def api_documents():
+    """
+    List the authenticated user's documents, newest first.
+    Query params: limit (default 50, max 200), cursor (from the X-Next-Cursor header
+    of the previous page), fields (comma-separated; default is the summary view
+    without extracted_text; full text comes from /api/document/<id>).
+    Responses carry an ETag; an unchanged list answers If-None-Match with 304.
+    """
+    try:
+        # Get user_id from token - now it's just a string
+        user_id = get_jwt_identity()
+        limit = _int_arg("limit", 50, maximum=200)
+
+        fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+        fields = fields or DOCUMENT_SUMMARY_FIELDS
+        unknown = set(fields) - DOCUMENT_FIELDS
+        if unknown:
+            return jsonify({"error": f"unknown fields: {', '.join(sorted(unknown))}"}), 400
+        # The cursor is built from (upload_date, doc_id), so always select them
+        columns = [f"d.{f}" for f in dict.fromkeys(["doc_id", "upload_date"] + fields) if f != "extracted_text"]
+        source = "documents d"
+        if "extracted_text" in fields:  # stored compressed in document_text
+            columns.append(f"COALESCE({text_store.SQL_FUNCTION}(t.codec, t.body), '') AS extracted_text")
+            source += " LEFT JOIN document_text t ON t.doc_id = d.doc_id"
+
+        cursor = request.args.get("cursor")
+        if cursor:
+            try:
+                cursor_date, cursor_id = _decode_cursor(cursor)
+            except ValueError:
+                return jsonify({"error": "invalid cursor"}), 400
+            where = "d.user_id=? AND d.deleted_at IS NULL AND (d.upload_date, d.doc_id) < (?, ?)"
+            params = (user_id, cursor_date, cursor_id)
+        else:
+            where, params = "d.user_id=? AND d.deleted_at IS NULL", (user_id,)
+
+        def load():
+            with connection() as conn:
+                cur = conn.cursor()
+                cur.execute(f"""
+                    SELECT {", ".join(columns)} FROM {source}
+                    WHERE {where}
+                    ORDER BY d.upload_date DESC, d.doc_id DESC
+                    LIMIT ?
+                """, params + (limit + 1,))
+                rows = cur.fetchall()
+            next_cursor = None
+            if len(rows) > limit:
+                last = rows[limit - 1]
+                next_cursor = _encode_cursor(last["upload_date"], last["doc_id"])
+            return {"items": [{f: row[f] for f in fields} for row in rows[:limit]], "next": next_cursor}
+
+        def build(version):
+            variant = f"{limit}|{','.join(fields)}|{cursor or ''}"
+            page = metadata_cache.document_list(user_id, version, variant, load)
+            response = jsonify(page["items"])
+            if page["next"]:
+                response.headers["X-Next-Cursor"] = page["next"]
+            return response
+
+        return _conditional(user_id, build)
     except Exception as e:
-        print(f"Error in api_documents: {str(e)}")
+        logger.exception("Error in api_documents")
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/search", methods=["GET"])
+@api.route("/api/search", methods=["GET"])
 def api_search():
-    """Search user's documents by title or extracted text."""
+    """
+    Search user's documents by title or extracted text (BM25-ranked, paginated).
+    Query params: user_id, q, limit (default 20, max 100), offset,
+    scope (`documents` (default) or `pages`: one result per matching PDF/TIFF page),
+    mode (`keyword` (default), `semantic` or `hybrid`; the last two rank documents by
+    embedding similarity, alone or blended with BM25, and their scores are higher-is-better).
+    Semantic and hybrid mode need EMBEDDING_BACKEND and a JWT for `user_id`; their
+    responses name the backend and whether it is only lexical (hashing).
+    """
     user_id = request.args.get("user_id")
-    query = request.args.get("q", "").strip()
+    text = request.args.get("q", "").strip()
+    query = fts_match_query(text)
+    limit = _int_arg("limit", 20, maximum=100)
+    offset = _int_arg("offset", 0)
+    scope = request.args.get("scope", "documents")
+    mode = request.args.get("mode", "keyword")
 
     if not user_id:
         return jsonify({"error": "user_id required"}), 400
+    if scope not in ("documents", "pages"):
+        return jsonify({"error": "scope must be documents or pages"}), 400
+    if mode not in ("keyword", "semantic", "hybrid"):
+        return jsonify({"error": "mode must be keyword, semantic or hybrid"}), 400
+    if (scope == "pages" or mode != "keyword") and not query:
+        return jsonify({"error": "q required"}), 400
+    if scope == "pages" and mode != "keyword":
+        return jsonify({"error": "scope=pages supports keyword mode only"}), 400
+
+    if mode != "keyword":
+        if not semantic_index.enabled():
+            return jsonify({"error": f"mode={mode} is not available: no EMBEDDING_BACKEND configured"}), 400
+        # Embedding a query may be a paid API call: signed-in users, their own documents only
+        verify_jwt_in_request()
+        if str(get_jwt_identity()) != str(user_id):
+            return jsonify({"error": "forbidden"}), 403
+        try:
+            rows = _ranked_search(user_id, text, query, mode, limit, offset)
+        except Exception as e:
+            logger.exception("Semantic search failed")
+            return jsonify({"error": f"Semantic search unavailable: {e}"}), 503
+        backend = semantic_index.get_backend()
+        return jsonify({
+            "results": rows[:limit],
+            "embedding": {"backend": backend.name, "lexical": backend.lexical},
+            "limit": limit,
+            "offset": offset,
+            "next_offset": offset + limit if len(rows) > limit else None
+        }), 200
 
-    conn = get_conn()
-    cur = conn.cursor()
+    with connection() as conn:
+        cur = conn.cursor()
 
-    if query:  # Search if query is provided
-        cur.execute("""
-            SELECT * FROM documents
-            WHERE user_id=?
-            AND (title LIKE ? OR extracted_text LIKE ?)
-        """, (user_id, f"%{query}%", f"%{query}%"))
-    else:  # Return all documents for user if no query
-        cur.execute("""
-            SELECT * FROM documents
-            WHERE user_id=?
-        """, (user_id,))
+        if scope == "pages":  # Ranked per-page matches of multi-page documents
+            cur.execute("""
+                SELECT d.doc_id, d.user_id, d.title, d.upload_date, d.status, p.page_no,
+                       snippet(document_pages_fts, 0, '<mark>', '</mark>', '…', 16) AS snippet,
+                       bm25(document_pages_fts) AS score
+                FROM document_pages_fts
+                JOIN document_pages p ON p.page_id = document_pages_fts.rowid
+                JOIN documents d ON d.doc_id = p.doc_id
+                WHERE document_pages_fts MATCH ? AND d.user_id=? AND d.deleted_at IS NULL
+                ORDER BY score
+                LIMIT ? OFFSET ?
+            """, (query, user_id, limit + 1, offset))
+        elif query:  # Ranked full-text search, title matches weighted higher
+            cur.execute("""
+                SELECT d.doc_id, d.user_id, d.title, d.file_path, d.upload_date, d.status,
+                       snippet(documents_fts, -1, '<mark>', '</mark>', '…', 16) AS snippet,
+                       bm25(documents_fts, 10.0, 1.0) AS score
+                FROM documents_fts
+                JOIN documents d ON d.doc_id = documents_fts.rowid
+                WHERE documents_fts MATCH ? AND d.user_id=? AND d.deleted_at IS NULL
+                ORDER BY score
+                LIMIT ? OFFSET ?
+            """, (query, user_id, limit + 1, offset))
+        else:  # Return all documents for user if no query
+            cur.execute("""
+                SELECT doc_id, user_id, title, file_path, upload_date, status,
+                       NULL AS snippet, NULL AS score
+                FROM documents
+                WHERE user_id=? AND deleted_at IS NULL
+                ORDER BY upload_date DESC, doc_id DESC
+                LIMIT ? OFFSET ?
+            """, (user_id, limit + 1, offset))
 
-    rows = cur.fetchall()
-    conn.close()
+        rows = cur.fetchall()
 
-    return jsonify([dict(row) for row in rows]), 200
+    has_more = len(rows) > limit
+    return jsonify({
+        "results": [dict(row) for row in rows[:limit]],
+        "limit": limit,
+        "offset": offset,
+        "next_offset": offset + limit if has_more else None
+    }), 200
+
+
+def _ranked_search(user_id, text, query, mode, limit, offset):
+    """
+    Semantic or hybrid ranking; returns up to limit + 1 result dicts starting at `offset`.
+    Hybrid score = HYBRID_ALPHA * cosine similarity + (1 - HYBRID_ALPHA) * BM25 scaled to 0..1,
+    over the top SEARCH_CANDIDATES of each ranking.
+    """
+    n = min(offset + limit + 1, SEARCH_CANDIDATES)
+    semantic = semantic_index.search(user_id, text, n)
+    scores = {doc_id: max(similarity, 0.0) for doc_id, similarity, _ in semantic}
+    best_chunk = {doc_id: chunk_id for doc_id, _, chunk_id in semantic}
+    snippets = {}
+
+    with connection() as conn:
+        cur = conn.cursor()
+        if mode == "hybrid":
+            cur.execute("""
+                SELECT documents_fts.rowid AS doc_id,
+                       snippet(documents_fts, -1, '<mark>', '</mark>', '…', 16) AS snippet,
+                       bm25(documents_fts, 10.0, 1.0) AS score
+                FROM documents_fts
+                JOIN documents d ON d.doc_id = documents_fts.rowid
+                WHERE documents_fts MATCH ? AND d.user_id=? AND d.deleted_at IS NULL
+                ORDER BY score
+                LIMIT ?
+            """, (query, user_id, n))
+            keyword = cur.fetchall()
+            # bm25() is negative, lower is better
+            best = max((-row["score"] for row in keyword), default=0.0) or 1.0
+            scores = {doc_id: HYBRID_ALPHA * score for doc_id, score in scores.items()}
+            for row in keyword:
+                scores[row["doc_id"]] = scores.get(row["doc_id"], 0.0) + (1 - HYBRID_ALPHA) * (-row["score"] / best)
+                snippets[row["doc_id"]] = row["snippet"]
+
+        ranked = sorted(((d, sc) for d, sc in scores.items() if sc > 0), key=lambda item: -item[1])
+        ranked = ranked[offset:offset + limit + 1]
+        if not ranked:
+            return []
+        ids = [doc_id for doc_id, _ in ranked]
+        marks = ",".join("?" * len(ids))
+        cur.execute(f"""
+            SELECT doc_id, user_id, title, file_path, upload_date, status
+            FROM documents WHERE doc_id IN ({marks}) AND user_id=? AND deleted_at IS NULL
+        """, ids + [user_id])
+        docs = {row["doc_id"]: dict(row) for row in cur.fetchall()}
+        chunk_ids = [best_chunk[doc_id] for doc_id in ids if doc_id not in snippets and doc_id in best_chunk]
+        if chunk_ids:
+            cur.execute(
+                f"SELECT doc_id, text FROM document_chunks WHERE chunk_id IN ({','.join('?' * len(chunk_ids))})",
+                chunk_ids
+            )
+            for row in cur.fetchall():
+                snippets[row["doc_id"]] = row["text"][:300]
+
+    return [
+        dict(docs[doc_id], snippet=snippets.get(doc_id), score=round(score, 6))
+        for doc_id, score in ranked if doc_id in docs
+    ]
+
+
+@api.route("/api/export/bulk", methods=["GET"])
+@jwt_required()
+def api_export_bulk():
+    """
+    Stream a ZIP of the user's documents as it is built.
+    Query params: ids (comma-separated doc ids; default all), include_images (1 to add
+    the original uploads). Contains <id>_<title>.txt files, images/ and manifest.json.
+    """
+    user_id = int(get_jwt_identity())
+    include_images = request.args.get("include_images", "0").lower() in ("1", "true", "yes")
+    try:
+        ids = sorted({int(i) for i in request.args.get("ids", "").split(",") if i.strip()})
+    except ValueError:
+        return jsonify({"error": "ids must be comma-separated integers"}), 400
 
+    logger.debug("Bulk export request", extra={"user_id": user_id, "ids": len(ids) or "all"})
+    return Response(
+        _zip_export(user_id, ids, include_images),
+        mimetype="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="documents_export.zip"'}
+    )
 
-@app.route("/api/export/<int:doc_id>", methods=["GET"])
+
+def _iter_export_rows(user_id, ids):
+    """
+    Yield the rows to export in doc_id order, EXPORT_BATCH_SIZE at a time.
+    Each batch is a short keyset query, so no pooled connection is pinned while
+    a slow client downloads the archive.
+    """
+    last_id = 0
+    while True:
+        where, params = "d.user_id=? AND d.deleted_at IS NULL AND d.doc_id>?", [user_id, last_id]
+        if ids:
+            where += f" AND d.doc_id IN ({','.join('?' * len(ids))})"
+            params += ids
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT d.doc_id, d.title, d.file_path, d.upload_date, d.status, t.codec, t.body
+                FROM documents d LEFT JOIN document_text t ON t.doc_id = d.doc_id
+                WHERE {where}
+                ORDER BY d.doc_id
+                LIMIT ?
+            """, params + [EXPORT_BATCH_SIZE])
+            rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1]["doc_id"]
+
+
+def _zip_export(user_id, ids, include_images):
+    """Generator producing the ZIP archive chunk by chunk."""
+    sink = _ZipSink()
+    manifest = []
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for row in _iter_export_rows(user_id, ids):
+            doc_id = row["doc_id"]
+            entry = {
+                "doc_id": doc_id,
+                "title": row["title"],
+                "upload_date": row["upload_date"],
+                "status": row["status"],
+                "text_file": f"{doc_id}_{_safe_title(row['title'], doc_id)}.txt",
+                "image_file": None
+            }
+            zf.writestr(entry["text_file"], text_store.decode(row["codec"], row["body"]) or "")
+            yield sink.drain()
+
+            file_path = row["file_path"]
+            if include_images and storage.exists(file_path):
+                entry["image_file"] = f"images/{doc_id}_{Path(file_path).name}"
+                # Images are already compressed; store them and copy in chunks
+                with storage.open_file(file_path) as src, \
+                        zf.open(zipfile.ZipInfo(entry["image_file"]), "w", force_zip64=True) as dest:
+                    for chunk in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b""):
+                        dest.write(chunk)
+                        yield sink.drain()
+            manifest.append(entry)
+
+        zf.writestr("manifest.json", json.dumps({
+            "user_id": user_id,
+            "exported_at": datetime.now(timezone.utc).isoformat(),
+            "count": len(manifest),
+            "documents": manifest
+        }, indent=2))
+    yield sink.drain()
+
+
+@api.route("/api/export/<int:doc_id>", methods=["GET"])
 @jwt_required()
 def api_export(doc_id):
-    """Export extracted text as .txt file."""
+    """Export extracted text as .txt file (`?page=N` for a single page of a PDF/TIFF)."""
     try:
         current_user_id = get_jwt_identity()
         user_id = int(current_user_id)  # Convert string back to int
-        
-        print(f"Export request for doc_id: {doc_id}, user_id: {user_id}")
-
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT title, extracted_text
-            FROM documents
-            WHERE doc_id=? AND user_id=?
-        """, (doc_id, user_id))
-        row = cur.fetchone()
-        conn.close()
+        page_no = request.args.get("page", type=int)
+
+        logger.debug("Export request", extra={"doc_id": doc_id, "user_id": user_id, "page": page_no})
+
+        with connection() as conn:
+            cur = conn.cursor()
+            if page_no is None:
+                cur.execute("""
+                    SELECT d.title, t.codec, t.body
+                    FROM documents d LEFT JOIN document_text t ON t.doc_id = d.doc_id
+                    WHERE d.doc_id=? AND d.user_id=? AND d.deleted_at IS NULL
+                """, (doc_id, user_id))
+            else:
+                cur.execute("""
+                    SELECT d.title, p.text AS extracted_text
+                    FROM documents d JOIN document_pages p ON p.doc_id = d.doc_id
+                    WHERE d.doc_id=? AND d.user_id=? AND d.deleted_at IS NULL AND p.page_no=?
+                """, (doc_id, user_id, page_no))
+            row = cur.fetchone()
 
         if not row:
-            print(f"Document not found: doc_id={doc_id}, user_id={user_id}")
+            logger.info("Document not found", extra={"doc_id": doc_id, "user_id": user_id, "page": page_no})
             return jsonify({"error": "Document not found"}), 404
 
         title = row["title"] or f"document_{doc_id}"
-        text = row["extracted_text"] or ""
-        
+        if page_no is None:
+            text = text_store.decode(row["codec"], row["body"]) or ""
+        else:
+            text = row["extracted_text"] or ""
+
         if not text.strip():
             text = "No extracted text available for this document."
-        
-        # Clean title for filename
-        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
-        filename = f"{safe_title}.txt"
 
-        tmp_path = Path("data") / f"export_{doc_id}.txt"
-        tmp_path.parent.mkdir(parents=True, exist_ok=True)
-        tmp_path.write_text(text, encoding="utf-8")
-        
-        print(f"Successfully created export file: {tmp_path}")
-        return send_file(str(tmp_path), as_attachment=True, download_name=filename)
+        suffix = f"_p{page_no}" if page_no is not None else ""
+        filename = f"{_safe_title(title, doc_id)}{suffix}.txt"
+
+        # Served from memory; the ETag lets clients revalidate with If-None-Match (304)
+        data = text.encode("utf-8")
+        etag = hashlib.sha256(filename.encode() + b"\0" + data).hexdigest()
+        return send_file(
+            io.BytesIO(data),
+            mimetype="text/plain; charset=utf-8",
+            as_attachment=True,
+            download_name=filename,
+            etag=etag,
+            conditional=True,
+            max_age=0
+        )
         
     except Exception as e:
-        print(f"Export error: {str(e)}")
+        logger.exception("Export failed")
         return jsonify({"error": f"Export failed: {str(e)}"}), 500
 
 
-@app.route("/api/document/<int:doc_id>", methods=["DELETE"])
+@api.route("/api/document/<int:doc_id>", methods=["DELETE"])
 @jwt_required()
 def api_delete(doc_id):
-    """Delete document and remove file from disk."""
+    """Delete document; its file is removed in the background once nothing else uses it."""
     # Get user ID from JWT token
     user_id = get_jwt_identity()
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT file_path FROM documents
-        WHERE doc_id=? AND user_id=?
-    """, (doc_id, user_id))
-    row = cur.fetchone()
-
-    if not row:
-        conn.close()
-        return jsonify({"error": "Document not found or access denied"}), 404
-
-    file_path = row["file_path"]
-
-    try:
-        if file_path and Path(file_path).exists():
-            Path(file_path).unlink()
-    except Exception as e:
-        print(f"Warning: failed to remove file {file_path}: {e}")
+    with connection() as conn:
+        cur = conn.cursor()
+        # Uploads of the same content share one stored file; the blobs triggers
+        # queue it for the collector when this was its last reference
+        cur.execute("""
+            DELETE FROM documents
+            WHERE doc_id=? AND user_id=?
+        """, (doc_id, user_id))
 
-    cur.execute("""
-        DELETE FROM documents
-        WHERE doc_id=? AND user_id=?
-    """, (doc_id, user_id))
-    conn.commit()
-    conn.close()
+        if not cur.rowcount:
+            return jsonify({"error": "Document not found or access denied"}), 404
 
+    file_gc.wake()
     return jsonify({"message": "Document deleted successfully"}), 200
 
 
-@app.route("/api/auth/delete_account", methods=["DELETE"])
+@api.route("/api/auth/delete_account", methods=["DELETE"])
 @jwt_required()
 def delete_account():
     """
@@ -565,64 +1313,92 @@ def delete_account():
     """
     try:
         user_id = get_jwt_identity()
-        print(f"Delete account request for user_id: {user_id}")
-        
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        # First, get all documents for this user to delete files
-        print("Getting user documents...")
-        cur.execute("SELECT file_path FROM documents WHERE user_id=?", (user_id,))
-        documents = cur.fetchall()
-        print(f"Found {len(documents)} documents to delete")
-        
-        # Delete all document files
-        for doc in documents:
-            file_path = doc[0]
-            try:
-                if file_path and Path(file_path).exists():
-                    print(f"Deleting file: {file_path}")
-                    Path(file_path).unlink()
-                else:
-                    print(f"File not found or path empty: {file_path}")
-            except Exception as e:
-                print(f"Warning: failed to remove file {file_path}: {e}")
+        logger.info("Delete account request", extra={"user_id": user_id})
         
-        # Delete all user documents from database
-        print("Deleting user documents from database...")
-        cur.execute("DELETE FROM documents WHERE user_id=?", (user_id,))
-        documents_deleted = cur.rowcount
-        print(f"Deleted {documents_deleted} document records")
-        
-        # Delete the user account
-        print("Deleting user account...")
-        cur.execute("DELETE FROM users WHERE user_id=?", (user_id,))
-        user_deleted = cur.rowcount
-        print(f"Deleted {user_deleted} user record")
-        
-        if user_deleted == 0:
-            conn.close()
-            print(f"Warning: No user found with id {user_id}")
-            return jsonify({"error": "User not found"}), 404
-        
-        conn.commit()
-        conn.close()
-        
-        print("Account deletion successful")
+        with connection() as conn:
+            cur = conn.cursor()
+
+            # Mark the documents and queue their files in one set-based step;
+            # rows and files are removed in batches by the background collector
+            documents_deleted = file_gc.queue_user_deletion(cur, user_id)
+            logger.debug("Marked %d documents for deletion", documents_deleted)
+
+            # Delete the user account
+            cur.execute("DELETE FROM users WHERE user_id=?", (user_id,))
+            user_deleted = cur.rowcount
+            logger.debug("Deleted %d user record", user_deleted)
+
+            if user_deleted == 0:
+                conn.rollback()
+                logger.warning("No user found with id %s", user_id)
+                return jsonify({"error": "User not found"}), 404
+
+        file_gc.wake()
+        metadata_cache.invalidate_profile(user_id)
+        logger.info("Account deleted", extra={"user_id": user_id, "documents": documents_deleted})
         return jsonify({"message": "Account deleted successfully"}), 200
         
     except Exception as e:
-        print(f"Error deleting account: {e}")
-        print(f"Error type: {type(e).__name__}")
-        import traceback
-        traceback.print_exc()
-        try:
-            conn.close()
-        except:
-            pass
+        logger.exception("Error deleting account")
         return jsonify({"error": f"Failed to delete account: {str(e)}"}), 500
 
 
+# ------------------------
+# Application factory
+# ------------------------
+
+_background_pid = None
+_background_lock = threading.Lock()
+
+def start_background():
+    """
+    Start this process's background work: resume unfinished jobs and run the file
+    collector. Runs once per process, on its first request, so a pre-forking server
+    that imports the app in its master starts nothing there.
+    """
+    global _background_pid
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    try:
+        resume_pending_jobs()
+        file_gc.start()
+    except Exception:
+        logger.exception("Could not start background work (has `python db.py init` run?)")
+
+def create_app(config=None):
+    """
+    Build the Flask app. Cheap and side-effect free: the database schema is set up
+    by `python db.py init`, and connections, OpenAI clients and worker pools are
+    created per process on first use.
+    """
+    started = time.perf_counter()
+    configure_logging()
+    app = Flask(__name__)
+    app.config.update(
+        JWT_SECRET_KEY=os.getenv("JWT_SECRET_KEY", "smart-document-assistant-secret-key"),  # Change this in production!
+        JWT_ACCESS_TOKEN_EXPIRES=timedelta(hours=24),
+        PROPAGATE_EXCEPTIONS=True,  # Propagate JWT exceptions to see them in the logs
+        MAX_CONTENT_LENGTH=MAX_REQUEST_BYTES,
+        UPLOAD_FOLDER=UPLOAD_FOLDER,
+    )
+    app.config.update(config or {})
+
+    CORS(app, expose_headers=["X-Next-Cursor", "X-Request-ID"])
+    jwt.init_app(app)
+    app.register_blueprint(api)
+    if SWAGGER_UI:
+        from flasgger import Swagger
+        Swagger(app)
+    if not os.getenv("OPENAI_API_KEY"):
+        logger.warning("OPENAI_API_KEY is not set; uploads will be extracted with OCR only")
+
+    logger.debug("App created in %.1f ms", (time.perf_counter() - started) * 1000)
+    return app
+
+app = create_app()
+
 if __name__ == "__main__":
     init_db()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,114 @@
+# asgi.py
+"""
+ASGI entry point:
+
+    uvicorn asgi:asgi_app --host 127.0.0.1 --port 5000
+
+Routes and JWT handling are exactly those of the Flask app in app.py. Upload
+extraction runs on the asyncio job runner (JOB_MODE=async): Vision calls use the
+async OpenAI client and hundreds of them can be in flight per process, while
+SQLite, Pillow and Tesseract work runs in an executor.
+
+GET /api/jobs/<id>/events is still authorized by the Flask route, but the event
+stream itself is written from the event loop; through WsgiToAsgi every open stream
+would hold one of asgiref's threads until its job ends.
+
+Set up the database first with `python db.py init`.
+"""
+import os
+import re
+import sys
+import asyncio
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+
+os.environ.setdefault("JOB_MODE", "async")
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.test import EnvironBuilder
+from app import create_app, start_background
+import job_events
+
+app = create_app()
+# Each uvicorn worker process imports this module itself, so start its workers now
+start_background()
+
+wsgi_asgi_app = WsgiToAsgi(app)
+
+EVENTS_PATH = re.compile(r"^/api/jobs/(\d+)/events$")
+
+
+def _open_events(scope) -> tuple:
+    """
+    Run an events request through Flask (JWT, ownership, request hooks) without reading
+    the response body. Returns (status, headers, body); body is None for an event stream.
+    """
+    environ = EnvironBuilder(
+        path=scope["path"],
+        query_string=scope["query_string"].decode("latin1"),
+        headers=[(name.decode("latin1"), value.decode("latin1")) for name, value in scope["headers"]],
+        environ_base={"REMOTE_ADDR": (scope.get("client") or ("",))[0]},
+    ).get_environ()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started.update(status=int(status.split()[0]), headers=headers)
+
+    response = app(environ, start_response)
+    try:
+        streaming = started["status"] == 200 and any(
+            name.lower() == "content-type" and value.startswith("text/event-stream")
+            for name, value in started["headers"]
+        )
+        # The body of a stream is a generator that has not started yet
+        body = None if streaming else b"".join(response)
+    finally:
+        if hasattr(response, "close"):
+            response.close()
+    headers = [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in started["headers"]]
+    return started["status"], headers, body
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _events(scope, receive, send, job_id: int):
+    status, headers, body = await asyncio.to_thread(_open_events, scope)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    if body is not None:
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    events = job_events.stream_async(job_id)
+    chunk = None
+    try:
+        while True:
+            chunk = asyncio.ensure_future(events.__anext__())
+            await asyncio.wait({chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not chunk.done():  # client went away
+                return
+            try:
+                data = chunk.result()
+            except StopAsyncIteration:
+                break
+            await send({"type": "http.response.body", "body": data.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        # The generator can only be closed once no __anext__ is running
+        tasks = [task for task in (chunk, disconnected) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await events.aclose()
+
+
+async def asgi_app(scope, receive, send):
+    if scope["type"] == "http" and scope["method"] == "GET":
+        match = EVENTS_PATH.match(scope["path"])
+        if match:
+            await _events(scope, receive, send, int(match.group(1)))
+            return
+    await wsgi_asgi_app(scope, receive, send)
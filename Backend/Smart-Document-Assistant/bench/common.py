@@ -0,0 +1,105 @@
+# bench/common.py
+"""Shared helpers for the benchmark scripts: timing, percentiles and JSON reports."""
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(BACKEND_DIR))
+
+
+def use_workdir(path: Optional[str] = None) -> str:
+    """
+    chdir into a scratch directory before the backend modules are imported:
+    db.py and app.py use relative data/ and uploads/ paths.
+    """
+    path = path or tempfile.mkdtemp(prefix="sda-bench-")
+    os.makedirs(path, exist_ok=True)
+    os.chdir(path)
+    # The OpenAI client needs a key; benchmarks never reach the real API
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    # Per-request INFO lines would be timed along with the requests
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    return path
+
+
+def check_log_handlers():
+    """The report is printed to stdout; fail early if the in-process app logs there too."""
+    import logging
+    for handler in logging.getLogger().handlers:
+        if getattr(handler, "stream", None) is sys.stdout:
+            raise RuntimeError(f"log handler {handler!r} writes to stdout, which carries the JSON report")
+
+
+def percentile(sorted_samples: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, -(-len(sorted_samples) * p // 100))
+    return sorted_samples[int(rank) - 1]
+
+
+def summarize(samples: List[float], elapsed: Optional[float] = None) -> dict:
+    """Latency summary in milliseconds (samples are seconds) plus throughput in ops/s."""
+    ordered = sorted(samples)
+    elapsed = elapsed if elapsed is not None else sum(samples)
+    ms = lambda s: round(s * 1000, 4)
+    return {
+        "count": len(ordered),
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        "min_ms": ms(ordered[0]) if ordered else 0.0,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else 0.0,
+        "throughput_per_s": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def measure(fn: Callable[[], object], iterations: int, warmup: int = 0) -> dict:
+    """Call `fn` sequentially and summarize the per-call latency."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=5,
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def write_report(suite: str, params: dict, results: dict, output: Optional[str] = None) -> dict:
+    """Print the report as JSON (and write it to `output` if given) so runs can be diffed across commits."""
+    report = {
+        "suite": suite,
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        Path(output).write_text(text + "\n")
+    return report
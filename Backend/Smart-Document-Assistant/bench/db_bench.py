@@ -0,0 +1,160 @@
+# bench/db_bench.py
+"""
+DB-backed endpoint benchmarks: seed `documents` with synthetic rows, then time
+/api/documents, /api/search and /api/export/<id> through the Flask test client.
+
+    python bench/db_bench.py --rows 10000,100000,1000000 --output db.json
+
+Each row count gets a fresh database in a scratch directory (--workdir to keep it).
+"""
+import os
+import random
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+from common import use_workdir, check_log_handlers, measure, write_report
+
+WORDS = (
+    "invoice receipt total amount due payment account customer order shipping "
+    "address tax report quarterly revenue contract agreement signature meeting "
+    "notes schedule delivery warehouse inventory product service balance bank "
+    "statement insurance policy claim medical prescription license permit"
+).split()
+SEED_BATCH = 5000
+
+
+def _synthetic_text(rng: random.Random, words: int) -> str:
+    lines = []
+    for _ in range(max(1, words // 10)):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(10)))
+    return "\n".join(lines)
+
+
+def seed(rows: int, users: int, text_words: int, seed_value: int = 42):
+    """
+    Insert `users` users and `rows` documents spread over them, stored the way uploads
+    are: content-addressed storage keys and content hashes (the triggers fill FTS and blobs).
+    """
+    from db import connection, make_preview
+    import storage
+    import text_store
+
+    rng = random.Random(seed_value)
+    start = datetime(2024, 1, 1)
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO users (username, password, email) VALUES (?, 'x', ?)",
+            [(f"bench{u}", f"bench{u}@example.com") for u in range(users)],
+        )
+    for offset in range(0, rows, SEED_BATCH):
+        batch, texts = [], []
+        for i in range(offset, min(offset + SEED_BATCH, rows)):
+            text = _synthetic_text(rng, text_words)
+            uploaded = start + timedelta(seconds=i * 30)
+            content_hash = hashlib.sha256(f"bench_{i}".encode()).hexdigest()
+            batch.append((
+                i + 1, i % users + 1, f"{rng.choice(WORDS).title()} {i}",
+                storage.object_key(content_hash, f"bench_{i}.png"), content_hash,
+                make_preview(text), uploaded.strftime("%Y-%m-%d %H:%M:%S"),
+            ))
+            texts.append((i + 1, text))
+        with connection() as conn:
+            conn.executemany("""
+                INSERT INTO documents (doc_id, user_id, title, file_path, content_hash, text_preview,
+                                       upload_date, status, extraction_source)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'done', 'vision')
+            """, batch)
+            text_store.store_many(conn.cursor(), texts)
+    with connection() as conn:
+        conn.execute("ANALYZE")
+
+
+def run(rows: int, args) -> dict:
+    import time
+    from db import connection
+    from app import app
+    from flask_jwt_extended import create_access_token
+    check_log_handlers()
+
+    started = time.perf_counter()
+    seed(rows, args.users, args.text_words)
+    seed_seconds = round(time.perf_counter() - started, 2)
+
+    user_id = 1
+    with app.app_context():
+        headers = {"Authorization": f"Bearer {create_access_token(identity=str(user_id))}"}
+    with connection() as conn:
+        doc_ids = [r[0] for r in conn.execute(
+            "SELECT doc_id FROM documents WHERE user_id=? LIMIT 1000", (user_id,))]
+    client = app.test_client()
+    rng = random.Random(7)
+
+    def get(url):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, (url, response.status_code)
+        return response
+
+    # Walk pages the way the dashboard does, restarting from the top after `pages`
+    cursor = {"value": None, "page": 0}
+
+    def documents_next_page():
+        url = "/api/documents?limit=50" + (f"&cursor={cursor['value']}" if cursor["value"] else "")
+        response = get(url)
+        cursor["page"] += 1
+        next_cursor = response.headers.get("X-Next-Cursor")
+        cursor["value"] = next_cursor if next_cursor and cursor["page"] < args.pages else None
+        if not cursor["value"]:
+            cursor["page"] = 0
+
+    n = args.iterations
+    results = {
+        "api_documents.first_page": measure(lambda: get("/api/documents?limit=50"), n, warmup=5),
+        "api_documents.paged": measure(documents_next_page, n, warmup=5),
+        "api_documents.full_text": measure(
+            lambda: get("/api/documents?limit=50&fields=doc_id,title,extracted_text"), n, warmup=5),
+        "api_search.single_term": measure(
+            lambda: get(f"/api/search?user_id={user_id}&q={rng.choice(WORDS)}"), n, warmup=5),
+        "api_search.two_terms": measure(
+            lambda: get(f"/api/search?user_id={user_id}&q={rng.choice(WORDS)}+{rng.choice(WORDS)}"), n, warmup=5),
+        "api_search.deep_offset": measure(
+            lambda: get(f"/api/search?user_id={user_id}&q={rng.choice(WORDS)}&offset=500"), n, warmup=5),
+        "api_search.no_query": measure(lambda: get(f"/api/search?user_id={user_id}"), n, warmup=5),
+        "api_export": measure(lambda: get(f"/api/export/{rng.choice(doc_ids)}"), n, warmup=5),
+    }
+    db_bytes = sum(os.path.getsize(p) for p in ("data/app.db", "data/app.db-wal") if os.path.exists(p))
+    return {"seed_seconds": seed_seconds, "db_bytes": db_bytes, "endpoints": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000", help="comma-separated row counts, e.g. 10000,100000,1000000")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--text-words", type=int, default=200, help="words of extracted text per document")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=20, help="pages walked by api_documents.paged")
+    parser.add_argument("--workdir")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    row_counts = [int(r) for r in args.rows.split(",") if r.strip()]
+    base = use_workdir(args.workdir)
+    results = {}
+    for rows in row_counts:
+        # A fresh process-wide pool per size: point db at a new directory and reopen
+        os.chdir(base)
+        os.makedirs(f"rows_{rows}", exist_ok=True)
+        os.chdir(f"rows_{rows}")
+        os.makedirs("data", exist_ok=True)
+        import db
+        db.pool.close_all()
+        db.init_db()
+        results[str(rows)] = run(rows, args)
+
+    params = {k: v for k, v in vars(args).items() if k not in ("output", "workdir")}
+    params["rows"] = row_counts
+    write_report("db", params, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
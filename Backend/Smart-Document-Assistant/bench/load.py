@@ -0,0 +1,161 @@
+# bench/load.py
+"""
+End-to-end load driver: concurrent /api/upload requests, then poll each job to completion
+(or, with --events, follow it through /api/jobs/<id>/events and time the first text).
+
+By default it starts the OpenAI stub and the Flask app in-process (threaded
+Werkzeug server, scratch data directory):
+
+    python bench/load.py --uploads 200 --concurrency 20 --ai-latency 0.8 --output load.json
+    python bench/load.py --uploads 50 --ai-latency 0.6 --ai-token-interval 0.2 --events
+
+Or point it at a server you started yourself (e.g. under uvicorn, with
+OPENAI_BASE_URL set to a running bench/stub_openai.py):
+
+    python bench/load.py --base-url http://127.0.0.1:5000 --uploads 200
+"""
+import io
+import os
+import time
+import uuid
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from common import use_workdir, check_log_handlers, summarize, write_report
+
+
+def _png(width: int, height: int) -> bytes:
+    """A distinct image per upload so the extraction cache doesn't short-circuit the AI call."""
+    from PIL import Image
+    img = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _start_local_app(args) -> str:
+    use_workdir(args.workdir)
+    import stub_openai
+    stub = stub_openai.start(latency=args.ai_latency, jitter=args.ai_jitter, error_rate=args.ai_error_rate,
+                             token_interval=args.ai_token_interval)
+    os.environ["OPENAI_BASE_URL"] = stub.base_url
+
+    from werkzeug.serving import make_server
+    from app import app
+    from db import init_db
+    init_db()
+    check_log_handlers()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def _login(base_url: str) -> dict:
+    name = f"bench{uuid.uuid4().hex[:8]}"
+    creds = {"username": name, "password": "bench-password", "email": f"{name}@example.com"}
+    requests.post(f"{base_url}/api/auth/register", json=creds, timeout=30).raise_for_status()
+    response = requests.post(f"{base_url}/api/auth/login", json=creds, timeout=30)
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def _follow_events(http: requests.Session, base_url: str, job_id: int, started: float, timeout: float) -> dict:
+    """Read a job's event stream to its end; returns timings (seconds since `started`) and the final status."""
+    outcome = {"status": "timeout"}
+    response = http.get(f"{base_url}/api/jobs/{job_id}/events", stream=True, timeout=timeout)
+    with response:
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif not line.startswith("data: "):
+                continue
+            elif event == "text" and "first_text" not in outcome:
+                outcome["first_text"] = time.perf_counter() - started
+            elif event in ("done", "failed"):
+                outcome.update(status=event, job=time.perf_counter() - started)
+                break
+    return outcome
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="benchmark a running server instead of an in-process one")
+    parser.add_argument("--uploads", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--image-size", default="800x600", help="WIDTHxHEIGHT of generated images")
+    parser.add_argument("--ai-latency", type=float, default=0.5, help="stub time to first token (seconds)")
+    parser.add_argument("--ai-jitter", type=float, default=0.1)
+    parser.add_argument("--ai-error-rate", type=float, default=0.0)
+    parser.add_argument("--ai-token-interval", type=float, default=0.0, help="stub seconds between answer chunks")
+    parser.add_argument("--events", action="store_true", help="follow jobs over SSE instead of polling")
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--job-timeout", type=float, default=300)
+    parser.add_argument("--workdir")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    base_url = args.base_url or _start_local_app(args)
+    headers = _login(base_url)
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+    images = [_png(width, height) for _ in range(args.uploads)]
+
+    session = threading.local()
+
+    def http() -> requests.Session:
+        if not hasattr(session, "value"):
+            session.value = requests.Session()
+            session.value.headers.update(headers)
+        return session.value
+
+    def one(i: int) -> dict:
+        """Upload one image and wait for its job; returns timings (seconds) and the final status."""
+        started = time.perf_counter()
+        response = http().post(f"{base_url}/api/upload",
+                               files={"file": (f"bench_{i}.png", images[i], "image/png")}, timeout=60)
+        upload_done = time.perf_counter()
+        if response.status_code != 202:
+            return {"upload": upload_done - started, "status": f"http_{response.status_code}"}
+
+        job_id = response.json()["job_id"]
+        if args.events:
+            return dict(_follow_events(http(), base_url, job_id, started, args.job_timeout), upload=upload_done - started)
+        deadline = started + args.job_timeout
+        status = "timeout"
+        while time.perf_counter() < deadline:
+            job = http().get(f"{base_url}/api/jobs/{job_id}", timeout=30).json()
+            if job.get("status") in ("done", "failed"):
+                status = job["status"]
+                break
+            time.sleep(args.poll_interval)
+        return {"upload": upload_done - started, "job": time.perf_counter() - started, "status": status}
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(one, range(args.uploads)))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for outcome in outcomes:
+        statuses[outcome["status"]] = statuses.get(outcome["status"], 0) + 1
+    results = {
+        "elapsed_seconds": round(elapsed, 3),
+        "statuses": statuses,
+        # Time until the 202 came back
+        "upload_request": summarize([o["upload"] for o in outcomes], elapsed),
+        # Upload start until the job reached done/failed (includes polling granularity)
+        "upload_to_done": summarize([o["job"] for o in outcomes if o["status"] == "done"], elapsed),
+    }
+    if args.events:
+        # Upload start until the first partial text arrived over SSE
+        results["upload_to_first_text"] = summarize([o["first_text"] for o in outcomes if "first_text" in o], elapsed)
+    params = {k: v for k, v in vars(args).items() if k not in ("output", "workdir")}
+    params["in_process"] = not args.base_url
+    write_report("load", params, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
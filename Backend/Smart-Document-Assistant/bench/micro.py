@@ -0,0 +1,59 @@
+# bench/micro.py
+"""
+Micro-benchmarks for hot helpers in ai_service:
+
+    python bench/micro.py --iterations 2000 --output micro.json
+"""
+import os
+import json
+import argparse
+from common import use_workdir, measure, write_report
+
+
+def _make_image(path: str, size: tuple):
+    """Write a noisy PNG so its size is realistic rather than trivially compressible."""
+    from PIL import Image
+    Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(path, "PNG")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--image-iterations", type=int, default=50)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    workdir = use_workdir()
+    from ai_service import _parse_json, _title_from_text, preprocess_image, encode_image
+
+    structured = json.dumps({"title": "Invoice 2024-113", "text": "Line item " * 400})
+    fenced = f"```json\n{structured}\n```"
+    long_text = "\n".join(["", "12", "Quarterly report: revenue, costs and outlook for the northern region"]
+                          + ["body line with several words"] * 2000)
+
+    small_png = os.path.join(workdir, "small.png")
+    large_png = os.path.join(workdir, "large.png")
+    _make_image(small_png, (640, 480))
+    _make_image(large_png, (2048, 1536))
+    small_img, large_img = preprocess_image(small_png), preprocess_image(large_png)
+
+    n = args.iterations
+    results = {
+        "parse_json.structured": measure(lambda: _parse_json(structured), n, warmup=10),
+        "parse_json.code_fence": measure(lambda: _parse_json(fenced), n, warmup=10),
+        "parse_json.truncated": measure(lambda: _parse_json(structured[:-20]), n, warmup=10),
+        "title_from_text.short": measure(lambda: _title_from_text("Receipt\nTotal 12.50"), n, warmup=10),
+        "title_from_text.long": measure(lambda: _title_from_text(long_text), n, warmup=10),
+        "encode_image.640x480": measure(lambda: encode_image(small_img), args.image_iterations, warmup=2),
+        "encode_image.2048x1536": measure(lambda: encode_image(large_img), args.image_iterations, warmup=2),
+    }
+    params = {
+        "iterations": n,
+        "image_iterations": args.image_iterations,
+        "image_bytes": {"640x480": os.path.getsize(small_png), "2048x1536": os.path.getsize(large_png)},
+    }
+    write_report("micro", params, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
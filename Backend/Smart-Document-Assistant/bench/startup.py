@@ -0,0 +1,70 @@
+# bench/startup.py
+"""
+Cold-start benchmark: each run is a fresh interpreter that imports the app
+(which builds it with create_app()) and serves one request through the test client.
+
+    python bench/startup.py --runs 10 --target-ms 500 --output startup.json
+
+Exits with status 1 if the p50 of import + first request exceeds --target-ms.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from common import BACKEND_DIR, use_workdir, summarize, write_report
+
+CHILD = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get("/api/health")
+served = time.perf_counter()
+print(json.dumps({"import": imported - started, "first_request": served - imported, "status": response.status_code}))
+"""
+
+
+def _run_once(env: dict) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, timeout=120, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _measure(runs: int, extra_env: dict) -> dict:
+    env = dict(os.environ, PYTHONPATH=str(BACKEND_DIR), LOG_LEVEL="WARNING", **extra_env)
+    _run_once(env)  # warm the OS file cache and write the .pyc files
+    samples = [_run_once(env) for _ in range(runs)]
+    return {
+        "import": summarize([s["import"] for s in samples]),
+        "first_request": summarize([s["first_request"] for s in samples]),
+        "total": summarize([s["import"] + s["first_request"] for s in samples]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--target-ms", type=float, default=500)
+    parser.add_argument("--workdir")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    use_workdir(args.workdir)
+    from db import init_db
+    init_db()
+
+    results = {
+        "swagger_on": _measure(args.runs, {"SWAGGER_UI": "1"}),
+        "swagger_off": _measure(args.runs, {"SWAGGER_UI": "0"}),
+    }
+    p50 = results["swagger_on"]["total"]["p50_ms"]
+    results["target_met"] = p50 <= args.target_ms
+    write_report("startup", {"runs": args.runs, "target_ms": args.target_ms}, results, args.output)
+    if not results["target_met"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
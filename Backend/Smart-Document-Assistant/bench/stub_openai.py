@@ -0,0 +1,135 @@
+# bench/stub_openai.py
+"""
+Local stand-in for the OpenAI chat completions endpoint with configurable latency.
+
+    python bench/stub_openai.py --port 8765 --latency 0.8 --jitter 0.2 --error-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python app.py
+
+--latency is the time to the first token. Like a real model the answer is then
+generated in chunks of STREAM_CHUNK_CHARS, one per --token-interval: streamed
+requests (stream=true) receive them as they are produced, others when all are done.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+STREAM_CHUNK_CHARS = 16
+
+
+class StubOpenAI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.5, jitter: float = 0.0, error_rate: float = 0.0,
+                 token_interval: float = 0.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_interval = token_interval
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, n: int, chunks: list, usage: dict):
+        """Server-sent chat.completion.chunk events, ending with a usage chunk and [DONE]."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def event(choices: list, **extra):
+            chunk = {"id": f"chatcmpl-stub-{n}", "object": "chat.completion.chunk",
+                     "created": int(time.time()), "model": "stub", "choices": choices, **extra}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        for i, content in enumerate(chunks):
+            if i:
+                time.sleep(self.server.token_interval)
+            event([{"index": 0, "delta": {"content": content}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        event([], usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        request_bytes = len(raw)
+        stream = bool(json.loads(raw or b"{}").get("stream"))
+        with server._lock:
+            server.requests += 1
+            n = server.requests
+
+        time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        if random.random() < server.error_rate:
+            self._send_json(503, {"error": {"message": "stub overloaded", "type": "server_error"}})
+            return
+
+        content = json.dumps({"title": f"Stub Document {n}", "text": f"stub extracted text for request {n}"})
+        chunks = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+        # Roughly what an image of this size would cost, so usage numbers aren't zero
+        usage = {"prompt_tokens": request_bytes // 1000 + 85, "completion_tokens": 20,
+                 "total_tokens": request_bytes // 1000 + 105}
+        if stream:
+            self._send_stream(n, chunks, usage)
+            return
+
+        time.sleep(server.token_interval * (len(chunks) - 1))
+        self._send_json(200, {
+            "id": f"chatcmpl-stub-{n}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "stub",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+
+def start(port: int = 0, latency: float = 0.5, jitter: float = 0.0, error_rate: float = 0.0,
+          token_interval: float = 0.0) -> StubOpenAI:
+    """Start the stub in a daemon thread; port 0 picks a free one."""
+    server = StubOpenAI(("127.0.0.1", port), latency, jitter, error_rate, token_interval)
+    threading.Thread(target=server.serve_forever, name="stub-openai", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds to the first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds added to latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="seconds between generated chunks")
+    args = parser.parse_args()
+
+    server = StubOpenAI(("127.0.0.1", args.port), args.latency, args.jitter, args.error_rate, args.token_interval)
+    print(f"Stub OpenAI listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,198 @@
 # db.py
+import os
+import queue
 import sqlite3
+import logging
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from metrics import Gauge, Histogram, DB_BUCKETS, request_stats
+import text_store
+
+# Logger setup
+logger = logging.getLogger("db")
+logger.setLevel(logging.INFO)
 
 DB_PATH = Path("data") / "app.db"
-DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Per-connection prepared statement cache (sqlite3 reuses compiled statements by SQL text)
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+# Query metrics (see /metrics); the statement label is the leading SQL keyword
+db_query_seconds = Histogram("db_query_duration_seconds", "Time spent executing SQL statements",
+                             ["statement"], buckets=DB_BUCKETS)
+db_pool_wait_seconds = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection",
+                                 buckets=DB_BUCKETS)
+_STATEMENTS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+def _observe_query(sql, started):
+    elapsed = time.perf_counter() - started
+    verb = sql.lstrip()[:7].split(None, 1)[0].upper() if sql.strip() else ""
+    db_query_seconds.observe(elapsed, statement=verb if verb in _STATEMENTS else "OTHER")
+    stats = request_stats.get()
+    if stats is not None:
+        stats["queries"] += 1
+        stats["seconds"] += elapsed
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that records the duration of each execute (row fetching is not included)."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe_query(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe_query(sql, started)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors, including those behind conn.execute(), are instrumented."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
 
 def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    """Open a standalone connection with the standard pragmas applied."""
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_STATEMENT_CACHE,
+        factory=InstrumentedConnection,
+    )
     conn.row_factory = sqlite3.Row
+    # Decompresses document_text rows inside SQL (the full-text index reads text through it)
+    conn.create_function(text_store.SQL_FUNCTION, 2, text_store.decode, deterministic=True)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
     return conn
 
+class ConnectionPool:
+    """
+    Bounded pool of long-lived SQLite connections.
+    Connections are opened lazily up to `size`; callers block (up to `timeout`)
+    when all of them are checked out.
+    """
+
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return get_conn()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        started = time.perf_counter()
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"no database connection available after {self.timeout}s")
+        finally:
+            db_pool_wait_seconds.observe(time.perf_counter() - started)
+
+    def counts(self):
+        """{(state,): n} of open and idle connections, for the pool gauge."""
+        return {("open",): self._opened, ("idle",): self._idle.qsize()}
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._opened = 0
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commit on success, roll back on error."""
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+pool = ConnectionPool()
+Gauge("db_pool_connections", "Pooled SQLite connections", ["state"], collect=lambda: pool.counts())
+
+def _new_pool_after_fork():
+    """SQLite connections must not cross a fork; the child opens its own."""
+    global pool
+    pool = ConnectionPool()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_new_pool_after_fork)
+
+def connection():
+    """Context manager for a pooled connection: `with connection() as conn: ...`"""
+    return pool.connection()
+
+# Length of the text preview stored with each document for list views
+PREVIEW_CHARS = int(os.getenv("PREVIEW_CHARS", "200"))
+# Rows per transaction when moving inline text of older databases to document_text
+TEXT_MIGRATION_BATCH = int(os.getenv("TEXT_MIGRATION_BATCH", "1000"))
+
+def make_preview(text):
+    """Short single-line preview of extracted text."""
+    return " ".join((text or "").split())[:PREVIEW_CHARS]
+
+def _has_column(cur, table, column):
+    cur.execute(f"PRAGMA table_info({table})")
+    return column in {row["name"] for row in cur.fetchall()}
+
+def _ensure_column(cur, table, column, ddl):
+    """Add a column to an existing table if an older database lacks it. Returns True if added."""
+    if not _has_column(cur, table, column):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+        return True
+    return False
+
 def init_db():
+    """Create or upgrade the schema. Run once per deployment: `python db.py init`."""
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("""
@@ -18,20 +200,58 @@ def init_db():
         user_id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE NOT NULL,
         password TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL
+        email TEXT UNIQUE NOT NULL,
+        docs_version INTEGER NOT NULL DEFAULT 0
     );
     """)
+    # Bumped by the triggers below with every write to the user's documents (see metadata_cache.py)
+    _ensure_column(cur, "users", "docs_version", "INTEGER NOT NULL DEFAULT 0")
     cur.execute("""
     CREATE TABLE IF NOT EXISTS documents (
         doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
         title TEXT NOT NULL,
         file_path TEXT NOT NULL,
-        extracted_text TEXT,
         upload_date TEXT DEFAULT CURRENT_TIMESTAMP,
+        status TEXT NOT NULL DEFAULT 'done',
+        content_hash TEXT,
+        text_preview TEXT,
         FOREIGN KEY(user_id) REFERENCES users(user_id)
     );
     """)
+    _ensure_column(cur, "documents", "status", "TEXT NOT NULL DEFAULT 'done'")
+    _ensure_column(cur, "documents", "content_hash", "TEXT")
+    if _ensure_column(cur, "documents", "text_preview", "TEXT"):
+        cur.execute("SELECT doc_id, extracted_text FROM documents")
+        cur.executemany(
+            "UPDATE documents SET text_preview=? WHERE doc_id=?",
+            [(make_preview(row["extracted_text"]), row["doc_id"]) for row in cur.fetchall()]
+        )
+    # vision, ocr, none, text_layer or mixed (PDF/TIFF pages); NULL for documents extracted before it was recorded
+    _ensure_column(cur, "documents", "extraction_source", "TEXT")
+    # Set when the owning account is deleted; file_gc.py purges marked rows in batches
+    _ensure_column(cur, "documents", "deleted_at", "TEXT")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents(content_hash)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_file_path ON documents(file_path)")
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_documents_deleted
+    ON documents(deleted_at) WHERE deleted_at IS NOT NULL
+    """)
+    for name, event, user_id in (
+        ("documents_version_ai", "AFTER INSERT ON documents", "new.user_id"),
+        ("documents_version_au", "AFTER UPDATE ON documents", "new.user_id"),
+        ("documents_version_ad", "AFTER DELETE ON documents", "old.user_id"),
+    ):
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN
+            UPDATE users SET docs_version = docs_version + 1 WHERE user_id = {user_id};
+        END;
+        """)
+    # Serves the per-user list view (keyset pagination on upload_date, doc_id)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_documents_user_date
+    ON documents(user_id, upload_date DESC, doc_id DESC)
+    """)
 
     cur.execute("""
     CREATE TABLE IF NOT EXISTS uploads (
@@ -43,9 +263,354 @@ def init_db():
         FOREIGN KEY(user_id) REFERENCES users(user_id)
     );
     """)
+
+    # Files of deleted documents waiting for the collector (file_gc.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS file_gc (
+        file_path TEXT PRIMARY KEY,
+        content_hash TEXT,
+        queued_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+    # Checkpoints of re-extraction runs (reextract.py); run_id is derived from the filters
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS reextract_runs (
+        run_id TEXT PRIMARY KEY,
+        filters TEXT NOT NULL,
+        last_doc_id INTEGER NOT NULL DEFAULT 0,
+        processed INTEGER NOT NULL DEFAULT 0,
+        changed INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        finished_at TEXT
+    );
+    """)
+
+    # Live documents per stored file (storage.py); at zero the file is queued in file_gc
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name='blobs'")
+    blobs_missing = cur.fetchone() is None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS blobs (
+        key TEXT PRIMARY KEY,
+        content_hash TEXT,
+        refcount INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_blobs_content_hash ON blobs(content_hash)")
+    if blobs_missing:
+        cur.execute("""
+        INSERT INTO blobs (key, content_hash, refcount)
+        SELECT file_path, MAX(content_hash), COUNT(*) FROM documents
+        WHERE deleted_at IS NULL GROUP BY file_path
+        """)
+    blob_acquire = """
+        INSERT INTO blobs (key, content_hash, refcount) VALUES (new.file_path, new.content_hash, 1)
+        ON CONFLICT(key) DO UPDATE SET refcount = refcount + 1;"""
+    blob_release = """
+        UPDATE blobs SET refcount = refcount - 1 WHERE key = old.file_path;"""
+    for name, event, body in (
+        ("documents_blob_ai", "AFTER INSERT ON documents WHEN new.deleted_at IS NULL", blob_acquire),
+        ("documents_blob_ad", "AFTER DELETE ON documents WHEN old.deleted_at IS NULL", blob_release),
+        ("documents_blob_mark", "AFTER UPDATE OF deleted_at ON documents "
+                                "WHEN old.deleted_at IS NULL AND new.deleted_at IS NOT NULL", blob_release),
+        ("documents_blob_move", "AFTER UPDATE OF file_path ON documents "
+                                "WHEN new.deleted_at IS NULL AND new.file_path <> old.file_path",
+         blob_release + blob_acquire),
+        ("blobs_unreferenced", "AFTER UPDATE OF refcount ON blobs WHEN new.refcount <= 0", """
+        INSERT OR IGNORE INTO file_gc (file_path, content_hash) VALUES (new.key, new.content_hash);"""),
+    ):
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN{body}\n    END;")
+
+    # Background extraction jobs (one per upload), polled via /api/jobs/<id>
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        doc_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        title TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        error TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(doc_id) REFERENCES documents(doc_id),
+        FOREIGN KEY(user_id) REFERENCES users(user_id)
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+
+    # AI extraction results keyed by image hash + model + prompts
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS extraction_cache (
+        cache_key TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        title TEXT NOT NULL,
+        extracted_text TEXT NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        last_used_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used ON extraction_cache(last_used_at)")
+
+    # Token usage and latency of every Vision call (cost per document via doc_id)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ai_calls (
+        call_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content_hash TEXT,
+        model TEXT NOT NULL,
+        detail TEXT,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        total_tokens INTEGER,
+        latency_ms INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        error TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ai_calls_content_hash ON ai_calls(content_hash)")
+    # The upload a call was made for; older rows only have the content hash
+    _ensure_column(cur, "ai_calls", "doc_id", "INTEGER")
+    _ensure_column(cur, "ai_calls", "job_id", "INTEGER")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ai_calls_doc ON ai_calls(doc_id)")
+
+    # Per-page text of multi-page uploads (PDF/TIFF); source is 'text_layer' or 'image'
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS document_pages (
+        page_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        doc_id INTEGER NOT NULL,
+        page_no INTEGER NOT NULL,
+        text TEXT NOT NULL DEFAULT '',
+        source TEXT NOT NULL,
+        image_path TEXT,
+        UNIQUE (doc_id, page_no)
+    );
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS documents_pages_ad AFTER DELETE ON documents BEGIN
+        DELETE FROM document_pages WHERE doc_id = old.doc_id;
+    END;
+    """)
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS document_pages_fts USING fts5(
+        text, content='document_pages', content_rowid='page_id'
+    );
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS document_pages_fts_ai AFTER INSERT ON document_pages BEGIN
+        INSERT INTO document_pages_fts(rowid, text) VALUES (new.page_id, new.text);
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS document_pages_fts_ad AFTER DELETE ON document_pages BEGIN
+        INSERT INTO document_pages_fts(document_pages_fts, rowid, text) VALUES ('delete', old.page_id, old.text);
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS document_pages_fts_au AFTER UPDATE OF text ON document_pages BEGIN
+        INSERT INTO document_pages_fts(document_pages_fts, rowid, text) VALUES ('delete', old.page_id, old.text);
+        INSERT INTO document_pages_fts(rowid, text) VALUES (new.page_id, new.text);
+    END;
+    """)
+
+    # Embeddings of overlapping text chunks for semantic search (see semantic_index.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS document_chunks (
+        chunk_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        doc_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        chunk_no INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        model TEXT NOT NULL,
+        embedding BLOB NOT NULL
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_document_chunks_user ON document_chunks(user_id, model)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_document_chunks_doc ON document_chunks(doc_id)")
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS documents_chunks_ad AFTER DELETE ON documents BEGIN
+        DELETE FROM document_chunks WHERE doc_id = old.doc_id;
+    END;
+    """)
+
+    # Full text of each document, compressed (see text_store.py); read only on demand
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS document_text (
+        doc_id INTEGER PRIMARY KEY,
+        codec TEXT NOT NULL,
+        body BLOB NOT NULL
+    );
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS documents_text_ad AFTER DELETE ON documents BEGIN
+        DELETE FROM document_text WHERE doc_id = old.doc_id;
+    END;
+    """)
+    # What the full-text index covers: title plus decompressed text
+    cur.execute(f"""
+    CREATE VIEW IF NOT EXISTS documents_fts_content AS
+    SELECT d.doc_id, d.title, {text_store.SQL_FUNCTION}(t.codec, t.body) AS extracted_text
+    FROM documents d LEFT JOIN document_text t ON t.doc_id = d.doc_id
+    """)
+
+    # Older databases kept the text inline and indexed the documents table directly
+    cur.execute("SELECT sql FROM sqlite_master WHERE name='documents_fts'")
+    fts = cur.fetchone()
+    if fts and "documents_fts_content" not in fts["sql"]:
+        for trigger in ("documents_fts_ai", "documents_fts_ad", "documents_fts_au"):
+            cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cur.execute("DROP TABLE documents_fts")
     conn.commit()
+    report = None
+    if _has_column(cur, "documents", "extracted_text"):
+        report = migrate_text(conn)
+
+    # Full-text index over documents_fts_content, kept in sync by triggers on both tables.
+    # BEFORE triggers remove the entry as currently indexed, AFTER triggers add the new one.
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name='documents_fts'")
+    fts_missing = cur.fetchone() is None
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+        title, extracted_text,
+        content='documents_fts_content', content_rowid='doc_id'
+    );
+    """)
+    fts_delete = """
+        INSERT INTO documents_fts(documents_fts, rowid, title, extracted_text)
+        SELECT 'delete', doc_id, title, extracted_text FROM documents_fts_content WHERE doc_id = old.doc_id;"""
+    fts_insert = """
+        INSERT INTO documents_fts(rowid, title, extracted_text)
+        SELECT doc_id, title, extracted_text FROM documents_fts_content WHERE doc_id = new.doc_id;"""
+    for name, event, body in (
+        ("documents_fts_ai", "AFTER INSERT ON documents", fts_insert),
+        ("documents_fts_bu", "BEFORE UPDATE OF title ON documents", fts_delete),
+        ("documents_fts_au", "AFTER UPDATE OF title ON documents", fts_insert),
+        ("documents_fts_bd", "BEFORE DELETE ON documents", fts_delete),
+        ("document_text_fts_bi", "BEFORE INSERT ON document_text", fts_delete.replace("old.", "new.")),
+        ("document_text_fts_ai", "AFTER INSERT ON document_text", fts_insert),
+        ("document_text_fts_bu", "BEFORE UPDATE ON document_text", fts_delete),
+        ("document_text_fts_au", "AFTER UPDATE ON document_text", fts_insert),
+        ("document_text_fts_bd", "BEFORE DELETE ON document_text", fts_delete),
+    ):
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN{body}\n    END;")
+    if fts_missing:
+        cur.execute("INSERT INTO documents_fts(documents_fts) VALUES ('rebuild')")
+    conn.commit()
+    conn.close()
+    return report
+
+def _table_pages(conn):
+    """{table or index name: pages} from the dbstat virtual table."""
+    rows = conn.execute("SELECT name, COUNT(*) AS pages FROM dbstat GROUP BY name").fetchall()
+    return {row["name"]: row["pages"] for row in rows}
+
+def storage_report(conn=None):
+    """Database size and the pages a full scan of documents / document_text reads."""
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        pages = _table_pages(conn)
+        text = conn.execute("""
+            SELECT COUNT(*) AS n, COALESCE(SUM(length(body)), 0) AS stored FROM document_text
+        """).fetchone() if "document_text" in pages else {"n": 0, "stored": 0}
+        return {
+            "db_bytes": page_size * page_count,
+            "free_bytes": page_size * freelist,
+            "page_size": page_size,
+            "documents_scan_pages": pages.get("documents", 0),
+            "document_text_pages": pages.get("document_text", 0),
+            "document_text_rows": text["n"],
+            "document_text_stored_bytes": text["stored"],
+        }
+    finally:
+        if own:
+            conn.close()
+
+def migrate_text(conn, batch_size=TEXT_MIGRATION_BATCH):
+    """
+    Move documents.extracted_text of an older database into document_text, one
+    transaction per batch (safe to interrupt and re-run), then drop the column.
+    Returns a before/after storage report.
+    """
+    before = storage_report(conn)
+    moved = raw_bytes = stored_bytes = 0
+    last_id = 0
+    while True:
+        rows = conn.execute("""
+            SELECT doc_id, extracted_text FROM documents
+            WHERE doc_id > ? AND extracted_text IS NOT NULL
+            ORDER BY doc_id LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        texts = [(row["doc_id"], row["extracted_text"]) for row in rows if row["extracted_text"]]
+        encoded = [(doc_id, *text_store.encode(text)) for doc_id, text in texts]
+        conn.executemany("""
+            INSERT INTO document_text (doc_id, codec, body) VALUES (?, ?, ?)
+            ON CONFLICT(doc_id) DO UPDATE SET codec=excluded.codec, body=excluded.body
+        """, encoded)
+        conn.executemany("UPDATE documents SET extracted_text=NULL WHERE doc_id=?", [(row["doc_id"],) for row in rows])
+        conn.commit()
+        moved += len(encoded)
+        raw_bytes += sum(len(text.encode("utf-8")) for _, text in texts)
+        stored_bytes += sum(len(body) for _, _, body in encoded)
+        last_id = rows[-1]["doc_id"]
+        logger.info(f"Moved text of {moved} documents to document_text (up to doc_id {last_id})")
+
+    try:
+        conn.execute("ALTER TABLE documents DROP COLUMN extracted_text")
+        conn.commit()
+    except sqlite3.OperationalError as e:  # SQLite < 3.35; the column just stays empty
+        logger.warning(f"Could not drop documents.extracted_text: {e}")
+    # The emptied pages of documents are only released by VACUUM
+    logger.info("Text migration done; run `python db.py vacuum` to compact the documents table")
+    return {
+        "documents_migrated": moved,
+        "text_raw_bytes": raw_bytes,
+        "text_stored_bytes": stored_bytes,
+        "before": before,
+        "after": storage_report(conn),
+    }
+
+def rebuild_fts():
+    """Rebuild the full-text indexes from documents_fts_content and document_pages."""
+    conn = get_conn()
+    conn.execute("INSERT INTO documents_fts(documents_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO document_pages_fts(document_pages_fts) VALUES ('rebuild')")
+    conn.commit()
+    count = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
     conn.close()
+    return count
+
+def fts_match_query(text):
+    """Turn free-form user input into a safe FTS5 query (every term quoted, AND-ed)."""
+    terms = [t.replace('"', '""') for t in text.split()]
+    return " ".join(f'"{t}"' for t in terms if t)
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument("command", choices=["init", "rebuild-fts", "storage-report", "vacuum"])
+    args = parser.parse_args()
 
-# Initialize tables on import
-init_db()
+    if args.command == "init":
+        report = init_db()
+        if report:
+            print(json.dumps(report, indent=2))
+        print(f"Schema ready in {DB_PATH}")
+    elif args.command == "storage-report":
+        print(json.dumps(storage_report(), indent=2))
+    elif args.command == "vacuum":  # returns the free pages left by migrations and deletions to the OS
+        conn = get_conn()
+        conn.execute("VACUUM")
+        conn.close()
+        print(json.dumps(storage_report(), indent=2))
+    elif args.command == "rebuild-fts":
+        print(f"Indexed {rebuild_fts()} documents")
     
\ No newline at end of file
@@ -0,0 +1,105 @@
+# derivatives.py
+"""
+WebP thumbnails and previews of uploaded images.
+Derivatives are local files under a content-addressed name,
+uploads/derived/<ab>/<cd>/<sha256>-<kind>-<size>-v<version>.webp, so documents sharing
+stored content share their derivatives and a settings change gets a new name.
+Rendering reads the original through storage.local_path (a temp copy for remote backends).
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PIL import Image, ImageOps
+from metrics import Counter, Histogram
+import paged_files
+import storage
+
+# Logger setup
+logger = logging.getLogger("derivatives")
+logger.setLevel(logging.INFO)
+
+# Longest side in pixels per derivative kind
+SIZES = {
+    "thumbnail": int(os.getenv("THUMBNAIL_SIZE", "256")),
+    "preview": int(os.getenv("PREVIEW_SIZE", "1024")),
+}
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+# Bump when the rendering changes so existing files are not served as current
+DERIVATIVE_VERSION = 1
+
+_executor = ThreadPoolExecutor(max_workers=DERIVATIVE_WORKERS, thread_name_prefix="derivative-worker")
+
+# One lock per output file so concurrent requests render it once
+_locks = {}
+_locks_guard = threading.Lock()
+
+derivatives_generated = Counter("derivatives_generated_total", "Derivatives rendered", ["kind", "trigger"])
+derivative_seconds = Histogram("derivative_duration_seconds", "Time to render one derivative", ["kind"])
+
+
+def derivative_path(content_hash: str, kind: str) -> Path:
+    """Content-addressed location of a derivative."""
+    name = f"{content_hash}-{kind}-{SIZES[kind]}-v{DERIVATIVE_VERSION}.webp"
+    return storage.shard_dir("derived", content_hash) / name
+
+
+def _render(original: str, dest: Path, max_dim: int):
+    """Downscale the first frame and write it as WebP via a temp file and rename."""
+    with paged_files.first_page_image(original) if paged_files.is_paged(original) else Image.open(original) as img:
+        img.seek(0)
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+        img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f"{dest.name}.{threading.get_ident()}.part")
+        try:
+            img.save(tmp, "WEBP", quality=DERIVATIVE_QUALITY, method=4)
+            tmp.replace(dest)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+
+def ensure(original: str, content_hash: str, kind: str, trigger: str = "lazy") -> Path:
+    """Return the derivative's path, rendering it first if it does not exist yet (`original` is a storage key)."""
+    dest = derivative_path(content_hash, kind)
+    if dest.exists():
+        return dest
+
+    with _locks_guard:
+        lock = _locks.setdefault(str(dest), threading.Lock())
+    try:
+        with lock:
+            if not dest.exists():  # another request may have rendered it meanwhile
+                started = time.perf_counter()
+                with storage.local_path(original) as path:
+                    _render(path, dest, SIZES[kind])
+                derivative_seconds.observe(time.perf_counter() - started, kind=kind)
+                derivatives_generated.inc(kind=kind, trigger=trigger)
+    finally:
+        with _locks_guard:
+            if _locks.get(str(dest)) is lock:  # a later caller may have replaced it
+                del _locks[str(dest)]
+    return dest
+
+
+def _generate_all(original: str, content_hash: str):
+    for kind in SIZES:
+        try:
+            ensure(original, content_hash, kind, trigger="upload")
+        except Exception as e:
+            logger.warning(f"Could not render {kind} for {original}: {e}")
+
+
+def schedule(original, content_hash: str):
+    """Render all derivatives of a new upload in the background."""
+    _executor.submit(_generate_all, str(original), content_hash)
+
+
+def remove(content_hash: str):
+    """Delete the derivatives of content that is being removed."""
+    for kind in SIZES:
+        derivative_path(content_hash, kind).unlink(missing_ok=True)
@@ -0,0 +1,124 @@
+# extraction_cache.py
+import os
+import hashlib
+import logging
+import threading
+from typing import Optional, Tuple
+from db import connection
+from metrics import Counter, Gauge
+
+# Logger setup
+logger = logging.getLogger("extraction_cache")
+logger.setLevel(logging.INFO)
+
+# Eviction limits: whichever is hit first removes entries
+CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_DAYS = int(os.getenv("EXTRACTION_CACHE_TTL_DAYS", "30"))
+
+# In-process hit/miss counters (exposed via /metrics and /api/cache/stats)
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+cache_events = Counter("extraction_cache_events_total", "Extraction cache lookups, stores and evictions", ["event"])
+
+
+def _count(name: str, n: int = 1):
+    with _stats_lock:
+        _stats[name] += n
+    cache_events.inc(n, event=name)
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's bytes, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(content_hash: str, *parts: str) -> str:
+    """Cache key = content hash combined with everything that shapes the result (model, prompts)."""
+    h = hashlib.sha256(content_hash.encode())
+    for part in parts:
+        h.update(b"\0" + part.encode())
+    return h.hexdigest()
+
+
+def get(key: str) -> Optional[Tuple[str, str]]:
+    """Return cached (title, text) for a key, or None."""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT title, extracted_text FROM extraction_cache
+                WHERE cache_key=? AND created_at >= datetime('now', ?)
+            """, (key, f"-{CACHE_TTL_DAYS} days"))
+            row = cur.fetchone()
+            if row:
+                cur.execute("""
+                    UPDATE extraction_cache
+                    SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+                    WHERE cache_key=?
+                """, (key,))
+    except Exception as e:
+        logger.error(f"Cache lookup failed: {e}")
+        return None
+
+    _count("hits" if row else "misses")
+    return (row["title"], row["extracted_text"]) if row else None
+
+
+def put(key: str, content_hash: str, title: str, text: str):
+    """Store an extraction result and apply eviction."""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT OR REPLACE INTO extraction_cache (cache_key, content_hash, title, extracted_text)
+                VALUES (?, ?, ?, ?)
+            """, (key, content_hash, title, text))
+            _count("stores")
+            _evict(cur)
+    except Exception as e:
+        logger.error(f"Cache store failed: {e}")
+
+
+def _evict(cur):
+    """Drop expired entries, then the least recently used ones above the size limit."""
+    cur.execute(
+        "DELETE FROM extraction_cache WHERE created_at < datetime('now', ?)",
+        (f"-{CACHE_TTL_DAYS} days",),
+    )
+    evicted = cur.rowcount
+    cur.execute("SELECT COUNT(*) FROM extraction_cache")
+    excess = cur.fetchone()[0] - CACHE_MAX_ENTRIES
+    if excess > 0:
+        cur.execute("""
+            DELETE FROM extraction_cache WHERE cache_key IN (
+                SELECT cache_key FROM extraction_cache
+                ORDER BY last_used_at ASC LIMIT ?
+            )
+        """, (excess,))
+        evicted += cur.rowcount
+    if evicted:
+        _count("evictions", evicted)
+
+
+def stats() -> dict:
+    """Hit/miss counters for this process plus the current cache size."""
+    with _stats_lock:
+        result = dict(_stats)
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = round(result["hits"] / lookups, 4) if lookups else 0.0
+
+    result["entries"] = entry_count()
+    return result
+
+
+def entry_count() -> int:
+    """Rows in the cache table, across all processes sharing the database."""
+    with connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+
+
+Gauge("extraction_cache_entries", "Cached extraction results", collect=entry_count)
@@ -0,0 +1,290 @@
+# file_gc.py
+"""
+Deferred removal of deleted documents and their files.
+Deletions only touch the database: account deletion marks the user's documents
+(documents.deleted_at) in one set-based transaction; deleting a single document
+removes its row. Either way the blobs triggers (db.py) drop the reference counts
+and queue files that no live document uses any more in file_gc.
+A background collector then purges marked rows and removes queued files in
+batches, re-checking each count under the write lock (identical uploads share
+one stored file, see storage.py). A periodic reconciler lists the stored objects
+and queues those without a blobs row, e.g. leftovers of crashes.
+"""
+import os
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+from db import connection
+from metrics import Counter, Gauge
+import derivatives
+import paged_files
+import storage
+
+# Logger setup
+logger = logging.getLogger("file_gc")
+logger.setLevel(logging.INFO)
+
+GC_INTERVAL = int(os.getenv("GC_INTERVAL", "60"))
+GC_BATCH_SIZE = int(os.getenv("GC_BATCH_SIZE", "500"))
+# Seconds between upload folder scans (0 disables the reconciler)
+GC_RECONCILE_INTERVAL = int(os.getenv("GC_RECONCILE_INTERVAL", str(6 * 3600)))
+# Unreferenced objects and temp files younger than this are left alone: uploads
+# publish their object right after inserting the row
+GC_GRACE_SECONDS = int(os.getenv("GC_GRACE_SECONDS", "3600"))
+# Set to 0 to run collection only through the CLI (e.g. from cron)
+GC_ENABLED = os.getenv("GC_ENABLED", "1") == "1"
+
+files_removed = Counter("gc_files_removed_total", "Files removed by the collector", ["reason"])
+documents_purged = Counter("gc_documents_purged_total", "Deleted document rows purged by the collector")
+
+_wakeup = threading.Event()
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _queue_depth() -> int:
+    with connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM file_gc").fetchone()[0]
+
+
+Gauge("gc_queue_depth", "Files waiting for the collector", collect=_queue_depth)
+
+
+# ---------- Queueing (called inside the deleting transaction) ----------
+def queue_file(cur, file_path: str, content_hash: Optional[str]):
+    """Queue one file for removal once nothing references it (the blobs triggers do this on delete)."""
+    if file_path:
+        cur.execute(
+            "INSERT OR IGNORE INTO file_gc (file_path, content_hash) VALUES (?, ?)",
+            (file_path, content_hash),
+        )
+
+
+def queue_user_deletion(cur, user_id) -> int:
+    """
+    Mark all documents of a user deleted (which queues files left unreferenced) and
+    drop their jobs and upload records. Set-based, so the cost does not grow with
+    file I/O. Returns the number of documents marked.
+    """
+    cur.execute(
+        "UPDATE documents SET deleted_at=CURRENT_TIMESTAMP WHERE user_id=? AND deleted_at IS NULL",
+        (user_id,),
+    )
+    marked = cur.rowcount
+    cur.execute("DELETE FROM jobs WHERE user_id=?", (user_id,))
+    cur.execute("DELETE FROM uploads WHERE user_id=?", (user_id,))
+    return marked
+
+
+def wake():
+    """Run the background collector now instead of at its next interval."""
+    _wakeup.set()
+
+
+# ---------- Collection ----------
+def _purge_rows(batch_size: int) -> int:
+    """Delete one batch of marked document rows (triggers clean FTS, pages and chunks)."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT doc_id FROM documents WHERE deleted_at IS NOT NULL LIMIT ?",
+            (batch_size,),
+        )
+        ids = [row["doc_id"] for row in cur.fetchall()]
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+        cur.execute(f"DELETE FROM jobs WHERE doc_id IN ({marks})", ids)
+        cur.execute(f"DELETE FROM documents WHERE doc_id IN ({marks})", ids)
+    documents_purged.inc(len(ids))
+    return len(ids)
+
+
+def _remove_file(file_path: str, content_hash: Optional[str]) -> bool:
+    """
+    Remove one queued file if it is still unreferenced. The check, the removal and
+    the dequeue share one write transaction, so an upload of the same content
+    either runs first (and keeps the file) or publishes it again afterwards.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM blobs WHERE key=? AND refcount <= 0", (file_path,))
+        cur.execute("DELETE FROM file_gc WHERE file_path=?", (file_path,))
+        cur.execute("SELECT 1 FROM blobs WHERE key=?", (file_path,))
+        if cur.fetchone():
+            return False
+        storage.delete(file_path)
+        if content_hash:
+            cur.execute("SELECT 1 FROM blobs WHERE content_hash=? AND refcount > 0 LIMIT 1", (content_hash,))
+            if not cur.fetchone():  # derived files are shared by every copy of the content
+                derivatives.remove(content_hash)
+                paged_files.remove_pages(content_hash)
+    return True
+
+
+def _remove_files(batch_size: int) -> int:
+    """Remove one batch of queued files that no live document references."""
+    with connection() as conn:
+        queued = conn.execute(
+            "SELECT file_path, content_hash FROM file_gc ORDER BY queued_at LIMIT ?", (batch_size,)
+        ).fetchall()
+
+    removed = 0
+    for row in queued:
+        try:
+            removed += _remove_file(row["file_path"], row["content_hash"])
+        except Exception as e:
+            logger.warning(f"Failed to remove file {row['file_path']}: {e}")
+    files_removed.inc(removed, reason="deleted")
+    return len(queued)
+
+
+def collect(batch_size: int = GC_BATCH_SIZE) -> dict:
+    """Purge all marked rows and drain the file queue, one short transaction per batch."""
+    purged = processed = 0
+    while True:
+        n = _purge_rows(batch_size)
+        purged += n
+        if n < batch_size:
+            break
+    while True:
+        n = _remove_files(batch_size)
+        processed += n
+        if n < batch_size:
+            break
+    if purged or processed:
+        logger.info(f"Collected {purged} deleted documents and {processed} queued files")
+    return {"documents_purged": purged, "files_processed": processed}
+
+
+# ---------- Reconciliation ----------
+def _old_enough(path: Path, cutoff: float) -> bool:
+    try:
+        return path.stat().st_mtime < cutoff
+    except FileNotFoundError:
+        return False
+
+
+def _remove_stale(paths, cutoff: float, reason: str) -> int:
+    removed = 0
+    for path in paths:
+        if path.is_file() and _old_enough(path, cutoff):
+            path.unlink(missing_ok=True)
+            files_removed.inc(reason=reason)
+            removed += 1
+    return removed
+
+
+def reconcile(grace_seconds: int = GC_GRACE_SECONDS, batch_size: int = GC_BATCH_SIZE) -> dict:
+    """
+    Queue stored objects that have no blobs row and remove stale temp files,
+    derivatives and page images. Documents of users that no longer exist are marked
+    deleted first. Anything modified within `grace_seconds` is skipped.
+    """
+    counts = {"orphaned_documents": 0, "queued": 0, "removed": 0}
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE documents SET deleted_at=CURRENT_TIMESTAMP
+            WHERE deleted_at IS NULL AND user_id NOT IN (SELECT user_id FROM users)
+        """)
+        counts["orphaned_documents"] = cur.rowcount
+        cur.execute("DELETE FROM uploads WHERE user_id NOT IN (SELECT user_id FROM users)")
+
+    cutoff = time.time() - grace_seconds
+    counts["removed"] += _remove_stale(storage.TEMP_DIR.glob("*"), cutoff, "partial")
+
+    # Objects are checked against blobs in batches (listing order is arbitrary)
+    def queue_orphans(batch):
+        with connection() as conn:
+            cur = conn.cursor()
+            marks = ",".join("?" * len(batch))
+            cur.execute(f"SELECT key FROM blobs WHERE key IN ({marks})", batch)
+            known = {row["key"] for row in cur.fetchall()}
+            for key in batch:
+                if key not in known:
+                    queue_file(cur, key, None)
+        return len(batch) - len(known)
+
+    batch = []
+    for key, modified in storage.get_backend().iter_objects():
+        if modified < cutoff:
+            batch.append(key)
+        if len(batch) >= batch_size:
+            counts["queued"] += queue_orphans(batch)
+            batch = []
+    if batch:
+        counts["queued"] += queue_orphans(batch)
+
+    # Derivatives and page images are named <content_hash>-... in hash-sharded folders
+    for kind in ("derived", "pages"):
+        for shard in (storage.STORAGE_ROOT / kind).glob("*/*"):
+            files = list(shard.iterdir())
+            hashes = sorted({path.name.split("-", 1)[0] for path in files})
+            if not hashes:
+                continue
+            with connection() as conn:
+                marks = ",".join("?" * len(hashes))
+                live = {row["content_hash"] for row in conn.execute(
+                    f"SELECT DISTINCT content_hash FROM blobs WHERE content_hash IN ({marks}) AND refcount > 0",
+                    hashes,
+                )}
+            stale = [path for path in files if path.name.split("-", 1)[0] not in live]
+            counts["removed"] += _remove_stale(stale, cutoff, "orphan")
+
+    logger.info(
+        f"Reconciled storage: {counts['orphaned_documents']} orphaned documents, "
+        f"{counts['queued']} files queued, {counts['removed']} removed"
+    )
+    return counts
+
+
+# ---------- Background thread ----------
+def _loop():
+    next_reconcile = time.monotonic() + GC_RECONCILE_INTERVAL
+    while True:
+        _wakeup.wait(GC_INTERVAL)
+        _wakeup.clear()
+        try:
+            collect()
+            if GC_RECONCILE_INTERVAL and time.monotonic() >= next_reconcile:
+                reconcile()
+                next_reconcile = time.monotonic() + GC_RECONCILE_INTERVAL
+        except Exception as e:
+            logger.error(f"Garbage collection failed: {e}")
+
+
+def _forget_thread():
+    global _thread, _thread_lock
+    _thread = None
+    _thread_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_thread)
+
+
+def start():
+    """Start the collector thread (once per process; no-op when GC_ENABLED=0)."""
+    global _thread
+    if not GC_ENABLED:
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_loop, name="file-gc", daemon=True)
+            _thread.start()
+    wake()  # pick up work left by a previous run
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Deleted file collection")
+    parser.add_argument("command", choices=["collect", "reconcile"])
+    parser.add_argument("--grace-seconds", type=int, default=GC_GRACE_SECONDS)
+    args = parser.parse_args()
+
+    if args.command == "reconcile":
+        print(reconcile(args.grace_seconds))
+    print(collect())
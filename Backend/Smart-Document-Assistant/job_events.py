@@ -0,0 +1,273 @@
+# job_events.py
+"""
+Live progress of upload jobs, served as Server-Sent Events by
+GET /api/jobs/<id>/events. Events, in order:
+
+  status    {"status": "pending" | "processing"}; every stream starts with one
+  text      {"delta": "..."} partial text as Vision streams it, or the OCR result;
+            "page" is set for pages of PDFs and TIFFs
+  fallback  {"source": "ocr"} Vision failed or found nothing, so the text streamed
+            so far (of that page) is replaced by what follows
+  done      {"doc_id", "title", "text", "source"} once the result is stored
+  failed    {"error"}; also sent for a job cancelled because its document was deleted
+
+The stream ends after done/failed. Deltas are only a preview: the result is written
+to the database once, by the job, and "done" is sent after that commit.
+
+Channels live in the process that runs the job. Each keeps its events (consecutive
+deltas merged), so a client that connects late gets everything so far, and lingers
+EVENTS_LINGER seconds after the job ends. Without a channel here (job running in
+another process, or long finished) a stream polls the jobs table instead.
+"""
+import os
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+from db import connection
+import text_store
+
+# Logger setup
+logger = logging.getLogger("job_events")
+logger.setLevel(logging.INFO)
+
+EVENTS_LINGER = float(os.getenv("EVENTS_LINGER", "60"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "1"))
+
+TERMINAL = ("done", "failed")
+KEEPALIVE = ": keepalive\n\n"
+
+
+# ---------- Channels ----------
+class _Subscriber:
+    """Receives a channel's events on a thread queue, or on an asyncio queue bound to `loop`."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.loop = loop
+        self.queue = asyncio.Queue() if loop else queue.Queue()
+
+    def put(self, item):
+        if self.loop is None:
+            self.queue.put(item)
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:  # the loop is closed; nobody is listening any more
+            pass
+
+
+class _Channel:
+    def __init__(self):
+        self.history = [("status", {"status": "pending"})]
+        self.subscribers = set()
+        self.closed_at = None
+
+    def append(self, event: str, data: dict):
+        last_event, last_data = self.history[-1]
+        if event == "text" and last_event == "text" and last_data.get("page") == data.get("page"):
+            self.history[-1] = ("text", dict(last_data, delta=last_data["delta"] + data["delta"]))
+        else:
+            self.history.append((event, data))
+
+
+_channels: Dict[int, _Channel] = {}
+_lock = threading.Lock()
+
+
+def _expire(now: float):
+    for job_id in [j for j, c in _channels.items() if c.closed_at and now - c.closed_at > EVENTS_LINGER]:
+        del _channels[job_id]
+
+
+def start(job_id: int):
+    """Open the channel of a job about to be dispatched in this process."""
+    with _lock:
+        _expire(time.monotonic())
+        _channels[job_id] = _Channel()
+
+
+def publish(job_id: int, event: str, data: dict):
+    """Send an event to the job's subscribers (no-op if the job has no open channel here)."""
+    with _lock:
+        channel = _channels.get(job_id)
+        if channel is None or channel.closed_at:
+            return
+        channel.append(event, data)
+        for subscriber in channel.subscribers:
+            subscriber.put((event, data))
+
+
+def finish(job_id: int, event: str, data: dict):
+    """Publish the final done/failed event and close the channel."""
+    publish(job_id, event, data)
+    with _lock:
+        channel = _channels.get(job_id)
+        if channel is not None:
+            channel.closed_at = time.monotonic()
+
+
+def drop(job_id: int):
+    """Forget the channel of a job this process does not run after all; its streams poll the database."""
+    with _lock:
+        channel = _channels.pop(job_id, None)
+    if channel is not None:
+        for subscriber in channel.subscribers:
+            subscriber.put(None)
+
+
+def _subscribe(job_id: int, loop=None) -> Tuple[Optional[_Subscriber], list]:
+    """(subscriber, events so far), or (None, []) if the job has no channel here."""
+    with _lock:
+        channel = _channels.get(job_id)
+        if channel is None:
+            return None, []
+        subscriber = _Subscriber(loop)
+        channel.subscribers.add(subscriber)
+        return subscriber, list(channel.history)
+
+
+def _unsubscribe(job_id: int, subscriber: _Subscriber):
+    with _lock:
+        channel = _channels.get(job_id)
+        if channel is not None:
+            channel.subscribers.discard(subscriber)
+
+
+def _forget_channels():
+    global _channels, _lock
+    _channels = {}  # jobs of the parent process do not run in the child
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_channels)
+
+
+# ---------- Database state ----------
+def job_state(job_id: int) -> Tuple[str, dict]:
+    """The job's current state as an event: status, or done/failed with the stored result."""
+    with connection() as conn:
+        job = conn.execute("SELECT doc_id, status, error FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+        if job is None:
+            return "failed", {"error": "job no longer exists"}
+        if job["status"] in ("failed", "cancelled"):
+            return "failed", {"error": job["error"]}
+        if job["status"] != "done":
+            return "status", {"status": job["status"]}
+        doc = conn.execute(
+            "SELECT title, extraction_source FROM documents WHERE doc_id=?", (job["doc_id"],)
+        ).fetchone()
+        text = text_store.load(conn.cursor(), job["doc_id"]) or ""
+    return "done", {
+        "doc_id": job["doc_id"],
+        "title": doc["title"] if doc else "",
+        "text": text,
+        "source": doc["extraction_source"] if doc else None,
+    }
+
+
+# ---------- SSE streams ----------
+def sse(event: str, data: dict) -> str:
+    """One Server-Sent Event (JSON data on a single line)."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream(job_id: int) -> Iterator[str]:
+    """The job's events as SSE text, for a WSGI response body (holds its thread while open)."""
+    subscriber, history = _subscribe(job_id)
+    if subscriber is None:
+        yield from _poll(job_id)
+        return
+    try:
+        for event, data in history:
+            yield sse(event, data)
+            if event in TERMINAL:
+                return
+        while True:
+            try:
+                item = subscriber.queue.get(timeout=EVENTS_HEARTBEAT)
+            except queue.Empty:
+                # A job that died without closing its channel must not leave the stream open
+                event, data = job_state(job_id)
+                if event in TERMINAL:
+                    yield sse(event, data)
+                    return
+                yield KEEPALIVE
+                continue
+            if item is None:
+                yield from _poll(job_id)
+                return
+            yield sse(*item)
+            if item[0] in TERMINAL:
+                return
+    finally:
+        _unsubscribe(job_id, subscriber)
+
+
+def _poll(job_id: int) -> Iterator[str]:
+    status, beat = None, time.monotonic()
+    while True:
+        event, data = job_state(job_id)
+        if event in TERMINAL:
+            yield sse(event, data)
+            return
+        if data["status"] != status:
+            status = data["status"]
+            yield sse(event, data)
+        elif time.monotonic() - beat >= EVENTS_HEARTBEAT:
+            beat = time.monotonic()
+            yield KEEPALIVE
+        time.sleep(EVENTS_POLL_INTERVAL)
+
+
+async def stream_async(job_id: int) -> AsyncIterator[str]:
+    """Event-loop version of stream(): an open stream costs no thread."""
+    subscriber, history = _subscribe(job_id, asyncio.get_running_loop())
+    if subscriber is None:
+        async for chunk in _poll_async(job_id):
+            yield chunk
+        return
+    try:
+        for event, data in history:
+            yield sse(event, data)
+            if event in TERMINAL:
+                return
+        while True:
+            try:
+                item = await asyncio.wait_for(subscriber.queue.get(), EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                event, data = await asyncio.to_thread(job_state, job_id)
+                if event in TERMINAL:
+                    yield sse(event, data)
+                    return
+                yield KEEPALIVE
+                continue
+            if item is None:
+                async for chunk in _poll_async(job_id):
+                    yield chunk
+                return
+            yield sse(*item)
+            if item[0] in TERMINAL:
+                return
+    finally:
+        _unsubscribe(job_id, subscriber)
+
+
+async def _poll_async(job_id: int) -> AsyncIterator[str]:
+    status, beat = None, time.monotonic()
+    while True:
+        event, data = await asyncio.to_thread(job_state, job_id)
+        if event in TERMINAL:
+            yield sse(event, data)
+            return
+        if data["status"] != status:
+            status = data["status"]
+            yield sse(event, data)
+        elif time.monotonic() - beat >= EVENTS_HEARTBEAT:
+            beat = time.monotonic()
+            yield KEEPALIVE
+        await asyncio.sleep(EVENTS_POLL_INTERVAL)
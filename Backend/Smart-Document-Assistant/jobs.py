@@ -0,0 +1,363 @@
+# jobs.py
+import os
+import asyncio
+import logging
+import threading
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+from db import connection, make_preview
+import text_store
+from metrics import Gauge, Histogram
+from ai_service import process_image_with_ai, process_image_with_ai_async, _title_from_text
+import paged_files
+import storage
+import semantic_index
+import job_events
+
+# Logger setup
+logger = logging.getLogger("jobs")
+logger.setLevel(logging.INFO)
+
+# How jobs run: "threads" (a pool of UPLOAD_WORKERS threads, one blocking Vision
+# call each) or "async" (one event loop with up to ASYNC_MAX_INFLIGHT concurrent jobs)
+JOB_MODE = os.getenv("JOB_MODE", "threads")
+
+# Number of background workers running the AI/OCR step
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "200"))
+
+# Concurrent extractions for batch uploads, shared by all requests so the
+# total number of in-flight Vision calls stays within the provider's rate limits
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Concurrent Vision/OCR calls for the text-less pages of PDFs and TIFFs (shared by all jobs)
+PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload-worker")
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch-worker")
+_page_executor = ThreadPoolExecutor(max_workers=PAGE_CONCURRENCY, thread_name_prefix="page-worker")
+
+_loop = None
+_loop_lock = threading.Lock()
+_inflight = None
+_page_slots = None
+
+job_seconds = Histogram("job_duration_seconds", "Time from claiming a job to storing its result", ["status"])
+
+
+def queue_depth() -> dict:
+    """{(state,): n} of jobs waiting or running, across all processes sharing the database."""
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT status, COUNT(*) AS n FROM jobs
+            WHERE status IN ('pending', 'processing') GROUP BY status
+        """).fetchall()
+    depth = {("pending",): 0, ("processing",): 0}
+    depth.update({(row["status"],): row["n"] for row in rows})
+    return depth
+
+
+Gauge("job_queue_depth", "Upload jobs by state", ["state"], collect=queue_depth)
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Start the job runner's event loop in a daemon thread on first use."""
+    global _loop, _inflight, _page_slots
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _inflight = asyncio.Semaphore(ASYNC_MAX_INFLIGHT)
+            _page_slots = asyncio.Semaphore(PAGE_CONCURRENCY)
+            threading.Thread(target=_loop.run_forever, name="job-loop", daemon=True).start()
+        return _loop
+
+
+def _forget_loop():
+    """A forked child does not inherit the loop's thread; it starts its own on first use."""
+    global _loop, _loop_lock, _inflight, _page_slots
+    _loop, _inflight, _page_slots = None, None, None
+    _loop_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_loop)
+
+
+def _dispatch(job_id: int):
+    job_events.start(job_id)
+    if JOB_MODE == "async":
+        asyncio.run_coroutine_threadsafe(_run_job_async(job_id), _get_loop())
+    else:
+        _executor.submit(_run_job, job_id)
+
+
+def enqueue_document(doc_id: int, user_id, title: str = "") -> int:
+    """
+    Create a job for an already stored document and hand it to the worker pool.
+    `title` is the user-supplied title; if empty the AI-generated one is used.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO jobs (doc_id, user_id, title) VALUES (?, ?, ?)",
+            (doc_id, user_id, title),
+        )
+        job_id = cur.lastrowid
+
+    _dispatch(job_id)
+    return job_id
+
+
+def resume_pending_jobs() -> int:
+    """Requeue jobs left pending or half-processed by a previous run."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE jobs SET status='pending' WHERE status='processing'")
+        cur.execute("SELECT job_id FROM jobs WHERE status='pending' ORDER BY job_id")
+        job_ids = [row["job_id"] for row in cur.fetchall()]
+
+    for job_id in job_ids:
+        _dispatch(job_id)
+    if job_ids:
+        logger.info(f"Resumed {len(job_ids)} pending jobs")
+    return len(job_ids)
+
+
+def _combine_pages(pages: list, extracted: dict) -> Tuple[str, str, list, str]:
+    """
+    Merge text-layer pages and extracted page images into (title, text, page rows, source).
+    Page rows are (page_no, text, source, image_path); the document's source is the
+    pages' common source (text_layer, vision, ocr, none) or "mixed".
+    """
+    rows, title, sources = [], "", set()
+    for page in pages:
+        if page.text is not None:
+            rows.append((page.page_no, page.text, "text_layer", None))
+            sources.add("text_layer")
+        else:
+            page_title, page_text, page_source = extracted[page.page_no]
+            if page.page_no == 1:
+                title = page_title
+            rows.append((page.page_no, page_text, "image", page.image_path))
+            sources.add(page_source)
+    text = "\n\n".join(row[1] for row in rows if row[1].strip())
+    source = sources.pop() if len(sources) == 1 else "mixed"
+    return title or _title_from_text(text), text, rows, source
+
+
+def _page_events(on_event: Callable, page_no: int):
+    """on_event for one page of a PDF/TIFF: its events carry the page number."""
+    if on_event is None:
+        return None
+    return lambda event, data: on_event(event, dict(data, page=page_no))
+
+
+def _publish_text_layer(pages: list, on_event: Callable):
+    if on_event is None:
+        return
+    for page in pages:
+        if page.text is not None and page.text.strip():
+            on_event("text", {"delta": page.text, "page": page.page_no})
+
+
+def extract_document(path: str, content_hash: str, on_event: Callable = None,
+                     doc_id: int = None, job_id: int = None) -> Tuple[str, str, list, str]:
+    """
+    (title, text, page rows, source) for an upload. Images go through process_image_with_ai
+    and have no page rows; PDF/TIFF pages use their text layer when present, and
+    the remaining pages are extracted in parallel.
+    `on_event` receives partial text as it arrives (see job_events.py); `doc_id` and
+    `job_id` attribute the Vision calls in ai_calls.
+    """
+    if not paged_files.is_paged(path):
+        title, text, source = process_image_with_ai(path, content_hash, on_event=on_event,
+                                                    doc_id=doc_id, job_id=job_id)
+        return title, text, [], source
+
+    pages = paged_files.split_pages(path, content_hash)
+    _publish_text_layer(pages, on_event)
+    futures = {
+        page.page_no: _page_executor.submit(
+            process_image_with_ai, page.image_path, on_event=_page_events(on_event, page.page_no),
+            doc_id=doc_id, job_id=job_id,
+        )
+        for page in pages if page.text is None
+    }
+    return _combine_pages(pages, {page_no: future.result() for page_no, future in futures.items()})
+
+
+async def extract_document_async(path: str, content_hash: str, on_event: Callable = None,
+                                 doc_id: int = None, job_id: int = None) -> Tuple[str, str, list, str]:
+    """Event-loop version of extract_document."""
+    if not paged_files.is_paged(path):
+        title, text, source = await process_image_with_ai_async(path, content_hash, on_event=on_event,
+                                                                doc_id=doc_id, job_id=job_id)
+        return title, text, [], source
+
+    pages = await asyncio.to_thread(paged_files.split_pages, path, content_hash)
+    _publish_text_layer(pages, on_event)
+    scanned = [page for page in pages if page.text is None]
+
+    async def extract_page(page):
+        async with _page_slots:  # same bound as _page_executor in the threaded path
+            return await process_image_with_ai_async(page.image_path, on_event=_page_events(on_event, page.page_no),
+                                                     doc_id=doc_id, job_id=job_id)
+
+    results = await asyncio.gather(*(extract_page(page) for page in scanned))
+    return _combine_pages(pages, {page.page_no: result for page, result in zip(scanned, results)})
+
+
+def store_pages(cur, doc_id: int, rows: list):
+    """Replace a document's page rows."""
+    cur.execute("DELETE FROM document_pages WHERE doc_id=?", (doc_id,))
+    cur.executemany(
+        "INSERT INTO document_pages (doc_id, page_no, text, source, image_path) VALUES (?, ?, ?, ?, ?)",
+        [(doc_id,) + tuple(row) for row in rows],
+    )
+
+
+def extract_many(items: List[Tuple[str, str]]) -> list:
+    """
+    Run extract_document over (path, content_hash) pairs with bounded concurrency.
+    Returns (title, text, page rows, source) in input order; a failed item's slot holds its exception.
+    """
+    futures = [_batch_executor.submit(extract_document, path, content_hash) for path, content_hash in items]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error(f"Batch extraction failed: {e}")
+            results.append(e)
+    return results
+
+
+def _set_status(cur, job_id: int, doc_id: int, status: str, error: str = None):
+    cur.execute(
+        "UPDATE jobs SET status=?, error=?, updated_at=CURRENT_TIMESTAMP WHERE job_id=?",
+        (status, error, job_id),
+    )
+    cur.execute("UPDATE documents SET status=? WHERE doc_id=?", (status, doc_id))
+
+
+def _claim_job(job_id: int):
+    """Mark a pending job as processing; returns its row, or None if taken or gone."""
+    with connection() as conn:
+        cur = conn.cursor()
+        # Another worker may already have picked it up
+        cur.execute(
+            "UPDATE jobs SET status='processing', updated_at=CURRENT_TIMESTAMP "
+            "WHERE job_id=? AND status='pending'",
+            (job_id,),
+        )
+        if cur.rowcount == 0:
+            job_events.drop(job_id)
+            return None
+        cur.execute("""
+            SELECT j.doc_id, j.user_id, j.title, d.file_path, d.content_hash
+            FROM jobs j JOIN documents d ON d.doc_id = j.doc_id
+            WHERE j.job_id=?
+        """, (job_id,))
+        job = cur.fetchone()
+        if not job:
+            cur.execute(
+                "UPDATE jobs SET status='failed', error=?, updated_at=CURRENT_TIMESTAMP WHERE job_id=?",
+                ("document no longer exists", job_id),
+            )
+            job_events.drop(job_id)
+            return None
+        cur.execute("UPDATE documents SET status='processing' WHERE doc_id=?", (job["doc_id"],))
+        job = dict(job, claimed_at=time.monotonic())
+    job_events.publish(job_id, "status", {"status": "processing"})
+    return job
+
+
+def _store_result(job_id: int, job, ai_title: str, extracted_text: str, pages: list, source: str):
+    """
+    The one write of a job's result; streamed partial text is never stored. A document
+    deleted while the job ran gets no text, pages or embeddings; its job is cancelled.
+    """
+    title = (job["title"] or "").strip() or ai_title
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE documents SET title=?, text_preview=?, extraction_source=? "
+            "WHERE doc_id=? AND deleted_at IS NULL",
+            (title, make_preview(extracted_text), source, job["doc_id"]),
+        )
+        stored = cur.rowcount > 0
+        if stored:
+            text_store.store(cur, job["doc_id"], extracted_text)
+            if pages:
+                store_pages(cur, job["doc_id"], pages)
+            _set_status(cur, job_id, job["doc_id"], "done")
+        else:
+            cur.execute(
+                "UPDATE jobs SET status='cancelled', error=?, updated_at=CURRENT_TIMESTAMP WHERE job_id=?",
+                ("document was deleted", job_id),
+            )
+    job_seconds.observe(time.monotonic() - job["claimed_at"], status="done" if stored else "cancelled")
+    if not stored:
+        logger.info(f"Job {job_id} cancelled: document {job['doc_id']} was deleted")
+        job_events.drop(job_id)  # streams report the cancelled job from the database
+        return
+    # Only after the commit, so a client reacting to "done" reads the stored document
+    job_events.finish(job_id, "done", {
+        "doc_id": job["doc_id"], "title": title, "text": extracted_text, "source": source,
+    })
+    semantic_index.schedule(job["doc_id"], job["user_id"], extracted_text)
+
+
+def _store_failure(job_id: int, job, e: Exception):
+    logger.error(f"Job {job_id} failed: {e}")
+    job_seconds.observe(time.monotonic() - job["claimed_at"], status="failed")
+    with connection() as conn:
+        _set_status(conn.cursor(), job_id, job["doc_id"], "failed", str(e))
+    job_events.finish(job_id, "failed", {"error": str(e)})
+
+
+def _run_job(job_id: int):
+    """Worker body: run extraction for one job and store the result."""
+    try:
+        job = _claim_job(job_id)
+        if not job:
+            return
+
+        # No connection is held while the (slow) AI/OCR step runs
+        try:
+            with storage.local_path(job["file_path"]) as path:
+                ai_title, extracted_text, pages, source = extract_document(
+                    path, job["content_hash"], partial(job_events.publish, job_id),
+                    doc_id=job["doc_id"], job_id=job_id,
+                )
+        except Exception as e:
+            _store_failure(job_id, job, e)
+            return
+        _store_result(job_id, job, ai_title, extracted_text, pages, source)
+    except Exception as e:
+        logger.error(f"Job {job_id} could not be processed: {e}")
+        job_events.finish(job_id, "failed", {"error": str(e)})
+
+
+async def _run_job_async(job_id: int):
+    """Event-loop version of _run_job; SQLite work goes to the executor."""
+    async with _inflight:
+        try:
+            job = await asyncio.to_thread(_claim_job, job_id)
+            if not job:
+                return
+            try:
+                async with storage.local_path_async(job["file_path"]) as path:
+                    ai_title, extracted_text, pages, source = await extract_document_async(
+                        path, job["content_hash"], partial(job_events.publish, job_id),
+                        doc_id=job["doc_id"], job_id=job_id,
+                    )
+            except Exception as e:
+                await asyncio.to_thread(_store_failure, job_id, job, e)
+                return
+            await asyncio.to_thread(_store_result, job_id, job, ai_title, extracted_text, pages, source)
+        except Exception as e:
+            logger.error(f"Job {job_id} could not be processed: {e}")
+            job_events.finish(job_id, "failed", {"error": str(e)})
@@ -0,0 +1,72 @@
+# log_config.py
+"""
+Structured logging: one line per record, either logfmt (`LOG_FORMAT=text`, default)
+or JSON (`LOG_FORMAT=json`). Fields passed with `extra=` and the current request id
+are emitted as keys. Messages use %-style args so they are only formatted when the
+level is enabled.
+"""
+import os
+import sys
+import json
+import time
+import logging
+from contextvars import ContextVar
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# Set per request by app.py; attached to every record logged while handling it
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    fields = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+        "level": record.levelname.lower(),
+        "logger": record.name,
+        "msg": record.getMessage(),
+    }
+    rid = request_id.get()
+    if rid:
+        fields["request_id"] = rid
+    for key, value in record.__dict__.items():
+        if key not in _RESERVED:
+            fields[key] = value
+    if record.exc_info:
+        fields["exc"] = logging.Formatter().formatException(record.exc_info)
+    return fields
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(_fields(record), default=str)
+
+
+class LogfmtFormatter(logging.Formatter):
+    def format(self, record):
+        parts = []
+        for key, value in _fields(record).items():
+            value = "" if value is None else str(value)
+            if not value or any(c in value for c in ' "=\n'):
+                value = json.dumps(value)
+            parts.append(f"{key}={value}")
+        return " ".join(parts)
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """Install the structured handler on the root logger (idempotent)."""
+    root = logging.getLogger()
+    if any(getattr(h, "_sda_structured", False) for h in root.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setLevel(level)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else LogfmtFormatter())
+    handler._sda_structured = True
+    root.addHandler(handler)
+    root.setLevel(level)
+    # The OpenAI client logs every HTTP request at INFO; the Vision metrics cover that
+    logging.getLogger("httpx").setLevel(logging.WARNING)
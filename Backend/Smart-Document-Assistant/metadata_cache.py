@@ -0,0 +1,233 @@
+# metadata_cache.py
+"""
+Read-through cache for the rows the frontend polls: user profiles, single documents
+and /api/documents pages.
+
+Document entries are keyed by the user's documents version (users.docs_version,
+see db.py), which triggers bump in the same transaction as every write to the
+user's documents. A request reads the version first (one primary-key lookup), so
+entries written before a change are never served again, whichever process made
+the change; old entries just age out. The version also yields the ETags of
+per-user responses (see etag()), so polls get 304s with any backend.
+
+User rows have no version; they are only cached in a shared backend, where
+invalidate_profile() reaches every process.
+
+CACHE_BACKEND selects where entries live:
+  local  in-process LRU with a TTL (default; each worker process has its own)
+  redis  a shared Redis at CACHE_URL, so workers share entries and user rows are cached
+  none   nothing is cached (ETags still work)
+Other backends can be added with register_backend().
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+from db import connection
+from metrics import Counter
+
+try:
+    import redis
+except ImportError:  # only needed for CACHE_BACKEND=redis
+    redis = None
+
+# Logger setup
+logger = logging.getLogger("metadata_cache")
+logger.setLevel(logging.INFO)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+# Bounds memory only: document entries of an old version are never read again
+CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "4096"))
+# Set to 0 to bypass the cache (reads always hit the database)
+CACHE_ENABLED = os.getenv("METADATA_CACHE", "1") == "1"
+
+cache_requests = Counter("metadata_cache_requests_total", "Metadata cache lookups", ["kind", "result"])
+
+
+# ---------- Backends ----------
+class NullCache:
+    """Caches nothing."""
+    shared = False
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value, ttl: int):
+        pass
+
+    def delete(self, key: str):
+        pass
+
+
+class LocalCache:
+    """Thread-safe in-process LRU with per-entry expiry."""
+    shared = False
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value, ttl: int):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisCache:
+    """Shared cache in Redis; values are stored as JSON."""
+    shared = True
+
+    def __init__(self, url: str = CACHE_URL):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package")
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value, ttl: int):
+        self._client.set(key, json.dumps(value), ex=ttl)
+
+    def delete(self, key: str):
+        self._client.delete(key)
+
+
+_backends: Dict[str, Callable] = {
+    "local": LocalCache,
+    "redis": RedisCache,
+    "none": NullCache,
+}
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable):
+    """
+    Make a cache backend selectable via CACHE_BACKEND=<name>. Backends provide
+    get/set/delete and `shared` (True if all processes see the same entries).
+    """
+    _backends[name] = factory
+
+
+def get_backend():
+    """The configured backend, created on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if CACHE_BACKEND not in _backends:
+                raise ValueError(f"unknown CACHE_BACKEND {CACHE_BACKEND!r}")
+            _backend = _backends[CACHE_BACKEND]()
+        return _backend
+
+
+def _forget_backend():
+    global _backend, _backend_lock
+    _backend = None  # neither the parent's entries nor its Redis connection belong to the child
+    _backend_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_backend)
+
+
+# ---------- Lookups ----------
+def _cached(kind: str, key: str, loader: Callable[[], Any]):
+    """Return the cached value for key, or load, store and return it (None is not cached)."""
+    if not CACHE_ENABLED:
+        return loader()
+    backend = get_backend()
+    try:
+        value = backend.get(key)
+    except Exception as e:  # a cache outage must not fail the request
+        logger.warning(f"Cache read failed: {e}")
+        return loader()
+    if value is not None:
+        cache_requests.inc(kind=kind, result="hit")
+        return value
+
+    cache_requests.inc(kind=kind, result="miss")
+    value = loader()
+    if value is not None:
+        try:
+            backend.set(key, value, CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Cache write failed: {e}")
+    return value
+
+
+def docs_version(user_id) -> Optional[int]:
+    """Current version of a user's documents, or None if the user does not exist."""
+    with connection() as conn:
+        row = conn.execute("SELECT docs_version FROM users WHERE user_id=?", (user_id,)).fetchone()
+    return row["docs_version"] if row else None
+
+
+def user(user_id, loader: Callable[[], Optional[dict]]) -> Optional[dict]:
+    """A user row (as a dict, without the password hash)."""
+    def load():
+        row = loader()
+        return {k: v for k, v in row.items() if k != "password"} if row else None
+
+    if not get_backend().shared:  # a per-process entry would miss changes made elsewhere
+        return load()
+    return _cached("user", f"user:{user_id}", load)
+
+
+def document(user_id, version: Optional[int], doc_id: int, loader: Callable[[], Optional[dict]]) -> Optional[dict]:
+    """One of the user's documents (as a dict) at the given docs_version()."""
+    if version is None:
+        return loader()
+    return _cached("document", f"doc:{user_id}:{version}:{doc_id}", loader)
+
+
+def document_list(user_id, version: Optional[int], variant: str, loader: Callable[[], Any]):
+    """
+    A page of the user's document list at the given docs_version(); `variant`
+    identifies the query (limit, cursor, fields).
+    """
+    if version is None:
+        return loader()
+    digest = hashlib.sha1(variant.encode()).hexdigest()
+    return _cached("document_list", f"docs:{user_id}:{version}:{digest}", loader)
+
+
+def etag(user_id, version: Optional[int], *parts) -> str:
+    """ETag for a response derived only from the user's documents and the given request parts."""
+    h = hashlib.sha1(f"{user_id}:{version}".encode())
+    for part in parts:
+        h.update(b"\0" + str(part).encode())
+    return h.hexdigest()
+
+
+# ---------- Invalidation ----------
+def invalidate_profile(user_id):
+    """Drop a cached user row (call after the user row changes or is deleted)."""
+    try:
+        get_backend().delete(f"user:{user_id}")
+    except Exception as e:
+        logger.error(f"Cache invalidation failed for user {user_id}: {e}")
@@ -0,0 +1,166 @@
+# ocr_service.py
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import List, Tuple
+import pytesseract
+from PIL import Image
+
+# Logger setup
+logger = logging.getLogger("ocr_service")
+logger.setLevel(logging.INFO)
+
+# Tesseract path (Windows only - change if installed elsewhere).
+# Applied in each pool worker when it starts (see _configure_tesseract).
+TESSERACT_PATH = os.getenv("TESSERACT_PATH", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+
+# Pool and tiling settings
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 2)))
+# forkserver/spawn/fork. fork is opt-in: the pool is started from a multi-threaded
+# server, and a forked worker can inherit locks held by other threads forever
+OCR_START_METHOD = os.getenv("OCR_START_METHOD") or (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+# OCR gets the preprocessed image (at most IMAGE_MAX_DIM, 2048 px by default, in
+# ai_service.py), so by default a page is split into two strips at most; more
+# strips only when IMAGE_MAX_DIM is raised or the tile height lowered
+OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", "1200"))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "120"))
+
+# Tesseract options: LSTM engine, automatic page segmentation
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_OEM = int(os.getenv("OCR_OEM", "1"))
+OCR_PSM = int(os.getenv("OCR_PSM", "3"))
+OCR_CONFIG = f"--oem {OCR_OEM} --psm {OCR_PSM}"
+
+_pool = None
+_pool_lock = Lock()
+
+
+def _configure_tesseract():
+    """Pool worker initializer: point pytesseract at TESSERACT_PATH if it exists."""
+    if os.path.exists(TESSERACT_PATH):
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Create the OCR process pool on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context(OCR_START_METHOD)
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=context,
+                                        initializer=_configure_tesseract)
+        return _pool
+
+
+def _forget_pool():
+    """After a fork the parent's pool (its workers and pipes) belongs to the parent."""
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_pool)
+
+
+def tile_bounds(height: int, tile_height: int = OCR_TILE_HEIGHT,
+                overlap: int = OCR_TILE_OVERLAP) -> List[Tuple[int, int, int, int]]:
+    """
+    Split `height` into overlapping horizontal strips.
+    Returns (top, bottom, own_top, own_bottom): each strip "owns" the middle of
+    its overlaps, so a text line crossing a seam is kept by exactly one strip.
+    """
+    bounds, top = [], 0
+    while True:
+        bottom = min(top + tile_height, height)
+        own_top = 0 if top == 0 else top + overlap // 2
+        own_bottom = height if bottom == height else bottom - overlap // 2
+        bounds.append((top, bottom, own_top, own_bottom))
+        if bottom == height:
+            return bounds
+        top = bottom - overlap
+
+
+def _reset_pool():
+    """Drop a broken pool (e.g. a worker was killed) so the next call starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _ocr_whole(img: Image.Image, lang: str, config: str) -> str:
+    try:
+        return pytesseract.image_to_string(img, lang=lang, config=config)
+    except Exception as e:
+        # pytesseract errors don't survive pickling back to the parent; send a plain one
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def _ocr_tile(tile: Image.Image, offset: int, own_top: int, own_bottom: int,
+              lang: str, config: str) -> List[Tuple[Tuple[int, int], str]]:
+    """OCR one strip; returns ((block, paragraph), line text) for the lines this strip owns."""
+    try:
+        data = pytesseract.image_to_data(tile, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    lines, order = {}, []
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        top, bottom = data["top"][i], data["top"][i] + data["height"][i]
+        if key not in lines:
+            lines[key] = [top, bottom, []]
+            order.append(key)
+        line = lines[key]
+        line[0], line[1] = min(line[0], top), max(line[1], bottom)
+        line[2].append(word)
+
+    owned = []
+    for key in order:
+        top, bottom, words = lines[key]
+        if own_top <= offset + (top + bottom) / 2 < own_bottom:
+            owned.append((key[:2], " ".join(words)))
+    return owned
+
+
+def _stitch(tiles: List[List[Tuple[Tuple[int, int], str]]]) -> str:
+    """Join per-strip lines, with a blank line between paragraphs inside a strip."""
+    out = []
+    for lines in tiles:
+        prev = None
+        for paragraph, text in lines:
+            if prev is not None and paragraph != prev:
+                out.append("")
+            out.append(text)
+            prev = paragraph
+    return "\n".join(out)
+
+
+def ocr_image(img: Image.Image, lang: str = OCR_LANG, config: str = OCR_CONFIG) -> str:
+    """
+    Extract text with Tesseract in the process pool. Tall images are split into
+    overlapping strips that are recognised in parallel and stitched back together.
+    """
+    pool = _get_pool()
+    width, height = img.size
+    try:
+        if height <= OCR_TILE_HEIGHT + OCR_TILE_OVERLAP:
+            return pool.submit(_ocr_whole, img, lang, config).result()
+
+        futures = [
+            pool.submit(_ocr_tile, img.crop((0, top, width, bottom)), top, own_top, own_bottom, lang, config)
+            for top, bottom, own_top, own_bottom in tile_bounds(height)
+        ]
+        logger.info(f"OCR on {len(futures)} tiles")
+        return _stitch([future.result() for future in futures])
+    except BrokenProcessPool:
+        _reset_pool()
+        raise
@@ -0,0 +1,146 @@
+# paged_files.py
+"""
+Splitting multi-page uploads (PDF, TIFF) into pages.
+PDF pages keep their embedded text layer when they have one; pages without
+usable text are rendered to PNG for the Vision/OCR step. Page images are local files
+under uploads/pages/<ab>/<cd>/<sha256>-p<n>.png, so uploads of the same content share
+them and a page can be re-extracted without splitting the file again.
+"""
+import os
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+from PIL import Image, ImageOps, ImageSequence
+import storage
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # PDFs are rejected at upload without it
+    pdfium = None
+
+# Logger setup
+logger = logging.getLogger("paged_files")
+logger.setLevel(logging.INFO)
+
+PAGED_EXTENSIONS = {"pdf", "tif", "tiff"}
+MAX_PAGES = int(os.getenv("MAX_PAGES", "500"))
+# A page whose text layer has fewer characters than this is treated as a scan
+MIN_TEXT_LAYER_CHARS = int(os.getenv("MIN_TEXT_LAYER_CHARS", "16"))
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "200"))
+
+# PDFium is not thread-safe, not even across separate documents
+_pdfium_lock = threading.Lock()
+
+
+@dataclass
+class Page:
+    page_no: int                      # 1-based
+    text: Optional[str] = None        # embedded text layer, if usable
+    image_path: Optional[str] = None  # rendered page for pages without one
+
+
+def is_paged(path) -> bool:
+    return Path(path).suffix.lower().lstrip(".") in PAGED_EXTENSIONS
+
+
+def supported_extensions() -> set:
+    """Paged formats this installation can split (PDF needs pypdfium2)."""
+    return PAGED_EXTENSIONS if pdfium else PAGED_EXTENSIONS - {"pdf"}
+
+
+def page_image_path(content_hash: str, page_no: int) -> Path:
+    return storage.shard_dir("pages", content_hash) / f"{content_hash}-p{page_no:04d}.png"
+
+
+def _save_page(img: Image.Image, dest: Path):
+    """Write a page image once (atomic rename; existing files are reused)."""
+    if dest.exists():
+        return
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f"{dest.name}.{threading.get_ident()}.part")
+    try:
+        img.save(tmp, "PNG")
+        tmp.replace(dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _split_pdf(path: str, content_hash: str) -> List[Page]:
+    pages = []
+    pdf = pdfium.PdfDocument(path)
+    try:
+        if len(pdf) > MAX_PAGES:
+            raise ValueError(f"document has {len(pdf)} pages (max {MAX_PAGES})")
+        for index in range(len(pdf)):
+            page = pdf[index]
+            try:
+                textpage = page.get_textpage()
+                text = textpage.get_text_range().replace("\r\n", "\n").strip()
+                textpage.close()
+                if len(text) >= MIN_TEXT_LAYER_CHARS:
+                    pages.append(Page(index + 1, text=text))
+                    continue
+                dest = page_image_path(content_hash, index + 1)
+                if not dest.exists():
+                    _save_page(page.render(scale=PDF_RENDER_DPI / 72).to_pil(), dest)
+                pages.append(Page(index + 1, image_path=str(dest)))
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+    return pages
+
+
+def _split_tiff(path: str, content_hash: str) -> List[Page]:
+    pages = []
+    with Image.open(path) as img:
+        for index, frame in enumerate(ImageSequence.Iterator(img)):
+            if index >= MAX_PAGES:
+                raise ValueError(f"document has more than {MAX_PAGES} pages")
+            dest = page_image_path(content_hash, index + 1)
+            if not dest.exists():
+                _save_page(ImageOps.exif_transpose(frame.copy()), dest)
+            pages.append(Page(index + 1, image_path=str(dest)))
+    return pages
+
+
+def split_pages(path: str, content_hash: str) -> List[Page]:
+    """Pages of a PDF or TIFF, in order."""
+    if Path(path).suffix.lower() == ".pdf":
+        if pdfium is None:
+            raise RuntimeError("PDF support requires pypdfium2")
+        with _pdfium_lock:
+            pages = _split_pdf(path, content_hash)
+    else:
+        pages = _split_tiff(path, content_hash)
+    with_text = sum(1 for page in pages if page.text is not None)
+    logger.info(f"Split {Path(path).name}: {len(pages)} pages, {with_text} with a text layer")
+    return pages
+
+
+def first_page_image(path: str) -> Image.Image:
+    """First page as an image (for thumbnails)."""
+    if Path(path).suffix.lower() == ".pdf":
+        if pdfium is None:
+            raise RuntimeError("PDF support requires pypdfium2")
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(path)
+            try:
+                page = pdf[0]
+                try:
+                    return page.render(scale=PDF_RENDER_DPI / 72).to_pil()
+                finally:
+                    page.close()
+            finally:
+                pdf.close()
+    with Image.open(path) as img:
+        img.seek(0)
+        return img.copy()
+
+
+def remove_pages(content_hash: str):
+    """Delete the rendered page images of content that is being removed."""
+    for page in storage.shard_dir("pages", content_hash).glob(f"{content_hash}-p*.png"):
+        page.unlink(missing_ok=True)
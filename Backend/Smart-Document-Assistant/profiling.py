@@ -0,0 +1,95 @@
+# profiling.py
+"""
+Opt-in request profiler. PROFILE_MODE:
+  off     (default) never profile
+  header  profile requests that send `X-Profile: <PROFILE_SECRET>`; their report is
+          always written. Off while PROFILE_SECRET is unset, so that clients cannot
+          make the server write files at will
+  sample  profile a PROFILE_SAMPLE_RATE fraction of requests; reports are written
+          only for requests slower than PROFILE_SLOW_MS
+Reports go to PROFILE_DIR: pyinstrument HTML if it is installed, else cProfile
+stats (.prof, readable with `python -m pstats`) plus a text summary.
+"""
+import os
+import io
+import hmac
+import time
+import random
+import pstats
+import cProfile
+import logging
+from pathlib import Path
+from typing import Optional
+
+try:
+    from pyinstrument import Profiler as _Pyinstrument
+except ImportError:  # optional dependency
+    _Pyinstrument = None
+
+# Logger setup
+logger = logging.getLogger("profiling")
+logger.setLevel(logging.INFO)
+
+PROFILE_MODE = os.getenv("PROFILE_MODE", "off")
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(Path("data") / "profiles")))
+PROFILE_ENGINE = os.getenv("PROFILE_ENGINE", "pyinstrument" if _Pyinstrument else "cprofile")
+
+
+class RequestProfile:
+    """A running profile for one request."""
+
+    def __init__(self, forced: bool):
+        self.forced = forced
+        if PROFILE_ENGINE == "pyinstrument" and _Pyinstrument:
+            self._profiler = _Pyinstrument()
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        if isinstance(self._profiler, cProfile.Profile):
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+
+    def dump(self, label: str, duration_ms: float) -> Optional[Path]:
+        """Write the report if the request was forced or slow enough; returns the file written."""
+        if not self.forced and duration_ms < PROFILE_SLOW_MS:
+            return None
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stem = f"{time.strftime('%Y%m%dT%H%M%S')}-{label}-{int(duration_ms)}ms"
+        if isinstance(self._profiler, cProfile.Profile):
+            path = PROFILE_DIR / f"{stem}.prof"
+            self._profiler.dump_stats(path)
+            summary = io.StringIO()
+            pstats.Stats(self._profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+            (PROFILE_DIR / f"{stem}.txt").write_text(summary.getvalue())
+        else:
+            path = PROFILE_DIR / f"{stem}.html"
+            path.write_text(self._profiler.output_html())
+        logger.info("Profile written", extra={"path": str(path), "duration_ms": round(duration_ms, 1)})
+        return path
+
+
+def start(headers) -> Optional[RequestProfile]:
+    """Start profiling the current request if PROFILE_MODE asks for it."""
+    if PROFILE_MODE == "header":
+        forced = bool(PROFILE_SECRET) and hmac.compare_digest(
+            headers.get(PROFILE_HEADER, "").encode(), PROFILE_SECRET.encode()
+        )
+        if not forced:
+            return None
+    elif PROFILE_MODE == "sample" and random.random() < PROFILE_SAMPLE_RATE:
+        forced = False
+    else:
+        return None
+    try:
+        return RequestProfile(forced)
+    except ValueError as e:  # cProfile on Python 3.12+ allows one active profiler per process
+        logger.warning("Profiler not started: %s", e)
+        return None
@@ -0,0 +1,310 @@
+# reextract.py
+"""
+Re-run extraction over stored documents, e.g. after a model, prompt or OCR change.
+
+    python reextract.py run --source ocr --since 2024-01-01 --concurrency 4 --rate 2
+    python reextract.py status
+
+Documents are selected by user, upload date range and extraction source (the
+`extraction_source` column; `unknown` for documents extracted before it was
+recorded) and processed in doc_id order, --batch-size at a time. Each batch's results
+and the run's checkpoint are written in one transaction, so an interrupted run
+resumes after the last committed batch: running the same command again picks
+up the unfinished run with the same filters (`--restart` starts over).
+
+Safe to run next to the API: only finished, non-deleted documents are touched,
+every write is a short transaction, a document deleted meanwhile is skipped, and
+a result that is worse than the stored one (no text, or OCR where Vision text was
+stored, e.g. while the Vision API is failing) is not written unless
+--allow-downgrade is given. Titles the user gave at upload are kept. Identical
+images still hit the extraction cache, so only a changed model or prompt yields
+new Vision results. The API serves the new text right away: every write bumps
+the user's docs_version, which keys the metadata cache.
+"""
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from dotenv import load_dotenv
+load_dotenv()  # before the imports below read their settings from the environment
+from db import connection, make_preview
+from jobs import extract_document, store_pages
+import semantic_index
+import storage
+import text_store
+
+# Logger setup
+logger = logging.getLogger("reextract")
+logger.setLevel(logging.INFO)
+
+SOURCES = ("vision", "ocr", "none", "text_layer", "mixed", "unknown")
+
+
+class RateLimiter:
+    """Spaces out calls to at most `rate` per second across threads (0 = unlimited)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+# ---------- Selection ----------
+def _where(filters: dict):
+    """SQL condition and parameters for the documents a run covers."""
+    where = ["d.status='done'", "d.deleted_at IS NULL"]
+    params = []
+    if filters.get("user_id") is not None:
+        where.append("d.user_id=?")
+        params.append(filters["user_id"])
+    if filters.get("since"):
+        where.append("d.upload_date >= ?")
+        params.append(filters["since"])
+    if filters.get("until"):
+        where.append("d.upload_date < ?")
+        params.append(filters["until"])
+    sources = filters.get("sources") or []
+    if sources:
+        known = [s for s in sources if s != "unknown"]
+        conditions = []
+        if known:
+            conditions.append(f"d.extraction_source IN ({','.join('?' * len(known))})")
+            params.extend(known)
+        if "unknown" in sources:
+            conditions.append("d.extraction_source IS NULL")
+        where.append(f"({' OR '.join(conditions)})")
+    return " AND ".join(where), params
+
+
+def _fetch_batch(filters: dict, after_id: int, batch_size: int) -> list:
+    where, params = _where(filters)
+    with connection() as conn:
+        return conn.execute(f"""
+            SELECT d.doc_id, d.user_id, d.title, d.file_path, d.content_hash, d.extraction_source,
+                   (SELECT j.title FROM jobs j WHERE j.doc_id = d.doc_id
+                    ORDER BY j.job_id DESC LIMIT 1) AS upload_title
+            FROM documents d
+            WHERE {where} AND d.doc_id > ?
+            ORDER BY d.doc_id
+            LIMIT ?
+        """, params + [after_id, batch_size]).fetchall()
+
+
+def _count_remaining(filters: dict, after_id: int) -> int:
+    where, params = _where(filters)
+    with connection() as conn:
+        return conn.execute(
+            f"SELECT COUNT(*) FROM documents d WHERE {where} AND d.doc_id > ?", params + [after_id]
+        ).fetchone()[0]
+
+
+# ---------- Checkpoints ----------
+def _run_id(filters: dict) -> str:
+    return hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def _open_run(filters: dict, restart: bool) -> dict:
+    """The unfinished run for these filters, or a new one."""
+    run_id = _run_id(filters)
+    with connection() as conn:
+        cur = conn.cursor()
+        if restart:
+            cur.execute("DELETE FROM reextract_runs WHERE run_id=?", (run_id,))
+        cur.execute("SELECT * FROM reextract_runs WHERE run_id=?", (run_id,))
+        run = cur.fetchone()
+        if run is None or run["finished_at"]:
+            cur.execute("DELETE FROM reextract_runs WHERE run_id=?", (run_id,))
+            cur.execute(
+                "INSERT INTO reextract_runs (run_id, filters) VALUES (?, ?)",
+                (run_id, json.dumps(filters, sort_keys=True)),
+            )
+            cur.execute("SELECT * FROM reextract_runs WHERE run_id=?", (run_id,))
+            run = cur.fetchone()
+        elif run["last_doc_id"]:
+            logger.info(f"Resuming run {run_id} after doc_id {run['last_doc_id']}")
+    return dict(run)
+
+
+def runs() -> List[dict]:
+    """All recorded runs, newest first."""
+    with connection() as conn:
+        return [dict(row) for row in conn.execute("SELECT * FROM reextract_runs ORDER BY started_at DESC")]
+
+
+# ---------- Processing ----------
+def _extract(row, limiter: RateLimiter):
+    limiter.wait()
+    with storage.local_path(row["file_path"]) as path:
+        return extract_document(path, row["content_hash"], doc_id=row["doc_id"])
+
+
+def _is_downgrade(row, old_text: Optional[str], text: str, source: str) -> bool:
+    if (old_text or "").strip() and not text.strip():
+        return True
+    return row["extraction_source"] == "vision" and source in ("ocr", "none")
+
+
+def _write_batch(run_id: str, rows: list, outcomes: list, allow_downgrade: bool) -> dict:
+    """Store one batch's results and advance the checkpoint in a single transaction."""
+    counts = {"changed": 0, "unchanged": 0, "kept": 0, "failed": 0}
+    changed = []
+    with connection() as conn:
+        cur = conn.cursor()
+        for row, outcome in zip(rows, outcomes):
+            if isinstance(outcome, Exception):
+                logger.warning(f"Re-extraction of document {row['doc_id']} failed: {outcome}")
+                counts["failed"] += 1
+                continue
+            ai_title, text, pages, source = outcome
+            old_text = text_store.load(cur, row["doc_id"])
+            if not allow_downgrade and _is_downgrade(row, old_text, text, source):
+                counts["kept"] += 1
+                continue
+            if text == (old_text or "") and source == row["extraction_source"]:
+                counts["unchanged"] += 1
+                continue
+            title = row["title"] if (row["upload_title"] or "").strip() else ai_title
+            # Conditions repeat the selection: the API may have deleted it since
+            cur.execute("""
+                UPDATE documents SET title=?, text_preview=?, extraction_source=?
+                WHERE doc_id=? AND status='done' AND deleted_at IS NULL
+            """, (title, make_preview(text), source, row["doc_id"]))
+            if not cur.rowcount:
+                continue
+            if text != (old_text or ""):
+                text_store.store(cur, row["doc_id"], text)
+                if pages:
+                    store_pages(cur, row["doc_id"], pages)
+                changed.append((row["doc_id"], row["user_id"], text))
+            counts["changed"] += 1
+        cur.execute("""
+            UPDATE reextract_runs
+            SET last_doc_id=?, processed=processed+?, changed=changed+?, failed=failed+?,
+                updated_at=CURRENT_TIMESTAMP
+            WHERE run_id=?
+        """, (rows[-1]["doc_id"], len(rows), counts["changed"], counts["failed"], run_id))
+
+    counts["reindex"] = changed
+    return counts
+
+
+def _reindex(item):
+    doc_id, user_id, text = item
+    try:
+        semantic_index.index_document(doc_id, user_id, text)
+    except Exception as e:
+        logger.error(f"Indexing document {doc_id} failed: {e}")
+
+
+def _format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s"
+
+
+def run(filters: dict, concurrency: int = 4, rate: float = 0, batch_size: int = 50,
+        restart: bool = False, allow_downgrade: bool = False) -> dict:
+    """Process every selected document after the run's checkpoint; returns the run's final counters."""
+    checkpoint = _open_run(filters, restart)
+    run_id = checkpoint["run_id"]
+    remaining = _count_remaining(filters, checkpoint["last_doc_id"])
+    print(f"Run {run_id}: {remaining} documents to process ({checkpoint['processed']} done before)", flush=True)
+
+    limiter = RateLimiter(rate)
+    last_id, done, started = checkpoint["last_doc_id"], 0, time.monotonic()
+    totals = {"changed": 0, "unchanged": 0, "kept": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="reextract") as pool:
+        try:
+            while True:
+                rows = _fetch_batch(filters, last_id, batch_size)
+                if not rows:
+                    break
+                futures = [pool.submit(_extract, row, limiter) for row in rows]
+                outcomes = []
+                for future in futures:
+                    try:
+                        outcomes.append(future.result())
+                    except Exception as e:
+                        outcomes.append(e)
+                counts = _write_batch(run_id, rows, outcomes, allow_downgrade)
+                if semantic_index.SEMANTIC_INDEXING:
+                    list(pool.map(_reindex, counts.pop("reindex")))
+                for key in totals:
+                    totals[key] += counts[key]
+
+                last_id = rows[-1]["doc_id"]
+                done += len(rows)
+                elapsed = time.monotonic() - started
+                per_second = done / elapsed if elapsed else 0.0
+                left = max(remaining - done, 0)
+                eta = _format_eta(left / per_second) if per_second else "?"
+                print(
+                    f"{done}/{remaining} documents, {per_second:.2f}/s, ETA {eta} "
+                    f"(changed {totals['changed']}, unchanged {totals['unchanged']}, "
+                    f"kept {totals['kept']}, failed {totals['failed']})",
+                    flush=True,
+                )
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print(f"Interrupted; run the same command again to resume after doc_id {last_id}", flush=True)
+            raise
+
+    with connection() as conn:
+        conn.execute(
+            "UPDATE reextract_runs SET finished_at=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP WHERE run_id=?",
+            (run_id,),
+        )
+        return dict(conn.execute("SELECT * FROM reextract_runs WHERE run_id=?", (run_id,)).fetchone())
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+    from log_config import configure_logging
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="start or resume a re-extraction run")
+    run_parser.add_argument("--user", type=int, help="only this user's documents")
+    run_parser.add_argument("--since", help="uploaded on or after (YYYY-MM-DD[ HH:MM:SS])")
+    run_parser.add_argument("--until", help="uploaded before (YYYY-MM-DD[ HH:MM:SS])")
+    run_parser.add_argument("--source", action="append", choices=SOURCES,
+                            help="extraction source to select (repeatable)")
+    run_parser.add_argument("--concurrency", type=int, default=4, help="documents extracted in parallel")
+    run_parser.add_argument("--rate", type=float, default=0, help="max documents started per second (0 = no limit)")
+    run_parser.add_argument("--batch-size", type=int, default=50, help="documents per transaction")
+    run_parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of a previous run")
+    run_parser.add_argument("--allow-downgrade", action="store_true",
+                            help="also store empty or OCR results over Vision text")
+    sub.add_parser("status", help="list runs and their checkpoints")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for entry in runs():
+            print(json.dumps(entry))
+        sys.exit(0)
+
+    filters = {
+        "user_id": args.user,
+        "since": args.since,
+        "until": args.until,
+        "sources": sorted(set(args.source or [])),
+    }
+    try:
+        print(json.dumps(run(filters, args.concurrency, args.rate, args.batch_size,
+                             args.restart, args.allow_downgrade)))
+    except KeyboardInterrupt:
+        sys.exit(130)
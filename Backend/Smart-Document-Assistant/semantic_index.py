@@ -0,0 +1,315 @@
+# semantic_index.py
+"""
+Semantic search over extracted text.
+Documents are split into overlapping word chunks; each chunk's embedding is stored
+as a float16/float32 BLOB in `document_chunks`. A query is embedded once and scored
+against the user's chunk matrix with a single NumPy dot product and an
+argpartition top-k. The matrix is cached per user and reloaded when their chunks change.
+
+The embedding backend is chosen with EMBEDDING_BACKEND:
+  openai   OpenAI embeddings API (EMBEDDING_MODEL, EMBEDDING_DIM); paid calls per
+           upload and per semantic query
+  local    a sentence-transformers model (EMBEDDING_MODEL), if installed
+  hashing  deterministic, offline feature hashing of words and character trigrams.
+           Lexical, not semantic: it matches shared words and spellings only, and
+           search responses say so. For offline setups and tests.
+Unset, nothing is embedded and semantic/hybrid search is off.
+Other backends can be added with register_backend().
+"""
+import os
+import re
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()  # before the imports below read their settings from the environment
+from db import connection
+import text_store
+from metrics import Histogram
+
+# Logger setup
+logger = logging.getLogger("semantic_index")
+logger.setLevel(logging.INFO)
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+EMBEDDING_DTYPE = np.dtype(os.getenv("EMBEDDING_DTYPE", "float16"))
+EMBEDDING_BATCH = int(os.getenv("EMBEDDING_BATCH", "64"))
+
+CHUNK_WORDS = int(os.getenv("CHUNK_WORDS", "120"))
+CHUNK_OVERLAP_WORDS = int(os.getenv("CHUNK_OVERLAP_WORDS", "20"))
+
+# Users whose chunk matrices are kept in memory
+SEMANTIC_CACHE_USERS = int(os.getenv("SEMANTIC_CACHE_USERS", "32"))
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "2"))
+# Set to 0 to stop embedding new documents (semantic search then covers what is indexed)
+SEMANTIC_INDEXING = os.getenv("SEMANTIC_INDEXING", "1") == "1" and bool(EMBEDDING_BACKEND)
+
+_executor = ThreadPoolExecutor(max_workers=INDEX_WORKERS, thread_name_prefix="index-worker")
+
+embed_seconds = Histogram("embedding_duration_seconds", "Embedding backend call latency", ["purpose"])
+query_seconds = Histogram("semantic_query_duration_seconds", "Semantic top-k scoring time (after embedding)")
+
+
+# ---------- Embedding backends ----------
+class HashingEmbedder:
+    """Deterministic offline embedder: signed feature hashing of words and character trigrams."""
+    lexical = True  # similar spelling, not similar meaning
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str):
+        for word in re.findall(r"\w+", text.lower()):
+            yield word, 1.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode())
+                out[row, h % self.dim] += weight if h & 0x80000000 else -weight
+        return out
+
+
+class OpenAIEmbedder:
+    """OpenAI embeddings API, shortened to `dim` dimensions."""
+    lexical = False
+
+    def __init__(self, model: str = EMBEDDING_MODEL, dim: int = EMBEDDING_DIM):
+        from ai_service import get_client
+        self._client = get_client()
+        self.model = model
+        self.dim = dim
+        self.name = f"openai:{model}:{dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        resp = self._client.embeddings.create(model=self.model, input=texts, dimensions=self.dim)
+        return np.array([item.embedding for item in resp.data], dtype=np.float32)
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model (optional dependency)."""
+    lexical = False
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(model)
+        self.dim = self._model.get_sentence_embedding_dimension()
+        self.name = f"local:{model}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self._model.encode(texts), dtype=np.float32)
+
+
+_backends: Dict[str, Callable] = {
+    "hashing": HashingEmbedder,
+    "openai": OpenAIEmbedder,
+    "local": SentenceTransformerEmbedder,
+}
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable):
+    """
+    Make an embedding backend selectable via EMBEDDING_BACKEND=<name>. Backends provide
+    embed(texts), `name`, and `lexical` (True if vectors only reflect shared words).
+    """
+    _backends[name] = factory
+
+
+def enabled() -> bool:
+    """Whether an embedding backend is configured (semantic/hybrid search is off otherwise)."""
+    return bool(EMBEDDING_BACKEND)
+
+
+def get_backend():
+    """The configured backend, created on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if not EMBEDDING_BACKEND:
+                raise RuntimeError("no EMBEDDING_BACKEND configured")
+            if EMBEDDING_BACKEND not in _backends:
+                raise ValueError(f"unknown EMBEDDING_BACKEND {EMBEDDING_BACKEND!r}")
+            _backend = _backends[EMBEDDING_BACKEND]()
+        return _backend
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+# ---------- Indexing ----------
+def chunk_text(text: str, size: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP_WORDS) -> List[str]:
+    """Overlapping windows of `size` words."""
+    words = (text or "").split()
+    if not words:
+        return []
+    step = max(1, size - overlap)
+    return [" ".join(words[i:i + size]) for i in range(0, max(1, len(words) - overlap), step)]
+
+
+def index_document(doc_id: int, user_id: int, text: str):
+    """(Re)compute and store the chunk embeddings of one document."""
+    backend = get_backend()
+    chunks = chunk_text(text)
+    vectors = []
+    for start in range(0, len(chunks), EMBEDDING_BATCH):
+        with embed_seconds.time(purpose="index"):
+            vectors.append(backend.embed(chunks[start:start + EMBEDDING_BATCH]))
+    matrix = _normalize(np.vstack(vectors)).astype(EMBEDDING_DTYPE) if vectors else []
+
+    with connection() as conn:
+        # The document may have been deleted while it was embedded
+        if not conn.execute(
+            "SELECT 1 FROM documents WHERE doc_id=? AND deleted_at IS NULL", (doc_id,)
+        ).fetchone():
+            return
+        conn.execute("DELETE FROM document_chunks WHERE doc_id=?", (doc_id,))
+        conn.executemany("""
+            INSERT INTO document_chunks (doc_id, user_id, chunk_no, text, model, embedding)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [
+            (doc_id, user_id, i, chunk, backend.name, matrix[i].tobytes())
+            for i, chunk in enumerate(chunks)
+        ])
+
+
+def _index_safely(doc_id: int, user_id: int, text: str):
+    try:
+        index_document(doc_id, user_id, text)
+    except Exception as e:
+        logger.error(f"Indexing document {doc_id} failed: {e}")
+
+
+def schedule(doc_id: int, user_id: int, text: str):
+    """Index a document in the background (embedding calls can be slow)."""
+    if not SEMANTIC_INDEXING:
+        return
+    _executor.submit(_index_safely, doc_id, int(user_id), text)
+
+
+# ---------- Querying ----------
+class _UserMatrix:
+    def __init__(self, version, chunk_ids, doc_ids, matrix):
+        self.version = version
+        self.chunk_ids = chunk_ids
+        self.doc_ids = doc_ids
+        self.matrix = matrix
+
+
+_matrices: "OrderedDict[Tuple[int, str], _UserMatrix]" = OrderedDict()
+_matrices_lock = threading.Lock()
+
+
+def _user_matrix(cur, user_id: int, model: str) -> _UserMatrix:
+    """The user's chunk embeddings as one (n, dim) array, cached until their chunks change."""
+    cur.execute(
+        "SELECT COUNT(*), MAX(chunk_id) FROM document_chunks WHERE user_id=? AND model=?",
+        (user_id, model)
+    )
+    version = tuple(cur.fetchone())
+    key = (user_id, model)
+    with _matrices_lock:
+        cached = _matrices.get(key)
+        if cached and cached.version == version:
+            _matrices.move_to_end(key)
+            return cached
+
+    cur.execute(
+        "SELECT chunk_id, doc_id, embedding FROM document_chunks WHERE user_id=? AND model=? ORDER BY chunk_id",
+        (user_id, model)
+    )
+    rows = cur.fetchall()
+    chunk_ids = np.fromiter((r["chunk_id"] for r in rows), dtype=np.int64, count=len(rows))
+    doc_ids = np.fromiter((r["doc_id"] for r in rows), dtype=np.int64, count=len(rows))
+    # Stored compact; scored as float32 because NumPy has no BLAS path for float16
+    matrix = np.frombuffer(b"".join(r["embedding"] for r in rows), dtype=EMBEDDING_DTYPE).astype(np.float32)
+    matrix = matrix.reshape(len(rows), -1) if rows else matrix.reshape(0, 0)
+    entry = _UserMatrix(version, chunk_ids, doc_ids, matrix)
+    with _matrices_lock:
+        _matrices[key] = entry
+        _matrices.move_to_end(key)
+        while len(_matrices) > SEMANTIC_CACHE_USERS:
+            _matrices.popitem(last=False)
+    return entry
+
+
+def search(user_id: int, query: str, k: int) -> List[Tuple[int, float, int]]:
+    """
+    Top-k documents for a query as (doc_id, cosine similarity, best chunk_id),
+    best first. A document's score is that of its best-matching chunk.
+    """
+    backend = get_backend()
+    with embed_seconds.time(purpose="query"):
+        q = _normalize(backend.embed([query]))[0]
+
+    with connection() as conn:
+        entry = _user_matrix(conn.cursor(), int(user_id), backend.name)
+    if not len(entry.chunk_ids):
+        return []
+
+    with query_seconds.time():
+        scores = entry.matrix @ q.astype(np.float32)
+        # Over-fetch chunks so that k distinct documents survive the per-document max
+        n = min(len(scores), k * 4)
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+    results, seen = [], set()
+    for i in top:
+        doc_id = int(entry.doc_ids[i])
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        results.append((doc_id, float(scores[i]), int(entry.chunk_ids[i])))
+        if len(results) == k:
+            break
+    return results
+
+
+def reindex(user_id: int = None, batch_size: int = 100) -> int:
+    """Re-embed every finished document (of one user, if given); returns the number indexed."""
+    where, params = "d.status='done' AND d.deleted_at IS NULL", ()
+    if user_id is not None:
+        where, params = where + " AND d.user_id=?", (user_id,)
+    count, last_id = 0, 0
+    while True:
+        with connection() as conn:
+            rows = conn.execute(
+                f"SELECT d.doc_id, d.user_id, t.codec, t.body "
+                f"FROM documents d LEFT JOIN document_text t ON t.doc_id = d.doc_id "
+                f"WHERE {where} AND d.doc_id>? ORDER BY d.doc_id LIMIT ?",
+                params + (last_id, batch_size)
+            ).fetchall()
+        if not rows:
+            return count
+        for row in rows:
+            index_document(row["doc_id"], row["user_id"], text_store.decode(row["codec"], row["body"]) or "")
+            count += 1
+        last_id = rows[-1]["doc_id"]
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Semantic index maintenance")
+    parser.add_argument("command", choices=["reindex"])
+    parser.add_argument("--user-id", type=int)
+    args = parser.parse_args()
+
+    if not enabled():
+        parser.error("set EMBEDDING_BACKEND first (openai, local or hashing)")
+    if args.command == "reindex":
+        print(f"Indexed {reindex(args.user_id)} documents with {get_backend().name}")
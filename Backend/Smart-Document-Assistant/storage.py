@@ -0,0 +1,346 @@
+# storage.py
+"""
+Content-addressed storage for uploaded files.
+An upload is streamed to a temp file while it is hashed, then published under its
+storage key, <sha256[:2]>/<sha256[2:4]>/<sha256>.<ext>. Identical uploads share one
+object and no directory grows past 256 entries per level. The extension is kept
+because the extraction pipeline dispatches on it (PDF/TIFF vs images).
+
+documents.file_path holds the key. The blobs table (see db.py) counts the live
+documents per key through triggers; when a count drops to zero the key is queued in
+file_gc, and the collector deletes the object once it is still unreferenced under
+the database write lock. Uploads therefore insert their row first and publish the
+object after the commit, so the collector never removes a file that a new row
+is about to use.
+
+STORAGE_BACKEND selects where objects live:
+  local  sharded directories under STORAGE_ROOT (default); publish is a rename
+  s3     an S3-compatible bucket (S3_BUCKET, S3_ENDPOINT_URL for MinIO and other
+         stand-ins; needs boto3); a PUT only becomes visible once complete
+Other backends can be added with register_backend().
+
+STORAGE_ROOT also holds the local working files of every backend: temp uploads
+(tmp/), derivatives (derived/) and rendered PDF/TIFF pages (pages/), sharded by
+content hash like the objects. Paths of older databases (uploads/<date>/<name>)
+still resolve as local files until `python storage.py migrate` moves them.
+"""
+import os
+import re
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Callable, Dict, IO, Iterable, Iterator, Tuple
+
+try:
+    import boto3
+except ImportError:  # only needed for STORAGE_BACKEND=s3
+    boto3 = None
+
+# Logger setup
+logger = logging.getLogger("storage")
+logger.setLevel(logging.INFO)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_ROOT = Path(os.getenv("STORAGE_ROOT", "uploads"))
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+TEMP_DIR = STORAGE_ROOT / "tmp"
+
+_KEY_RE = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z0-9]+)?$")
+
+
+def object_key(content_hash: str, filename: str) -> str:
+    """Storage key for content with the given sha256, keeping the file's extension."""
+    suffix = Path(filename).suffix.lower()
+    return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{suffix}"
+
+
+def is_key(path: str) -> bool:
+    """False for the local paths stored by older versions."""
+    return bool(_KEY_RE.match(path or ""))
+
+
+def shard_dir(kind: str, content_hash: str) -> Path:
+    """Local folder for working files derived from a content hash (derived/, pages/)."""
+    return STORAGE_ROOT / kind / content_hash[:2] / content_hash[2:4]
+
+
+# ---------- Backends ----------
+class LocalStorage:
+    """Objects as files under a sharded directory tree."""
+
+    def __init__(self, root: Path = STORAGE_ROOT):
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def publish(self, tmp_path: Path, key: str):
+        dest = self.path(key)
+        if dest.exists():  # same content already stored
+            Path(tmp_path).unlink(missing_ok=True)
+            return
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, dest)
+
+    def open(self, key: str) -> IO[bytes]:
+        return open(self.path(key), "rb")
+
+    @contextmanager
+    def local_path(self, key: str):
+        yield str(self.path(key))
+
+    def exists(self, key: str) -> bool:
+        return self.path(key).exists()
+
+    def delete(self, key: str):
+        self.path(key).unlink(missing_ok=True)
+
+    def iter_objects(self) -> Iterator[Tuple[str, float]]:
+        """(key, modified time) of every stored object."""
+        for path in self.root.glob("[0-9a-f][0-9a-f]/[0-9a-f][0-9a-f]/*"):
+            key = path.relative_to(self.root).as_posix()
+            if is_key(key):
+                try:
+                    yield key, path.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket; reads needing a file go through a temp copy."""
+
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: str = S3_ENDPOINT_URL, prefix: str = S3_PREFIX):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        # Credentials and region come from the usual AWS_* variables or config files
+        self._client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _name(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def publish(self, tmp_path: Path, key: str):
+        try:
+            if not self.exists(key):
+                self._client.upload_file(str(tmp_path), self.bucket, self._name(key))
+        finally:
+            Path(tmp_path).unlink(missing_ok=True)
+
+    def open(self, key: str) -> IO[bytes]:
+        return self._client.get_object(Bucket=self.bucket, Key=self._name(key))["Body"]
+
+    @contextmanager
+    def local_path(self, key: str):
+        tmp = _temp_path(key)
+        try:
+            self._client.download_file(self.bucket, self._name(key), str(tmp))
+            yield str(tmp)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self._name(key))
+            return True
+        except self._client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def delete(self, key: str):
+        self._client.delete_object(Bucket=self.bucket, Key=self._name(key))
+
+    def iter_objects(self) -> Iterator[Tuple[str, float]]:
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                key = obj["Key"][len(self.prefix):]
+                if is_key(key):
+                    yield key, obj["LastModified"].timestamp()
+
+
+_backends: Dict[str, Callable] = {
+    "local": LocalStorage,
+    "s3": S3Storage,
+}
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable):
+    """Make a storage backend selectable via STORAGE_BACKEND=<name>."""
+    _backends[name] = factory
+
+
+def get_backend():
+    """The configured backend, created on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if STORAGE_BACKEND not in _backends:
+                raise ValueError(f"unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+            _backend = _backends[STORAGE_BACKEND]()
+        return _backend
+
+
+def _forget_backend():
+    global _backend, _backend_lock
+    _backend = None  # boto3 clients must not cross a fork
+    _backend_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_backend)
+
+
+# ---------- Writing ----------
+def _temp_path(filename: str) -> Path:
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    return TEMP_DIR / f"{uuid.uuid4().hex}{Path(filename).suffix.lower()}"
+
+
+def save_temp(chunks: Iterable[bytes], filename: str) -> Tuple[Path, str]:
+    """
+    Write chunks to a temp file (named with the file's extension), hashing on the way.
+    Returns (temp path, sha256); the file is removed if the iterator raises.
+    """
+    tmp_path = _temp_path(filename)
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, "wb") as out:
+            for chunk in chunks:
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return tmp_path, digest.hexdigest()
+
+
+def publish(tmp_path: Path, key: str):
+    """Store a finished temp file under its key (consumes the temp file)."""
+    get_backend().publish(Path(tmp_path), key)
+
+
+def discard(tmp_path: Path):
+    """Remove a temp file that was not published."""
+    Path(tmp_path).unlink(missing_ok=True)
+
+
+# ---------- Reading and deleting ----------
+def open_file(key: str) -> IO[bytes]:
+    """Binary stream of a stored file."""
+    if not is_key(key):
+        return open(key, "rb")
+    return get_backend().open(key)
+
+
+@contextmanager
+def local_path(key: str):
+    """A filesystem path with the file's contents, valid inside the block."""
+    if not is_key(key):
+        yield key
+        return
+    with get_backend().local_path(key) as path:
+        yield path
+
+
+@asynccontextmanager
+async def local_path_async(key: str):
+    """local_path for the event loop; a download runs in a worker thread."""
+    context = local_path(key)
+    path = await asyncio.to_thread(context.__enter__)
+    try:
+        yield path
+    finally:
+        await asyncio.to_thread(context.__exit__, None, None, None)
+
+
+def exists(key: str) -> bool:
+    if not key:
+        return False
+    if not is_key(key):
+        return Path(key).exists()
+    return get_backend().exists(key)
+
+
+def delete(key: str):
+    """Delete a stored file (callers check the reference count first)."""
+    if not is_key(key):
+        Path(key).unlink(missing_ok=True)
+        return
+    get_backend().delete(key)
+
+
+# ---------- Migration of older uploads ----------
+def migrate_legacy(batch_size: int = 100) -> dict:
+    """
+    Copy files stored at uploads/<date>/<name> into the configured backend and, once
+    the copy is stored, point their documents at the new key. The old path's reference
+    count then drops to zero, so the collector removes the old file (and its
+    derivatives and page images). A failed copy leaves the documents untouched.
+    """
+    from db import connection
+    import extraction_cache
+
+    counts = {"moved": 0, "missing": 0}
+    last_path = ""
+    while True:
+        with connection() as conn:
+            rows = conn.execute("""
+                SELECT file_path, MAX(content_hash) AS content_hash FROM documents
+                WHERE file_path > ? AND deleted_at IS NULL AND file_path NOT GLOB '[0-9a-f][0-9a-f]/[0-9a-f][0-9a-f]/*'
+                GROUP BY file_path ORDER BY file_path LIMIT ?
+            """, (last_path, batch_size)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            old_path = row["file_path"]
+            if not Path(old_path).exists():
+                counts["missing"] += 1
+                continue
+            content_hash = row["content_hash"] or extraction_cache.file_sha256(old_path)
+            key = object_key(content_hash, old_path)
+            tmp_path = _temp_path(old_path)
+            shutil.copyfile(old_path, tmp_path)
+            try:
+                publish(tmp_path, key)
+            finally:
+                discard(tmp_path)
+            # Repointing the rows queues the old file for deletion, so the copy must exist first
+            if not exists(key):
+                raise RuntimeError(f"{old_path} was not stored as {key}")
+            with connection() as conn:
+                conn.execute(
+                    "UPDATE documents SET file_path=?, content_hash=? WHERE file_path=?",
+                    (key, content_hash, old_path),
+                )
+            # Derivatives and page images are re-created in the sharded folders on demand
+            for kind in ("derived", "pages"):
+                for path in (Path(old_path).parent / kind).glob(f"{content_hash}-*"):
+                    path.unlink(missing_ok=True)
+            counts["moved"] += 1
+        last_path = rows[-1]["file_path"]
+        logger.info(f"Moved {counts['moved']} files to {STORAGE_BACKEND} storage")
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Upload storage maintenance")
+    parser.add_argument("command", choices=["migrate"])
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(migrate_legacy())
+        print("Run `python file_gc.py collect` to remove the old copies.")
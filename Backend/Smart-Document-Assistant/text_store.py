@@ -0,0 +1,84 @@
+# text_store.py
+"""
+Compressed storage for extracted text.
+The full text of a document lives in `document_text` (doc_id, codec, body), not in
+`documents`, so scans over document metadata never read it. Each row names its
+codec, so rows written with different TEXT_CODEC settings can coexist:
+
+  none  UTF-8 bytes (also used for short texts, where compression does not pay)
+  zlib  zlib-compressed UTF-8 (default)
+  zstd  Zstandard-compressed UTF-8 (needs the zstandard package)
+
+Text is decompressed only where a caller asks for it (load/decode), or through the
+SQL function sda_text(codec, body) that db.get_conn() registers on every connection
+(used by the full-text index's content view).
+"""
+import os
+import zlib
+from typing import Iterable, Optional
+
+try:
+    import zstandard
+except ImportError:  # only needed for TEXT_CODEC=zstd or reading zstd rows
+    zstandard = None
+
+TEXT_CODEC = os.getenv("TEXT_CODEC", "zlib")
+TEXT_ZLIB_LEVEL = int(os.getenv("TEXT_ZLIB_LEVEL", "6"))
+TEXT_ZSTD_LEVEL = int(os.getenv("TEXT_ZSTD_LEVEL", "9"))
+# Shorter texts are stored uncompressed
+TEXT_COMPRESS_MIN_BYTES = int(os.getenv("TEXT_COMPRESS_MIN_BYTES", "128"))
+
+SQL_FUNCTION = "sda_text"
+
+
+def encode(text: str, codec: str = TEXT_CODEC):
+    """(codec, body) for storing `text`."""
+    raw = (text or "").encode("utf-8")
+    if len(raw) < TEXT_COMPRESS_MIN_BYTES or codec == "none":
+        return "none", raw
+    if codec == "zlib":
+        return "zlib", zlib.compress(raw, TEXT_ZLIB_LEVEL)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("TEXT_CODEC=zstd requires the zstandard package")
+        return "zstd", zstandard.ZstdCompressor(level=TEXT_ZSTD_LEVEL).compress(raw)
+    raise ValueError(f"unknown TEXT_CODEC {codec!r}")
+
+
+def decode(codec: Optional[str], body: Optional[bytes]) -> Optional[str]:
+    """Text from a stored (codec, body); None if there is no row."""
+    if body is None:
+        return None
+    if codec == "zlib":
+        body = zlib.decompress(body)
+    elif codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("reading zstd-compressed text requires the zstandard package")
+        body = zstandard.ZstdDecompressor().decompress(body)
+    elif codec != "none":
+        raise ValueError(f"unknown text codec {codec!r}")
+    return bytes(body).decode("utf-8")
+
+
+def store(cur, doc_id: int, text: str):
+    """Insert or replace a document's text (an upsert, so the FTS triggers see an UPDATE)."""
+    codec, body = encode(text)
+    cur.execute("""
+        INSERT INTO document_text (doc_id, codec, body) VALUES (?, ?, ?)
+        ON CONFLICT(doc_id) DO UPDATE SET codec=excluded.codec, body=excluded.body
+    """, (doc_id, codec, body))
+
+
+def store_many(cur, rows: Iterable):
+    """Bulk insert of new (doc_id, text) pairs."""
+    cur.executemany(
+        "INSERT INTO document_text (doc_id, codec, body) VALUES (?, ?, ?)",
+        ((doc_id, *encode(text)) for doc_id, text in rows),
+    )
+
+
+def load(cur, doc_id: int) -> Optional[str]:
+    """A document's text, or None if it has none yet."""
+    cur.execute("SELECT codec, body FROM document_text WHERE doc_id=?", (doc_id,))
+    row = cur.fetchone()
+    return decode(row["codec"], row["body"]) if row else None
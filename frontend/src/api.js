@@ -46,12 +46,24 @@ export const uploadDocument = (formData) =>
     headers: { "Content-Type": "multipart/form-data" },
   });
 
-export const getDocuments = () =>
-  api.get(`${API_BASE}/documents`);
+// Status of an upload's extraction job: pending, processing, done, failed or cancelled
+export const getJob = (jobId) =>
+  api.get(`${API_BASE}/jobs/${jobId}`);
+
+// Returns one page of document summaries; the next page's cursor is in the X-Next-Cursor header
+export const getDocuments = (params = {}) =>
+  api.get(`${API_BASE}/documents`, { params });
 
 export const getDocument = (docId) =>
   api.get(`${API_BASE}/document/${docId}`);
 
+// size: "thumbnail" (small, for lists) or "preview"
+export const getThumbnail = (docId, size = "thumbnail") =>
+  api.get(`${API_BASE}/document/${docId}/thumbnail`, {
+    params: { size },
+    responseType: "blob",
+  });
+
 export const exportDocument = (docId) =>
   api.get(`${API_BASE}/export/${docId}`, {
     responseType: "blob",
@@ -1,8 +1,69 @@
-import React, { useState, useRef } from "react";
-import { exportDocument, deleteDocument } from "../api";
+import React, { useState, useRef, useEffect } from "react";
+import { exportDocument, deleteDocument, getThumbnail } from "../api";
 import { toast } from "react-toastify";
 
-const DocumentList = ({ docs, onUpdate }) => {
+// Small WebP rendition of the upload, fetched once the card scrolls into view;
+// falls back to the file icon
+const DocumentThumbnail = ({ docId, title }) => {
+  const [src, setSrc] = useState(null);
+  const [visible, setVisible] = useState(false);
+  const placeholderRef = useRef(null);
+
+  useEffect(() => {
+    const node = placeholderRef.current;
+    if (visible || !node) return;
+    if (!("IntersectionObserver" in window)) {
+      setVisible(true);
+      return;
+    }
+    const observer = new IntersectionObserver(
+      (entries) => {
+        if (entries.some((entry) => entry.isIntersecting)) {
+          setVisible(true);
+          observer.disconnect();
+        }
+      },
+      { rootMargin: "200px" }
+    );
+    observer.observe(node);
+    return () => observer.disconnect();
+  }, [visible]);
+
+  useEffect(() => {
+    if (!visible) return;
+    let url = null;
+    let cancelled = false;
+    getThumbnail(docId)
+      .then((res) => {
+        if (cancelled) return;
+        url = window.URL.createObjectURL(res.data);
+        setSrc(url);
+      })
+      .catch(() => setSrc(null));
+    return () => {
+      cancelled = true;
+      if (url) window.URL.revokeObjectURL(url);
+    };
+  }, [docId, visible]);
+
+  if (!src) {
+    return (
+      <div className="document-icon" ref={placeholderRef}>
+        <i className="bi bi-file-earmark-text"></i>
+      </div>
+    );
+  }
+  return (
+    <img
+      src={src}
+      alt={title || "Document thumbnail"}
+      loading="lazy"
+      style={{ width: "100%", maxHeight: "160px", objectFit: "cover", borderRadius: "8px" }}
+    />
+  );
+};
+
+const DocumentList = ({ docs, onUpdate, hasMore, loadingMore, onLoadMore }) => {
   const [hoveredCard, setHoveredCard] = useState(null);
   const [searchTerm, setSearchTerm] = useState("");
   const fileInputRef = useRef(null); 
@@ -78,7 +139,7 @@ const DocumentList = ({ docs, onUpdate }) => {
         <h4 className="documents-title">Document Collection</h4>
         <div className="documents-count">
           <span className="badge bg-primary">
-            {filteredDocs.length} {filteredDocs.length === 1 ? 'Document' : 'Documents'}
+            {filteredDocs.length}{hasMore ? '+' : ''} {filteredDocs.length === 1 && !hasMore ? 'Document' : 'Documents'}
           </span>
         </div>
       </div>
@@ -159,9 +220,7 @@ const DocumentList = ({ docs, onUpdate }) => {
               onMouseLeave={() => setHoveredCard(null)}
             >
               <div className="card-body">
-                <div className="document-icon">
-                  <i className="bi bi-file-earmark-text"></i>
-                </div>
+                <DocumentThumbnail docId={doc.doc_id} title={doc.title} />
                 <div className="document-date">
                   <i className="bi bi-clock me-1"></i>
                   {doc.upload_date 
@@ -170,7 +229,7 @@ const DocumentList = ({ docs, onUpdate }) => {
                 </div>
                 <h5 className="card-title">{doc.title || "Untitled Document"}</h5>
 
-                {doc.extracted_text ? (
+                {doc.text_preview ? (
                   <div
                     style={{
                       whiteSpace: "pre-wrap",
@@ -184,8 +243,13 @@ const DocumentList = ({ docs, onUpdate }) => {
                       marginTop: "10px"
                     }}
                   >
-                    {doc.extracted_text}
+                    {doc.text_preview}
                   </div>
+                ) : doc.status === "pending" || doc.status === "processing" ? (
+                  <p className="text-muted">
+                    <span className="spinner-border spinner-border-sm me-2" role="status"></span>
+                    Extracting text...
+                  </p>
                 ) : (
                   <p className="text-muted">No text extracted</p>
                 )}
@@ -210,6 +274,28 @@ const DocumentList = ({ docs, onUpdate }) => {
         </div>
       )}
 
+      {hasMore && (
+        <div className="text-center mt-4">
+          <button
+            className="btn btn-outline-primary"
+            onClick={onLoadMore}
+            disabled={loadingMore}
+          >
+            {loadingMore ? (
+              <>
+                <span className="spinner-border spinner-border-sm me-2" role="status"></span>
+                Loading...
+              </>
+            ) : (
+              <>
+                <i className="bi bi-chevron-down me-2"></i>
+                Load more
+              </>
+            )}
+          </button>
+        </div>
+      )}
+
       {/* Hidden file input */}
       <input
         type="file"
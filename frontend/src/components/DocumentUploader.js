@@ -28,8 +28,8 @@ const DocumentUploader = ({ onUpload }) => {
       console.log("Upload response:", response);
       setTitle("");
       setFile(null);
-      toast.success("Document uploaded successfully!");
-      onUpload();
+      toast.success("Document uploaded, extracting text...");
+      onUpload(response.data);
     } catch (err) {
       console.error("Upload error:", err);
       toast.error("Upload failed: " + (err.response?.data?.error || err.message));
@@ -74,7 +74,7 @@ const DocumentUploader = ({ onUpload }) => {
                 <input
                   type="file"
                   id="fileInput"
-                  accept=".jpg,.jpeg,.png"
+                  accept=".jpg,.jpeg,.png,.gif,.pdf,.tif,.tiff"
                   onChange={(e) => setFile(e.target.files[0])}
                   disabled={isUploading}
                   style={{ display: 'none' }}
@@ -98,12 +98,14 @@ const DocumentUploader = ({ onUpload }) => {
                           Drop your file here or <span className="text-primary">browse</span>
                         </h5>
                         <p className="text-muted mb-3">
-                          Supports JPG, PNG • Maximum size 5MB
+                          Supports JPG, PNG, PDF, TIFF • Maximum size 20MB
                         </p>
                         <div className="supported-formats">
                           <span className="format-badge">JPG</span>
                           <span className="format-badge">PNG</span>
-                          <span className="format-badge">≤ 5MB</span>
+                          <span className="format-badge">PDF</span>
+                          <span className="format-badge">TIFF</span>
+                          <span className="format-badge">≤ 20MB</span>
                         </div>
                       </>
                     )}
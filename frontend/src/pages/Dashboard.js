@@ -1,17 +1,32 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import DocumentUploader from "../components/DocumentUploader";
 import DocumentList from "../components/DocumentList";
-import { getDocuments, getUserProfile, deleteCurrentUser } from "../api";
+import { getDocuments, getDocument, getJob, getUserProfile, deleteCurrentUser } from "../api";
 import { toast } from "react-toastify";
 
+// Documents fetched per request; further pages are loaded on demand
+const PAGE_SIZE = 50;
+// How often an upload's job is polled until its text is extracted
+const JOB_POLL_MS = 1500;
+
 const Dashboard = ({ user, setUser, onLogout }) => {
   const [docs, setDocs] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [showDropdown, setShowDropdown] = useState(false);
   const [activeTab, setActiveTab] = useState('overview');
   const [searchTerm, setSearchTerm] = useState("");
   const navigate = useNavigate();
+  const mounted = useRef(true);
+
+  useEffect(() => {
+    mounted.current = true;
+    return () => {
+      mounted.current = false;
+    };
+  }, []);
 
   useEffect(() => {
     if (!user) {
@@ -34,10 +49,12 @@ const Dashboard = ({ user, setUser, onLogout }) => {
     };
   }, [showDropdown]);
 
+  // First page of the newest documents
   const loadDocs = async () => {
     try {
-      const res = await getDocuments();
+      const res = await getDocuments({ limit: PAGE_SIZE });
       setDocs(res.data);
+      setNextCursor(res.headers["x-next-cursor"] || null);
     } catch (err) {
       console.error("Error loading documents:", err);
       toast.error("Failed to load documents");
@@ -46,6 +63,57 @@ const Dashboard = ({ user, setUser, onLogout }) => {
     }
   };
 
+  const loadMoreDocs = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const res = await getDocuments({ limit: PAGE_SIZE, cursor: nextCursor });
+      setDocs((prev) => prev.concat(res.data));
+      setNextCursor(res.headers["x-next-cursor"] || null);
+    } catch (err) {
+      console.error("Error loading documents:", err);
+      toast.error("Failed to load more documents");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // Poll the upload's job until the worker is done, then refresh that one row
+  const watchJob = async ({ job_id: jobId, doc_id: docId }) => {
+    while (mounted.current) {
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_MS));
+      let job;
+      try {
+        job = (await getJob(jobId)).data;
+      } catch (err) {
+        console.error("Error polling job:", err);
+        return;
+      }
+      if (job.status === "pending" || job.status === "processing") continue;
+
+      if (job.status === "done") {
+        try {
+          const { data: doc } = await getDocument(docId);
+          if (!mounted.current) return;
+          const summary = { title: doc.title, status: doc.status, text_preview: doc.text_preview };
+          setDocs((prev) => prev.map((d) => (d.doc_id === docId ? { ...d, ...summary } : d)));
+          toast.success(`Text extracted from "${doc.title}"`);
+        } catch (err) {
+          console.error("Error loading document:", err);
+        }
+      } else if (mounted.current) {
+        setDocs((prev) => prev.map((d) => (d.doc_id === docId ? { ...d, status: job.status } : d)));
+        if (job.status === "failed") toast.error("Extraction failed: " + (job.error || "unknown error"));
+      }
+      return;
+    }
+  };
+
+  const handleUpload = async (upload) => {
+    await loadDocs();
+    if (upload?.job_id) watchJob(upload);
+  };
+
   const handleDeleteAccount = async () => {
     const confirmDelete = window.confirm(
       "Are you sure you want to permanently delete your account? This action cannot be undone and will delete all your documents."
@@ -392,13 +460,19 @@ const Dashboard = ({ user, setUser, onLogout }) => {
 
             {activeTab === 'upload' && (
               <div className="upload-tab">
-                <DocumentUploader onUpload={loadDocs} />
+                <DocumentUploader onUpload={handleUpload} />
               </div>
             )}
 
             {activeTab === 'documents' && (
               <div className="documents-tab">
-                <DocumentList docs={docs} onUpdate={loadDocs} />
+                <DocumentList
+                  docs={docs}
+                  onUpdate={loadDocs}
+                  hasMore={Boolean(nextCursor)}
+                  loadingMore={loadingMore}
+                  onLoadMore={loadMoreDocs}
+                />
               </div>
             )}
           </div>